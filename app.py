@@ -4,7 +4,6 @@ Entrypoint for Gradio, see https://gradio.app/
 
 import platform
 import asyncio
-import base64
 import os
 import json
 from datetime import datetime
@@ -15,8 +14,11 @@ from typing import cast, Dict
 from collections import defaultdict
 import time
 import logging
+import uuid
 
 import gradio as gr
+import uvicorn
+from fastapi import FastAPI, Request, Response
 from anthropic import APIResponse
 from anthropic.types import TextBlock
 from anthropic.types.beta import BetaMessage, BetaTextBlock, BetaToolUseBlock
@@ -34,19 +36,25 @@ from computer_use_demo.loop import (
     sampling_loop_sync,
 )
 
+from computer_use_demo.blobs import as_bytes, get_blob_store
+from computer_use_demo.conversation import Conversation
+from computer_use_demo.events import get_event_bus
+from computer_use_demo.media import MEDIA_PATH, MediaLibrary
+from computer_use_demo.render import ChatRenderer
+from computer_use_demo.sessions import SessionBusyError, get_session_manager
 from computer_use_demo.tools import ToolResult
 from computer_use_demo.tools.computer import get_screen_details
 from computer_use_demo.autopc.actor.gpt4_actor import GPT4Actor
 from computer_use_demo.autopc.actor.anthropic_actor import AnthropicActor
 from computer_use_demo.autopc.actor.base import APIProvider
 from computer_use_demo.auth.auth_manager import AuthManager
+from computer_use_demo.auth.session_store import session_store_from_env
 
 CONFIG_DIR = Path("~/.anthropic").expanduser()
 API_KEY_FILE = CONFIG_DIR / "api_key"
 
 WARNING_TEXT = "⚠️ Security Alert: Never provide access to sensitive accounts or data, as malicious web content can hijack Claude's behavior"
 
-SELECTED_SCREEN_INDEX = None
 SCREEN_NAMES = None
 
 class Sender(StrEnum):
@@ -55,11 +63,22 @@ class Sender(StrEnum):
     TOOL = "tool"
 
 # Initialize auth manager
-auth_manager = AuthManager()
+auth_manager = AuthManager(store=session_store_from_env())
 
 def setup_state(state):
     if "messages" not in state:
-        state["messages"] = []
+        state["messages"] = Conversation()
+    if "renderer" not in state:
+        # renders each message once; the chat references screenshots by URL
+        state["renderer"] = ChatRenderer()
+    if "session_id" not in state:
+        # sessions queue fairly against each other for the account's rate limits
+        state["session_id"] = uuid.uuid4().hex
+    if "session" not in state:
+        # per-session settings (e.g. the screen) and the running loop's cancel flag
+        state["session"] = get_session_manager().open(
+            state["session_id"], user=state.get("user", "anonymous")
+        )
     if "api_key" not in state:
         # Try to load API key from file first, then environment
         state["api_key"] = load_from_storage("api_key") or os.getenv("ANTHROPIC_API_KEY", "")
@@ -173,7 +192,7 @@ def _render_message(sender: Sender, message: str | BetaTextBlock | BetaToolUseBl
         if message.error:
             return f"Error: {message.error}"
         if message.base64_image and not state["hide_images"]:
-            return base64.b64decode(message.base64_image)
+            return as_bytes(message.base64_image)
     elif isinstance(message, BetaTextBlock) or isinstance(message, TextBlock):
         return message.text
     elif isinstance(message, BetaToolUseBlock) or isinstance(message, ToolUseBlock):
@@ -182,7 +201,7 @@ def _render_message(sender: Sender, message: str | BetaTextBlock | BetaToolUseBl
         return message
 # open new tab, open google sheets inside, then create a new blank spreadsheet
 
-def process_input(user_input, state):
+async def process_input(user_input, state):
     # Ensure the state is properly initialized
     setup_state(state)
 
@@ -194,33 +213,37 @@ def process_input(user_input, state):
         }
     )
 
-    # Run the sampling loop synchronously and yield messages
-    for message in yield_message(state):
+    # Run the sampling loop on the session manager's pool and yield messages
+    async for message in yield_message(state):
         yield message
 
 
-def accumulate_messages(*args, **kwargs):
+def accumulate_messages(*args, renderer: ChatRenderer, selected_screen: int, **kwargs):
     """
-    Wrapper function to accumulate messages from sampling_loop_sync.
+    Wrapper function to accumulate messages from sampling_loop_sync. The renderer
+    adds each message's row once, so every update only appends what is new.
     """
-    accumulated_messages = []
-    global SELECTED_SCREEN_INDEX    
-    print(f"Selected screen: {SELECTED_SCREEN_INDEX}")
-    for message in sampling_loop_sync(*args, selected_screen=SELECTED_SCREEN_INDEX, **kwargs):
-        # Check if the message is already in the accumulated messages
-        if message not in accumulated_messages:
-            accumulated_messages.append(message)
-            # Yield the accumulated messages as a list
-            yield accumulated_messages
-
-
-def yield_message(state):
+    logging.info("Selected screen: %s", selected_screen)
+    for _ in sampling_loop_sync(
+        *args, selected_screen=selected_screen, renderer=renderer, **kwargs
+    ):
+        yield renderer.rows
+
+
+async def yield_message(state):
     # Ensure the API key is present
     if not state.get("api_key"):
         raise ValueError("API key is missing. Please set it in the environment or storage.")
 
-    # Call the sampling loop and yield messages
-    for message in accumulate_messages(
+    session = state["session"]
+    # Reuse one set of tools (bash session, edit history, ...) for the whole session,
+    # on a display of its own when the manager isolates sessions
+    state["tool_registry"] = await get_session_manager().tools(
+        session, workspace_root=os.getenv("WORKSPACE_ROOT")
+    )
+
+    steps = partial(
+        accumulate_messages,
         system_prompt_suffix=state["custom_system_prompt"],
         model=state["model"],
         provider=state["provider"],
@@ -230,10 +253,32 @@ def yield_message(state):
         api_response_callback=partial(_api_response_callback, response_state=state["responses"]),
         api_key=state["api_key"],
         only_n_most_recent_images=state["only_n_most_recent_images"],
+        tool_registry=state["tool_registry"],
+        session_id=state["session_id"],
+        event_bus=get_event_bus(),
+        renderer=state["renderer"],
+        selected_screen=session.selected_screen,
+    )
+    # the loop runs on the manager's threads and stops when the session is cancelled
+    async for message in get_session_manager().run(
+        session, lambda cancel_event: steps(cancel_event=cancel_event)
     ):
         yield message
 
 
+async def close_session(state):
+    """End the session: its loop, tools and display."""
+    if "session_id" in state:
+        await get_session_manager().aclose(state["session_id"])
+    state.clear()
+
+
+async def cancel_session(state):
+    """Stop the session's running loop right away."""
+    if "session_id" in state:
+        get_session_manager().cancel(state["session_id"])
+
+
 def create_interface():
     with gr.Blocks() as demo:
         # Login state
@@ -270,27 +315,47 @@ def create_interface():
                 label="Type your command...",
                 placeholder="Enter a command to control your computer"
             )
+            stop_btn = gr.Button("Stop")
+            logout_btn = gr.Button("Logout")
 
         def handle_login(username, password):
             token = auth_manager.login(username, password)
             if token:
                 return {
-                    "token": token
+                    "token": token,
+                    "user": username,
                 }, gr.Row.update(visible=False), gr.Row.update(visible=True), ""
             return None, None, None, "Invalid login. Try: test/test123"
 
-        def process_message(message, state, auth_state):
+        async def handle_logout(state, auth_state):
+            auth_manager.logout(auth_state.get("token"))
+            await close_session(state)
+            return {"token": None}, state, gr.Row.update(visible=True), gr.Row.update(visible=False)
+
+        async def process_message(message, state, auth_state):
             if not auth_manager.verify_token(auth_state.get("token")):
                 raise gr.Error("Please login first")
-                
+            state.setdefault("user", auth_state.get("user", "anonymous"))
+            setup_state(state)
+
             # Your existing message processing logic here
             if provider.value == APIProvider.GPT4.value:
                 actor = GPT4Actor(api_key.value)
             else:
                 actor = AnthropicActor(api_key.value)
-                
-            response = actor([{"role": "user", "content": message}])
-            return response.content
+
+            # the request counts against the user's limits, and the stop button ends it
+            try:
+                responses = [
+                    response
+                    async for response in get_session_manager().run(
+                        state["session"],
+                        lambda cancel_event: iter([actor([{"role": "user", "content": message}])]),
+                    )
+                ]
+            except SessionBusyError:
+                raise gr.Error("Still working on the previous command; stop it first")
+            return responses[-1].content if responses else gr.skip()
 
         # Connect components
         login_btn.click(
@@ -304,9 +369,38 @@ def create_interface():
             inputs=[chat_input, state, auth_state],
             outputs=[chatbot]
         )
+        stop_btn.click(cancel_session, inputs=[state], queue=False)
+        logout_btn.click(
+            handle_logout,
+            inputs=[state, auth_state],
+            outputs=[auth_state, state, login_block, main_block]
+        )
+
+    # handlers are async and agent loops run on the session manager's pool, so the
+    # queue can admit many more events than there are threads
+    demo.queue(default_concurrency_limit=int(os.getenv("GRADIO_CONCURRENCY_LIMIT", "64")))
 
     return demo
 
+_media = MediaLibrary(blob_store=get_blob_store())
+
+
+async def serve_media(request: Request) -> Response:
+    """Screenshots of the chat, by content hash, and their thumbnails (`?size=`)."""
+    target = request.url.path + (f"?{request.url.query}" if request.url.query else "")
+    media = await asyncio.to_thread(
+        _media.respond, request.method, target, dict(request.headers)
+    )
+    return Response(content=media.body, status_code=media.status, headers=media.headers)
+
+
 if __name__ == "__main__":
     demo = create_interface()
-    demo.launch()
+    app = FastAPI()
+    app.add_api_route(MEDIA_PATH + "/{key}", serve_media, methods=["GET", "HEAD"])
+    app = gr.mount_gradio_app(app, demo, path="/")
+    uvicorn.run(
+        app,
+        host=os.getenv("GRADIO_SERVER_NAME", "127.0.0.1"),
+        port=int(os.getenv("GRADIO_SERVER_PORT", "7860")),
+    )
@@ -1,26 +1,38 @@
-from typing import Dict, Optional
+from typing import Optional
 import hashlib
 import time
 import secrets
 
+from .session_store import MemorySessionStore, SessionStore
+
 class AuthManager:
-    def __init__(self):
+    def __init__(self, store: Optional[SessionStore] = None, purge_interval: float = 300.0):
         self.secret_key = secrets.token_hex(16)
         # Default test user
         self._users = {
             "test": self._hash_password("test123")
         }
-        self._sessions: Dict[str, float] = {}
+        # 1 hour sessions, extended on use; pass a shared store to run several workers
+        self.store = store if store is not None else MemorySessionStore(ttl=3600)
+        self.purge_interval = purge_interval
+        self._last_purge = time.time()
         
     def login(self, username: str, password: str) -> Optional[str]:
         if username in self._users and self._users[username] == self._hash_password(password):
             token = secrets.token_hex(16)
-            self._sessions[token] = time.time() + 3600  # 1 hour
+            self.store.create(token, username)
+            if time.time() - self._last_purge > self.purge_interval:
+                self._last_purge = time.time()
+                self.store.purge_expired()
             return token
         return None
         
-    def verify_token(self, token: str) -> bool:
-        return token in self._sessions and self._sessions[token] > time.time()
+    def logout(self, token: str | None):
+        if token:
+            self.store.delete(token)
+
+    def verify_token(self, token: str | None) -> bool:
+        return bool(token) and self.store.get(token) is not None
         
     def _hash_password(self, password: str) -> str:
         return hashlib.sha256(f"{password}{self.secret_key}".encode()).hexdigest() 
\ No newline at end of file
@@ -0,0 +1,235 @@
+"""
+Where login sessions live. `MemorySessionStore` serves a single process;
+`SQLiteSessionStore` shares sessions between app workers through one database file.
+"""
+import hashlib
+import heapq
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+
+@dataclass
+class SessionRecord:
+    user: str
+    expires: float
+
+
+class SessionStore(ABC):
+    """
+    Tokens mapped to the user they were issued to and when they expire. `get` answers
+    from a single keyed lookup; with a `sliding` lifetime it also pushes the expiry out
+    to `ttl` from now, at most once every `touch_interval` seconds so that most lookups
+    stay reads.
+    """
+
+    def __init__(self, ttl: float = 3600.0, sliding: bool = True, touch_interval: float = 60.0):
+        self.ttl = ttl
+        self.sliding = sliding
+        self.touch_interval = touch_interval
+
+    @abstractmethod
+    def create(self, token: str, user: str, now: float | None = None) -> SessionRecord:
+        ...
+
+    @abstractmethod
+    def get(self, token: str, now: float | None = None) -> SessionRecord | None:
+        """The token's session if it has not expired, extended if the lifetime slides."""
+
+    @abstractmethod
+    def delete(self, token: str):
+        ...
+
+    @abstractmethod
+    def purge_expired(self, now: float | None = None) -> int:
+        """Drop every expired session; returns how many there were."""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def close(self):
+        pass
+
+    def _touched(self, record: SessionRecord, now: float) -> float | None:
+        """The new expiry for a session looked up at `now`, if it should move."""
+        if not self.sliding:
+            return None
+        expires = now + self.ttl
+        return expires if expires - record.expires >= self.touch_interval else None
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Sessions in a dict, with their expiries in a min-heap so expired ones are found
+    without scanning. Creating a session drops those that have expired since.
+
+    A slid expiry leaves the old heap entry behind; entries that no longer match the
+    session's expiry are skipped when they come up.
+    """
+
+    def __init__(self, ttl: float = 3600.0, sliding: bool = True, touch_interval: float = 60.0):
+        super().__init__(ttl, sliding, touch_interval)
+        self._sessions: dict[str, SessionRecord] = {}
+        self._expiries: list[tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def create(self, token: str, user: str, now: float | None = None) -> SessionRecord:
+        now = time.time() if now is None else now
+        record = SessionRecord(user, now + self.ttl)
+        with self._lock:
+            self._purge(now)
+            self._sessions[token] = record
+            heapq.heappush(self._expiries, (record.expires, token))
+        return record
+
+    def get(self, token: str, now: float | None = None) -> SessionRecord | None:
+        record = self._sessions.get(token)
+        if record is None:
+            return None
+        now = time.time() if now is None else now
+        if record.expires <= now:
+            return None
+        expires = self._touched(record, now)
+        if expires is not None:
+            with self._lock:
+                if self._sessions.get(token) is record:
+                    record.expires = expires
+                    heapq.heappush(self._expiries, (expires, token))
+        return record
+
+    def delete(self, token: str):
+        with self._lock:
+            # its heap entries go stale and are skipped
+            self._sessions.pop(token, None)
+
+    def purge_expired(self, now: float | None = None) -> int:
+        with self._lock:
+            return self._purge(time.time() if now is None else now)
+
+    def _purge(self, now: float) -> int:
+        purged = 0
+        while self._expiries and self._expiries[0][0] <= now:
+            expires, token = heapq.heappop(self._expiries)
+            record = self._sessions.get(token)
+            if record is not None and record.expires == expires:
+                del self._sessions[token]
+                purged += 1
+        return purged
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions in an SQLite database in WAL mode, so any number of worker processes can
+    read them while one writes. Each thread has its own connection. Tokens are stored
+    as SHA-256 digests, so the file does not hold anything that could be replayed.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = 3600.0,
+        sliding: bool = True,
+        touch_interval: float = 60.0,
+        busy_timeout: float = 5.0,
+    ):
+        super().__init__(ttl, sliding, touch_interval)
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._connection().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                token_hash BLOB PRIMARY KEY,
+                user TEXT NOT NULL,
+                expires REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires);
+            """
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            # a crash may lose the last logins, never corrupt the file
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def create(self, token: str, user: str, now: float | None = None) -> SessionRecord:
+        now = time.time() if now is None else now
+        record = SessionRecord(user, now + self.ttl)
+        self._connection().execute(
+            "INSERT OR REPLACE INTO sessions (token_hash, user, expires) VALUES (?, ?, ?)",
+            (self._key(token), user, record.expires),
+        )
+        return record
+
+    def get(self, token: str, now: float | None = None) -> SessionRecord | None:
+        now = time.time() if now is None else now
+        key = self._key(token)
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT user, expires FROM sessions WHERE token_hash = ? AND expires > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        record = SessionRecord(*row)
+        expires = self._touched(record, now)
+        if expires is not None:
+            connection.execute(
+                "UPDATE sessions SET expires = max(expires, ?) WHERE token_hash = ?", (expires, key)
+            )
+            record.expires = expires
+        return record
+
+    def delete(self, token: str):
+        self._connection().execute("DELETE FROM sessions WHERE token_hash = ?", (self._key(token),))
+
+    def purge_expired(self, now: float | None = None) -> int:
+        now = time.time() if now is None else now
+        return self._connection().execute("DELETE FROM sessions WHERE expires <= ?", (now,)).rowcount
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT count(*) FROM sessions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+
+def session_store_from_env() -> SessionStore:
+    """
+    `SESSION_STORE=sqlite:///path/to/sessions.db` shares sessions between workers; by
+    default they are kept in memory. `SESSION_TTL` is the lifetime in seconds (default
+    3600), extended on use unless `SESSION_SLIDING=0`.
+    """
+    ttl = float(os.getenv("SESSION_TTL", "3600"))
+    sliding = os.getenv("SESSION_SLIDING", "1") != "0"
+    url = os.getenv("SESSION_STORE", "memory")
+    if url.startswith("sqlite://"):
+        return SQLiteSessionStore(url.removeprefix("sqlite://"), ttl=ttl, sliding=sliding)
+    if url != "memory":
+        raise ValueError(f"unknown SESSION_STORE {url!r}")
+    return MemorySessionStore(ttl=ttl, sliding=sliding)
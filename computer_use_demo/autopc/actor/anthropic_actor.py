@@ -3,15 +3,14 @@ Agentic sampling loop that calls the Anthropic API and local implenmentation of
 """
 import asyncio
 import platform
+import queue
 from collections.abc import Callable
+from dataclasses import replace
 from datetime import datetime
 from enum import StrEnum
 from typing import Any, cast
 
-from anthropic import Anthropic, AnthropicBedrock, AnthropicVertex, APIResponse
-from anthropic.types import (
-    ToolResultBlockParam,
-)
+from anthropic import APIResponse
 from anthropic.types.beta import (
     BetaContentBlock,
     BetaContentBlockParam,
@@ -20,16 +19,25 @@ from anthropic.types.beta import (
     BetaMessageParam,
     BetaTextBlockParam,
     BetaToolResultBlockParam,
+    BetaToolUseBlock,
 )
-from anthropic.types import TextBlock
-from anthropic.types.beta import BetaMessage, BetaTextBlock, BetaToolUseBlock
 
-from ...tools import BashTool, ComputerTool, EditTool, ToolCollection, ToolResult
+from ...blobs import materialize
+from ...conversation import filter_to_n_most_recent_images
+from ...event_loop import BackgroundEventLoop, get_background_loop
+from ...payload_cache import MessageEncoder
+from ...request_policy import RequestPolicy, RequestTarget
+from ...scheduler import Priority
+from .compaction import ConversationCompactor, ModelSummarizer
+from .prompt_cache import (
+    PROMPT_CACHING_BETA_FLAG,
+    CacheStats,
+    PromptCacheRequestBuilder,
+)
+from ...tools import ToolRegistry, ToolResult
 
 from PIL import Image
 from io import BytesIO
-import gradio as gr
-from typing import Dict
 
 
 BETA_FLAG = "computer-use-2024-10-22"
@@ -68,8 +76,19 @@ class AnthropicActor:
         max_tokens: int = 4096,
         only_n_most_recent_images: int | None = None,
         selected_screen: int = 0,
+        workspace_root: str | None = None,
+        tool_registry: ToolRegistry | None = None,
+        prompt_caching: bool = True,
+        stream: bool = False,
+        token_budget: int | None = None,
+        summary_model: str | None = None,
+        request_policy: RequestPolicy | None = None,
+        event_loop: BackgroundEventLoop | None = None,
+        session_id: str = "default",
+        priority: Priority = Priority.INTERACTIVE,
     ):
         self.model = model
+        self.stream = stream
         self.provider = provider
         self.system_prompt_suffix = system_prompt_suffix
         self.api_key = api_key
@@ -77,96 +96,172 @@ class AnthropicActor:
         self.max_tokens = max_tokens
         self.only_n_most_recent_images = only_n_most_recent_images
 
-        self.tool_collection = ToolCollection(
-            ComputerTool(selected_screen=selected_screen),
-            BashTool(),
-            EditTool(),
+        # the actor only needs the tool schemas; the executor of the same session
+        # shares this registry and owns the tool state
+        self.tool_registry = tool_registry or ToolRegistry(
+            selected_screen=selected_screen, workspace_root=workspace_root
         )
 
         self.system = (
             f"{SYSTEM_PROMPT}{' ' + system_prompt_suffix if system_prompt_suffix else ''}"
         )
 
-        # Instantiate the appropriate API client based on the provider
-        if provider == APIProvider.ANTHROPIC:
-            self.client = Anthropic(api_key=api_key)
-        elif provider == APIProvider.VERTEX:
-            self.client = AnthropicVertex()
-        elif provider == APIProvider.BEDROCK:
-            self.client = AnthropicBedrock()
+        # Requests, streamed ones and summaries included, are retried with backoff, and
+        # optionally hedged to a fallback provider; they run on the background loop with
+        # the pooled async clients, admitted by the account's shared rate-limit scheduler
+        self.request_policy = request_policy or RequestPolicy(
+            RequestTarget(provider, model, api_key=api_key),
+            session=session_id,
+            priority=priority,
+        )
+        self.event_loop = event_loop or get_background_loop()
+
+        # Past messages are serialized once and their JSON reused on later turns;
+        # Bedrock signs the request body before the transport sees it, so not there
+        providers = {
+            str(getattr(target.provider, "value", target.provider))
+            for target in (self.request_policy.primary, self.request_policy.fallback)
+            if target is not None
+        }
+        self.message_encoder = MessageEncoder() if "bedrock" not in providers else None
+
+        # Stale tool outputs (and, with a summary model, old turns) are compacted
+        # whenever a request would exceed the token budget
+        self.compactor = (
+            ConversationCompactor(
+                budget_tokens=token_budget,
+                summarizer=(
+                    ModelSummarizer(
+                        RequestPolicy(
+                            replace(self.request_policy.primary, model=summary_model),
+                            retry=self.request_policy.retry,
+                            session=self.request_policy.session,
+                            priority=self.request_policy.priority,
+                        ),
+                        event_loop=self.event_loop,
+                    )
+                    if summary_model
+                    else None
+                ),
+            )
+            if token_budget
+            else None
+        )
+
+        # Cache breakpoints on tools, system prompt and recent turns; image pruning is
+        # coordinated by the builder so the cached prefix only changes in chunks
+        self.request_builder = (
+            PromptCacheRequestBuilder(
+                images_to_keep=only_n_most_recent_images,
+                prune_images=filter_to_n_most_recent_images,
+            )
+            if prompt_caching
+            else None
+        )
 
     def __call__(
         self, 
         *,
-        messages: list[BetaMessageParam]
+        messages: list[BetaMessageParam],
+        on_text: Callable[[str], None] | None = None,
+        on_tool_use: Callable[[BetaToolUseBlock], None] | None = None,
     ):
-        if self.only_n_most_recent_images:
-            _maybe_filter_to_n_most_recent_images(messages, self.only_n_most_recent_images)
-
-        # Call the API synchronously
-        raw_response = self.client.beta.messages.with_raw_response.create(
-            max_tokens=self.max_tokens,
-            messages=messages,
-            model=self.model,
-            system=self.system,
-            tools=self.tool_collection.to_params(),
-            betas=["computer-use-2024-10-22"],
-        )
+        """
+        Sample the next assistant message. In streaming mode, `on_text` receives text
+        deltas as they arrive and `on_tool_use` each tool_use block as soon as its input
+        is complete; the returned message is the same as in non-streaming mode.
+        """
+        if self.compactor:
+            self.compactor.compact(
+                messages, system=self.system, tools=self.tool_registry.to_params()
+            )
 
-        self.api_response_callback(cast(APIResponse[BetaMessage], raw_response))
+        if self.request_builder:
+            request = self.request_builder.build(
+                system=self.system,
+                tools=self.tool_registry.to_params(),
+                messages=messages,
+            )
+            betas = [BETA_FLAG, PROMPT_CACHING_BETA_FLAG]
+        else:
+            if self.only_n_most_recent_images:
+                filter_to_n_most_recent_images(messages, self.only_n_most_recent_images)
+            request = {
+                "system": self.system,
+                "tools": self.tool_registry.to_params(),
+                "messages": messages,
+            }
+            betas = [BETA_FLAG]
+
+        # history holds image handles; base64 only exists for the duration of the request
+        if self.message_encoder:
+            request["messages"] = self.message_encoder.encode(request["messages"])
+        else:
+            request["messages"] = materialize(request["messages"])
 
-        # from IPython.core.debugger import Pdb
-        # Pdb().set_trace()
+        if self.stream:
+            response = self._stream(request, betas, on_text, on_tool_use)
+        else:
+            # Call the API synchronously, under the retry/hedging policy
+            raw_response = self.event_loop.run(
+                self.request_policy.create(
+                    max_tokens=self.max_tokens,
+                    betas=betas,
+                    **request,
+                )
+            )
 
-        response = raw_response.parse()
+            self.api_response_callback(cast(APIResponse[BetaMessage], raw_response))
 
-        return response
+            # from IPython.core.debugger import Pdb
+            # Pdb().set_trace()
+
+            response = raw_response.parse()
 
+        if self.request_builder:
+            self.request_builder.record_usage(response.usage)
 
-def _maybe_filter_to_n_most_recent_images(
-    messages: list[BetaMessageParam],
-    images_to_keep: int,
-    min_removal_threshold: int = 10,
-):
-    """
-    With the assumption that images are screenshots that are of diminishing value as
-    the conversation progresses, remove all but the final `images_to_keep` tool_result
-    images in place, with a chunk of min_removal_threshold to reduce the amount we
-    break the implicit prompt cache.
-    """
-    if images_to_keep is None:
-        return messages
-
-    tool_result_blocks = cast(
-        list[ToolResultBlockParam],
-        [
-            item
-            for message in messages
-            for item in (
-                message["content"] if isinstance(message["content"], list) else []
+        return response
+
+    def _stream(
+        self,
+        request: dict[str, Any],
+        betas: list[str],
+        on_text: Callable[[str], None] | None,
+        on_tool_use: Callable[[BetaToolUseBlock], None] | None,
+    ) -> BetaMessage:
+        # the stream is read on the background loop, under the retry policy; its
+        # events are handled here, so slow callbacks do not hold up the loop
+        events: queue.SimpleQueue = queue.SimpleQueue()
+        future = self.event_loop.submit(
+            self.request_policy.stream(
+                on_event=events.put,
+                max_tokens=self.max_tokens,
+                betas=betas,
+                **request,
             )
-            if isinstance(item, dict) and item.get("type") == "tool_result"
-        ],
-    )
-
-    total_images = sum(
-        1
-        for tool_result in tool_result_blocks
-        for content in tool_result.get("content", [])
-        if isinstance(content, dict) and content.get("type") == "image"
-    )
-
-    images_to_remove = total_images - images_to_keep
-    # for better cache behavior, we want to remove in chunks
-    images_to_remove -= images_to_remove % min_removal_threshold
-
-    for tool_result in tool_result_blocks:
-        if isinstance(tool_result.get("content"), list):
-            new_content = []
-            for content in tool_result.get("content", []):
-                if isinstance(content, dict) and content.get("type") == "image":
-                    if images_to_remove > 0:
-                        images_to_remove -= 1
-                        continue
-                new_content.append(content)
-            tool_result["content"] = new_content
\ No newline at end of file
+        )
+        future.add_done_callback(lambda _: events.put(None))
+        try:
+            while (event := events.get()) is not None:
+                if event.type == "text" and on_text:
+                    on_text(event.text)
+                elif (
+                    event.type == "content_block_stop"
+                    and event.content_block.type == "tool_use"
+                    and on_tool_use
+                ):
+                    # the input JSON is complete; the tool can run while we keep reading
+                    on_tool_use(cast(BetaToolUseBlock, event.content_block))
+            raw_response = future.result()
+        finally:
+            # a callback raised, or the caller went away; stop reading
+            future.cancel()
+
+        self.api_response_callback(cast(APIResponse[BetaMessage], raw_response))
+        return raw_response.parse()
+
+    @property
+    def cache_stats(self) -> CacheStats | None:
+        """Cumulative prompt-cache read/creation token counts for this actor."""
+        return self.request_builder.stats if self.request_builder else None
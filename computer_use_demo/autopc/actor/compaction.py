@@ -0,0 +1,285 @@
+"""
+Keeps each request under a token budget by compacting old turns of the conversation
+in place: stale tool outputs and narration become short stubs, and, with a summarizer,
+a run of old turns can be collapsed into one summary.
+"""
+import json
+import logging
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
+
+from anthropic.types.beta import BetaMessageParam
+
+from ...conversation import Conversation
+from ...event_loop import BackgroundEventLoop, get_background_loop
+from ...tokens import as_dict, message_tokens, text_tokens
+
+if TYPE_CHECKING:
+    from ...request_policy import RequestPolicy
+
+logger = logging.getLogger(__name__)
+
+ELIDED_MARKER = "[compacted:"
+SUMMARY_PREFIX = "Summary of the earlier steps of this task:\n"
+SUMMARY_PROMPT = """\
+Summarize the following transcript of a computer-use agent session in a few short \
+paragraphs. Keep the task, every decision and its outcome, file paths, commands, \
+values the agent will need later, and anything still unresolved. Omit pleasantries.
+
+<transcript>
+{transcript}
+</transcript>"""
+
+Summarizer = Callable[[list[BetaMessageParam]], str]
+
+
+def render_transcript(messages: list[BetaMessageParam]) -> str:
+    """Plain-text rendering of `messages` for a summarizer; images are left out."""
+    lines = []
+    for message in messages:
+        content = message["content"]
+        for block in [content] if isinstance(content, str) else content:
+            if isinstance(block, str):
+                lines.append(f"{message['role']}: {block}")
+                continue
+            block = as_dict(block)
+            if block["type"] == "text":
+                lines.append(f"{message['role']}: {block['text']}")
+            elif block["type"] == "tool_use":
+                lines.append(f"tool call {block['name']}: {json.dumps(block['input'])}")
+            elif block["type"] == "tool_result":
+                items = block.get("content", "")
+                if isinstance(items, str):
+                    items = [{"type": "text", "text": items}]
+                texts = [item["text"] for item in items if item.get("type") == "text"]
+                images = sum(1 for item in items if item.get("type") == "image")
+                result = "\n".join(texts) + (" [screenshot]" * images)
+                lines.append(f"tool result: {result}")
+    return "\n".join(lines)
+
+
+class ModelSummarizer:
+    """
+    Summarizes old turns with a separate, cheaper model call: the model of
+    `request_policy`'s target, under its retries and the account's rate limits.
+    """
+
+    def __init__(
+        self,
+        request_policy: "RequestPolicy",
+        event_loop: BackgroundEventLoop | None = None,
+        max_tokens: int = 1024,
+    ):
+        self.request_policy = request_policy
+        self.event_loop = event_loop or get_background_loop()
+        self.max_tokens = max_tokens
+
+    def __call__(self, messages: list[BetaMessageParam]) -> str:
+        prompt = SUMMARY_PROMPT.format(transcript=render_transcript(messages))
+        raw_response = self.event_loop.run(
+            self.request_policy.create(
+                max_tokens=self.max_tokens,
+                messages=[{"role": "user", "content": prompt}],
+            )
+        )
+        response = raw_response.parse()
+        return "".join(block.text for block in response.content if block.type == "text")
+
+
+@dataclass
+class CompactionReport:
+    tokens_before: int = 0
+    tokens_after: int = 0
+    stubbed_blocks: int = 0
+    collapsed_messages: int = 0
+    decisions: list[str] = field(default_factory=list)
+
+    @property
+    def compacted(self) -> bool:
+        return bool(self.stubbed_blocks or self.collapsed_messages)
+
+
+class ConversationCompactor:
+    """
+    Runs before every actor call. Once the estimated request exceeds `budget_tokens`,
+    it compacts down to `target_ratio` of the budget, so that the cached prompt prefix
+    changes in occasional chunks rather than on every turn. It walks the history oldest
+    first, leaving the last `keep_recent_messages` alone:
+
+    * tool results are cut down to their first `stub_chars` characters of text, and
+      their images are dropped;
+    * longer assistant narration is cut down the same way.
+
+    tool_use blocks are never touched, so every tool_result keeps its partner. If the
+    history is still above that target and a `summarizer` is configured, the oldest turns
+    after the first user message are collapsed into a summary appended to that message.
+    """
+
+    def __init__(
+        self,
+        budget_tokens: int,
+        keep_recent_messages: int = 6,
+        stub_chars: int = 200,
+        summarizer: Summarizer | None = None,
+        target_ratio: float = 0.75,
+    ):
+        self.budget_tokens = budget_tokens
+        self.target_tokens = int(budget_tokens * target_ratio)
+        self.keep_recent_messages = keep_recent_messages
+        self.stub_chars = stub_chars
+        self.summarizer = summarizer
+
+    def compact(
+        self,
+        messages: list[BetaMessageParam],
+        *,
+        system: str = "",
+        tools: list[dict[str, Any]] = (),
+    ) -> CompactionReport:
+        """Compact `messages` in place and report what was done."""
+        fixed = text_tokens(system) + (text_tokens(json.dumps(list(tools))) if tools else 0)
+        sizes = [message_tokens(message) for message in messages]
+        total = fixed + sum(sizes)
+        report = CompactionReport(tokens_before=total, tokens_after=total)
+        if total <= self.budget_tokens:
+            return report
+
+        stale = max(0, len(messages) - self.keep_recent_messages)
+        for i in range(stale):
+            if total <= self.target_tokens:
+                break
+            stubbed = self._stub_message(messages, i, report)
+            if stubbed:
+                size = message_tokens(messages[i])
+                total -= sizes[i] - size
+                sizes[i] = size
+
+        if total > self.target_tokens and self.summarizer:
+            total -= self._collapse(messages, sizes, stale, report)
+
+        report.tokens_after = total
+        logger.info(
+            "compacted conversation from %d to %d estimated tokens (budget %d): "
+            "%d blocks stubbed, %d messages collapsed",
+            report.tokens_before,
+            report.tokens_after,
+            self.budget_tokens,
+            report.stubbed_blocks,
+            report.collapsed_messages,
+        )
+        if total > self.budget_tokens:
+            logger.warning(
+                "conversation is still %d tokens over its budget of %d after compaction",
+                total - self.budget_tokens,
+                self.budget_tokens,
+            )
+        return report
+
+    def _stub(self, text: str) -> str:
+        if len(text) <= self.stub_chars or ELIDED_MARKER in text:
+            return text
+        elided = len(text) - self.stub_chars
+        return f"{text[: self.stub_chars]}\n{ELIDED_MARKER} {elided} characters elided]"
+
+    def _stub_message(
+        self, messages: list[BetaMessageParam], i: int, report: CompactionReport
+    ) -> bool:
+        message = messages[i]
+        if not isinstance(message["content"], list):
+            return False
+        changed = False
+        content = []
+        for block in message["content"]:
+            data = as_dict(block)
+            if data.get("type") == "tool_result" and isinstance(data.get("content"), list):
+                items = data["content"]
+                text = "\n".join(c["text"] for c in items if c.get("type") == "text")
+                images = sum(1 for c in items if c.get("type") == "image")
+                stub = self._stub(text)
+                if stub != text or images:
+                    if images:
+                        stub += f"\n{ELIDED_MARKER} {images} screenshot(s) removed]"
+                        if isinstance(messages, Conversation):
+                            # or its image count overstates, and pruning takes too many
+                            messages.images.forget(block, images)
+                    data["content"] = [{"type": "text", "text": stub}]
+                    report.stubbed_blocks += 1
+                    report.decisions.append(
+                        f"message {i}: stubbed tool_result {data.get('tool_use_id')}"
+                    )
+                    changed = True
+                content.append(data)
+            elif data.get("type") == "text" and message["role"] == "assistant":
+                stub = self._stub(data["text"])
+                if stub != data["text"]:
+                    report.stubbed_blocks += 1
+                    report.decisions.append(f"message {i}: truncated assistant text")
+                    changed = True
+                    content.append({"type": "text", "text": stub})
+                else:
+                    content.append(block)
+            else:
+                content.append(block)
+        if changed:
+            # a new list: assistant content may still be shared with the API response
+            message["content"] = content
+            logger.debug("compaction: %s", report.decisions[-1])
+        return changed
+
+    def _collapse(
+        self,
+        messages: list[BetaMessageParam],
+        sizes: list[int],
+        stale: int,
+        report: CompactionReport,
+    ) -> int:
+        """
+        Replace messages[1:end] with a summary appended to the first (user) message.
+        `end` is an assistant message, so roles keep alternating and no tool_result is
+        separated from its tool_use. Returns the tokens saved.
+        """
+        if not messages or messages[0]["role"] != "user":
+            return 0
+        end = next(
+            (
+                j
+                for j in range(min(stale, len(messages) - 1), 1, -1)
+                if messages[j]["role"] == "assistant"
+            ),
+            None,
+        )
+        if end is None:
+            return 0
+        collapsed = messages[1:end]
+        first = messages[0]
+        content = first["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        earlier = [
+            block
+            for block in content
+            if as_dict(block).get("text", "").startswith(SUMMARY_PREFIX)
+        ]
+        # the new summary replaces the one left by an earlier collapse, so it covers it
+        content = [block for block in content if not any(block is e for e in earlier)]
+        summary = self.summarizer(
+            [{"role": "user", "content": earlier}, *collapsed] if earlier else collapsed
+        )
+        messages[0] = {
+            **first,
+            "content": [*content, {"type": "text", "text": SUMMARY_PREFIX + summary}],
+        }
+        del messages[1:end]
+
+        new_size = message_tokens(messages[0])
+        saved = sum(sizes[:end]) - new_size
+        sizes[:end] = [new_size]
+        report.collapsed_messages += len(collapsed)
+        report.decisions.append(f"collapsed messages 1..{end - 1} into a summary")
+        logger.info(
+            "compaction: collapsed %d messages into a %d-token summary",
+            len(collapsed),
+            new_size,
+        )
+        return saved
@@ -0,0 +1,130 @@
+"""
+Builds Messages API requests with prompt-cache breakpoints on the stable prefix (tools,
+system prompt and conversation history), and tracks how well the cache is doing.
+"""
+import logging
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+PROMPT_CACHING_BETA_FLAG = "prompt-caching-2024-07-31"
+# the API accepts at most four cache_control breakpoints per request
+MAX_CACHE_BREAKPOINTS = 4
+EPHEMERAL: dict[str, str] = {"type": "ephemeral"}
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheStats:
+    requests: int = 0
+    input_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    prefix_resets: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        """Share of prompt tokens that were served from the cache."""
+        total = (
+            self.input_tokens
+            + self.cache_read_input_tokens
+            + self.cache_creation_input_tokens
+        )
+        return self.cache_read_input_tokens / total if total else 0.0
+
+
+class PromptCacheRequestBuilder:
+    """
+    Places `cache_control` breakpoints on the last tool definition, the system prompt
+    and the last two user turns. The newest turn writes the cache for the next request,
+    and the previous one reads what the last request wrote, so the breakpoints move
+    forward with the conversation.
+
+    Breakpoints are set on copies: the history itself is never modified, which keeps
+    the serialized prefix byte-identical from one turn to the next. Image pruning runs
+    here too, in chunks, and each chunk that is removed is counted as a prefix reset.
+    """
+
+    def __init__(
+        self,
+        images_to_keep: int | None = None,
+        prune_images: Callable[[list[Any], int], int] | None = None,
+        message_breakpoints: int = 2,
+    ):
+        self.images_to_keep = images_to_keep
+        self.prune_images = prune_images
+        self.message_breakpoints = min(message_breakpoints, MAX_CACHE_BREAKPOINTS - 2)
+        self.stats = CacheStats()
+
+    def build(
+        self,
+        *,
+        system: str,
+        tools: list[dict[str, Any]],
+        messages: list[Any],
+    ) -> dict[str, Any]:
+        """Return the `system`, `tools` and `messages` arguments for `create`."""
+        if self.images_to_keep and self.prune_images:
+            removed = self.prune_images(messages, self.images_to_keep)
+            if removed:
+                self.stats.prefix_resets += 1
+                logger.info(
+                    "pruned %d images; the cached conversation prefix restarts", removed
+                )
+
+        cached_tools = list(tools)
+        if cached_tools:
+            cached_tools[-1] = {**cached_tools[-1], "cache_control": EPHEMERAL}
+
+        cached_messages = list(messages)
+        user_indices = [
+            i for i, message in enumerate(messages) if message["role"] == "user"
+        ]
+        for i in user_indices[-self.message_breakpoints :] if self.message_breakpoints else []:
+            cached_messages[i] = _with_breakpoint(messages[i])
+
+        return {
+            "system": [{"type": "text", "text": system, "cache_control": EPHEMERAL}],
+            "tools": cached_tools,
+            "messages": cached_messages,
+        }
+
+    def record_usage(self, usage: Any) -> CacheStats:
+        """Accumulate the cache counters from a response's `usage`."""
+        self.stats.requests += 1
+        self.stats.input_tokens += getattr(usage, "input_tokens", 0) or 0
+        read = getattr(usage, "cache_read_input_tokens", 0) or 0
+        created = getattr(usage, "cache_creation_input_tokens", 0) or 0
+        self.stats.cache_read_input_tokens += read
+        self.stats.cache_creation_input_tokens += created
+        logger.debug(
+            "prompt cache: read=%d created=%d uncached=%d (hit ratio %.2f)",
+            read,
+            created,
+            getattr(usage, "input_tokens", 0) or 0,
+            self.stats.hit_ratio,
+        )
+        return self.stats
+
+
+def _with_breakpoint(message: dict[str, Any]) -> dict[str, Any]:
+    """Copy `message`, marking its last content block as a cache breakpoint."""
+    content = message["content"]
+    if isinstance(content, str):
+        return {
+            **message,
+            "content": [{"type": "text", "text": content, "cache_control": EPHEMERAL}],
+        }
+    if not content:
+        return message
+    content = list(content)
+    content[-1] = {**_as_dict(content[-1]), "cache_control": EPHEMERAL}
+    return {**message, "content": content}
+
+
+def _as_dict(block: Any) -> dict[str, Any]:
+    if isinstance(block, dict):
+        return block
+    # pydantic content blocks, e.g. TextBlock objects appended by the UI
+    return block.model_dump(exclude_none=True)
@@ -1,5 +1,6 @@
-import asyncio
-from typing import Any, Dict, cast
+import concurrent.futures
+import logging
+from typing import Any, cast
 from collections.abc import Callable
 from anthropic.types.beta import (
     BetaContentBlock,
@@ -9,10 +10,14 @@ from anthropic.types.beta import (
     BetaMessageParam,
     BetaTextBlockParam,
     BetaToolResultBlockParam,
+    BetaToolUseBlock,
 )
-from anthropic.types import TextBlock
-from anthropic.types.beta import BetaMessage, BetaTextBlock, BetaToolUseBlock
-from ...tools import BashTool, ComputerTool, EditTool, ToolCollection, ToolResult
+from ...tools import ToolDispatcher, ToolRegistry, ToolResult
+from ...conversation import Conversation, MessageKeys
+from ...event_loop import BackgroundEventLoop, get_background_loop
+from ...render import ChatRenderer
+
+logger = logging.getLogger(__name__)
 
 
 class AnthropicExecutor:
@@ -20,78 +25,97 @@ class AnthropicExecutor:
         self, 
         output_callback: Callable[[BetaContentBlockParam], None], 
         tool_output_callback: Callable[[Any, str], None],
-        selected_screen: int = 0
+        selected_screen: int = 0,
+        workspace_root: str | None = None,
+        event_loop: BackgroundEventLoop | None = None,
+        tool_registry: ToolRegistry | None = None,
+        renderer: ChatRenderer | None = None,
     ):
-        self.tool_collection = ToolCollection(
-            ComputerTool(selected_screen=selected_screen),
-            BashTool(),
-            EditTool(),
+        # with a workspace root configured, the registry's collection also reports what
+        # each tool call changed, so the model does not have to spend a turn on `ls` or
+        # `git status` to find out
+        self.tool_registry = tool_registry or ToolRegistry(
+            selected_screen=selected_screen, workspace_root=workspace_root
         )
+        self.tool_collection = self.tool_registry.collection
         self.output_callback = output_callback
         self.tool_output_callback = tool_output_callback
+        # tools run on one long-lived loop, so their async state (e.g. the bash
+        # subprocess) survives from one action to the next
+        self.event_loop = event_loop or get_background_loop()
+        # independent tool calls of one response run concurrently on that loop
+        self.dispatcher = ToolDispatcher(self.tool_collection, spawn=self.event_loop.submit)
+        # tool_use blocks already started, keyed by block id
+        self._dispatched: dict[str, concurrent.futures.Future[ToolResult]] = {}
+        # hashes of the messages seen so far, for histories that are not a Conversation
+        self._keys = MessageKeys()
+        # chat rows for the Gradio view; pass the session's renderer to keep its cursor
+        self.renderer = renderer or ChatRenderer()
+        # the results collected from the latest response so far, whether or not any
+        # chat row was yielded with them
+        self.tool_results: list[BetaToolResultBlockParam] = []
+
+    def dispatch(self, content_block: BetaToolUseBlock):
+        """
+        Start running a tool_use block right away, e.g. while the rest of the response
+        is still streaming. It waits only for the earlier calls it conflicts with; the
+        result is picked up when `__call__` reaches the block.
+        """
+        if content_block.id not in self._dispatched:
+            self._dispatched[content_block.id] = self.dispatcher.submit(
+                content_block.name, cast(dict[str, Any], content_block.input)
+            )
+
+    def cancel(self):
+        """Cancel the tool calls that were started but not collected yet."""
+        for future in self._dispatched.values():
+            future.cancel()
+        self._dispatched.clear()
+        self.dispatcher.reset()
 
     def __call__(self, response: BetaMessage, messages: list[BetaMessageParam]):
         new_message = {
             "role": "assistant",
             "content": cast(list[BetaContentBlockParam], response.content),
         }
-        if new_message not in messages:
+        keys = messages.keys if isinstance(messages, Conversation) else self._keys
+        if not keys.contains(messages, new_message):
             messages.append(new_message)
         else:
-            print("new_message already in messages, there are duplicates.")
+            logger.warning("new_message already in messages, there are duplicates.")
         
-        tool_result_content: list[BetaToolResultBlockParam] = []
+        # Start every tool call up front; results are still collected in block order
         for content_block in cast(list[BetaContentBlock], response.content):
-            self.output_callback(content_block)
-
-            # Execute the tool
             if content_block.type == "tool_use":
-                # Run the asynchronous tool execution in a synchronous context
-                result = asyncio.run(self.tool_collection.run(
-                    name=content_block.name,
-                    tool_input=cast(dict[str, Any], content_block.input),
-                ))
-                tool_result_content.append(
-                    _make_api_tool_result(result, content_block.id)
-                )
-                self.tool_output_callback(result, content_block.id)
+                self.dispatch(content_block)
 
-            # Craft messages based on the content_block
-            # Note: to display the messages in the gradio, you should organize the messages in the following way (user message, bot message)
-            display_messages = _message_display_callback(messages)
-            
-            # Send the messages to the gradio
-            for user_msg, bot_msg in display_messages:
-                yield [user_msg, bot_msg], tool_result_content
+        tool_result_content = self.tool_results = []
+        try:
+            for content_block in cast(list[BetaContentBlock], response.content):
+                self.output_callback(content_block)
+
+                # Collect the tool's result
+                if content_block.type == "tool_use":
+                    result = self._dispatched.pop(content_block.id).result()
+                    tool_result_content.append(
+                        _make_api_tool_result(result, content_block.id)
+                    )
+                    self.tool_output_callback(result, content_block.id)
+
+                # Send the rows of messages added since the last update to the gradio, as
+                # (user message, bot message) pairs
+                for row in self.renderer.update(messages):
+                    yield row, tool_result_content
+        finally:
+            # also when a tool or a callback raised, or the caller stopped iterating;
+            # otherwise the next response's calls would wait on this one's
+            self.dispatcher.reset()
 
         if not tool_result_content:
             return messages
         
         return tool_result_content
 
-def _message_display_callback(messages):
-    display_messages = []
-    for msg in messages:
-        try:
-            if isinstance(msg["content"][0], TextBlock):
-                display_messages.append((msg["content"][0].text, None))  # User message
-            elif isinstance(msg["content"][0], BetaTextBlock):
-                display_messages.append((None, msg["content"][0].text))  # Bot message
-            elif isinstance(msg["content"][0], BetaToolUseBlock):
-                display_messages.append((None, f"Tool Use: {msg['content'][0].name}\nInput: {msg['content'][0].input}"))  # Bot message
-            elif isinstance(msg["content"][0], Dict) and msg["content"][0]["content"][-1]["type"] == "image":
-                display_messages.append((None, f'<img src="data:image/png;base64,{msg["content"][0]["content"][-1]["source"]["data"]}">'))  # Bot message
-            elif isinstance(msg["content"][0], Dict) and msg["content"][0]["content"][-1]["type"] == "text":
-                # image_path = decode_base64_image_and_save(msg["content"][0]["content"][-1]["source"]["data"])
-                # res.append((None, gr.Image(image_path)))  # Bot message
-                display_messages.append((None, msg["content"][0]["content"][-1]["text"]))  # Bot message
-            else:
-                print(msg["content"][0])
-        except Exception as e:
-            print("error", e)
-            pass
-    return display_messages
-
 def _make_api_tool_result(
     result: ToolResult, tool_use_id: str
 ) -> BetaToolResultBlockParam:
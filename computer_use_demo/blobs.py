@@ -0,0 +1,270 @@
+"""
+Content-addressed store for screenshots and other images. The raw bytes of each image
+are held once, however many messages, tool results and caches refer to them; those
+hold an `ImageRef` handle instead of a base64 string, and base64 is only produced for
+the outgoing API request (see `materialize`).
+"""
+import base64
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from io import BytesIO
+from pathlib import Path
+from typing import Any
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024  # bytes
+
+
+def _dimensions(data: bytes) -> tuple[int, int] | None:
+    if data.startswith(b"\x89PNG\r\n\x1a\n") and len(data) >= 24:
+        return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+    try:
+        with Image.open(BytesIO(data)) as image:
+            return image.size
+    except OSError:
+        return None
+
+
+class ImageRef:
+    """
+    A handle to an image in a `BlobStore`. Every live handle counts as a reference;
+    the bytes are released when the last handle is garbage collected. Handles to the
+    same content compare equal, and copying one returns the handle itself.
+    """
+
+    __slots__ = ("store", "key", "media_type", "size", "dimensions", "__weakref__")
+
+    def __init__(
+        self,
+        store: "BlobStore",
+        key: str,
+        media_type: str,
+        size: int,
+        dimensions: tuple[int, int] | None,
+    ):
+        self.store = store
+        self.key = key
+        self.media_type = media_type
+        self.size = size
+        self.dimensions = dimensions
+        weakref.finalize(self, store.decref, key)
+
+    def data(self) -> bytes:
+        return self.store.get(self.key)
+
+    def base64(self) -> str:
+        return base64.b64encode(self.data()).decode()
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, ImageRef) and other.key == self.key
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    def __copy__(self) -> "ImageRef":
+        return self
+
+    def __deepcopy__(self, memo: dict) -> "ImageRef":
+        return self
+
+    def __repr__(self) -> str:
+        return f"ImageRef({self.key[:12]}, {self.media_type}, {self.size} bytes)"
+
+
+@dataclass
+class _Blob:
+    size: int
+    dimensions: tuple[int, int] | None
+    data: bytes | None = None  # None once spilled to disk
+    refs: int = 0
+
+
+@dataclass
+class BlobStoreStats:
+    blobs: int = 0
+    memory_bytes: int = 0
+    spilled_bytes: int = 0
+    spills: int = 0
+    # bytes a put did not have to store again because the content was already there
+    deduplicated_bytes: int = 0
+
+
+class BlobStore:
+    """
+    Reference-counted image bytes keyed by SHA-256. Up to `memory_limit` bytes are
+    kept in memory; beyond that, the least recently used blobs are written to
+    `spill_dir` (a temporary directory by default) and read back from there on use.
+    """
+
+    def __init__(self, memory_limit: int = DEFAULT_MEMORY_LIMIT, spill_dir: str | None = None):
+        self.memory_limit = memory_limit
+        self._spill_dir = Path(spill_dir) if spill_dir else None
+        self._blobs: dict[str, _Blob] = {}
+        self._resident: OrderedDict[str, None] = OrderedDict()  # in LRU order
+        # handles are finalized during garbage collection, possibly while held
+        self._lock = threading.RLock()
+        self.stats = BlobStoreStats()
+
+    def put(self, data: bytes, media_type: str = "image/png") -> ImageRef:
+        key = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            blob = self._blobs.get(key)
+            if blob is None:
+                blob = self._blobs[key] = _Blob(len(data), _dimensions(data), data)
+                self._resident[key] = None
+                self.stats.blobs += 1
+                self.stats.memory_bytes += blob.size
+                self._spill()
+            else:
+                self.stats.deduplicated_bytes += blob.size
+                if key in self._resident:
+                    self._resident.move_to_end(key)
+            blob.refs += 1
+            return ImageRef(self, key, media_type, blob.size, blob.dimensions)
+
+    def put_base64(self, data: str, media_type: str = "image/png") -> ImageRef:
+        return self.put(base64.b64decode(data), media_type)
+
+    def get(self, key: str) -> bytes:
+        with self._lock:
+            blob = self._blobs[key]
+            if blob.data is not None:
+                self._resident.move_to_end(key)
+                return blob.data
+            # spilled blobs are not brought back, so memory stays under the limit; the
+            # file is read under the lock, as the last `decref` unlinks it
+            return self._path(key).read_bytes()
+
+    def read(self, key: str, start: int = 0, stop: int | None = None) -> bytes:
+        """Bytes `start` to `stop` of a blob; of a spilled one, only those are read."""
+        with self._lock:
+            blob = self._blobs[key]
+            if blob.data is not None:
+                self._resident.move_to_end(key)
+                return blob.data[start:stop]
+            with self._path(key).open("rb") as file:
+                file.seek(start)
+                return file.read(-1 if stop is None else max(0, stop - start))
+
+    def size(self, key: str) -> int:
+        with self._lock:
+            return self._blobs[key].size
+
+    def decref(self, key: str):
+        with self._lock:
+            blob = self._blobs.get(key)
+            if blob is None:
+                return
+            blob.refs -= 1
+            if blob.refs > 0:
+                return
+            del self._blobs[key]
+            self.stats.blobs -= 1
+            if blob.data is not None:
+                del self._resident[key]
+                self.stats.memory_bytes -= blob.size
+            else:
+                self.stats.spilled_bytes -= blob.size
+                self._path(key).unlink(missing_ok=True)
+
+    def refs(self, key: str) -> int:
+        with self._lock:
+            blob = self._blobs.get(key)
+            return blob.refs if blob else 0
+
+    def _path(self, key: str) -> Path:
+        if self._spill_dir is None:
+            self._spill_dir = Path(tempfile.mkdtemp(prefix="computer-use-blobs-"))
+            weakref.finalize(self, shutil.rmtree, self._spill_dir, True)
+        return self._spill_dir / key
+
+    def _spill(self):
+        # the newest blob stays in memory even if it alone is over the limit
+        while self.stats.memory_bytes > self.memory_limit and len(self._resident) > 1:
+            key, _ = self._resident.popitem(last=False)
+            blob = self._blobs[key]
+            path = self._path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(blob.data)
+            blob.data = None
+            self.stats.memory_bytes -= blob.size
+            self.stats.spilled_bytes += blob.size
+            self.stats.spills += 1
+            logger.debug("spilled blob %s (%d bytes) to %s", key[:12], blob.size, path)
+
+
+def as_base64(image: "str | ImageRef") -> str:
+    return image.base64() if isinstance(image, ImageRef) else image
+
+
+def as_bytes(image: "str | ImageRef") -> bytes:
+    return image.data() if isinstance(image, ImageRef) else base64.b64decode(image)
+
+
+def materialize(messages: list[Any]) -> list[Any]:
+    """
+    The messages to send, with every `ImageRef` in an image block replaced by its
+    base64 data. Messages and blocks without handles are passed through as they are;
+    the rest are shallow copies, so `messages` keeps its handles and the base64
+    strings are discarded along with the request.
+    """
+    return [_materialize_message(message) for message in messages]
+
+
+def _materialize_message(message: Any) -> Any:
+    content = message.get("content") if isinstance(message, dict) else None
+    if not isinstance(content, list):
+        return message
+    blocks = [_materialize_block(block) for block in content]
+    if all(new is old for new, old in zip(blocks, content)):
+        return message
+    return {**message, "content": blocks}
+
+
+def _materialize_block(block: Any) -> Any:
+    if not isinstance(block, dict):
+        return block
+    if block.get("type") == "image":
+        source = block.get("source")
+        if isinstance(source, dict) and isinstance(source.get("data"), ImageRef):
+            ref = source["data"]
+            return {
+                **block,
+                "source": {**source, "media_type": ref.media_type, "data": ref.base64()},
+            }
+        return block
+    if block.get("type") == "tool_result" and isinstance(block.get("content"), list):
+        items = [_materialize_block(item) for item in block["content"]]
+        if any(new is not old for new, old in zip(items, block["content"])):
+            return {**block, "content": items}
+    return block
+
+
+_default_store: BlobStore | None = None
+_default_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """
+    Return the process-wide blob store. `BLOB_STORE_MEMORY_MB` caps its memory and
+    `BLOB_STORE_SPILL_DIR` sets where it spills to.
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            limit = os.getenv("BLOB_STORE_MEMORY_MB")
+            _default_store = BlobStore(
+                memory_limit=int(limit) * 1024 * 1024 if limit else DEFAULT_MEMORY_LIMIT,
+                spill_dir=os.getenv("BLOB_STORE_SPILL_DIR"),
+            )
+        return _default_store
@@ -0,0 +1,325 @@
+"""
+Process-wide registry of API clients, so that every turn and every session talking to
+the same provider with the same credentials reuses one keep-alive connection pool.
+"""
+import hashlib
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any
+
+import httpx
+from anthropic import (
+    Anthropic,
+    AnthropicBedrock,
+    AnthropicVertex,
+    AsyncAnthropic,
+    AsyncAnthropicBedrock,
+    AsyncAnthropicVertex,
+)
+
+from .payload_cache import splice
+
+AnthropicClient = Anthropic | AnthropicBedrock | AnthropicVertex
+AsyncAnthropicClient = AsyncAnthropic | AsyncAnthropicBedrock | AsyncAnthropicVertex
+
+
+@dataclass(frozen=True)
+class PoolLimits:
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 120.0  # seconds
+    timeout: float = 600.0  # seconds, matching the SDK default
+
+    @classmethod
+    def from_env(cls) -> "PoolLimits":
+        defaults = cls()
+        return cls(
+            max_connections=int(
+                os.getenv("ANTHROPIC_POOL_MAX_CONNECTIONS", defaults.max_connections)
+            ),
+            max_keepalive_connections=int(
+                os.getenv(
+                    "ANTHROPIC_POOL_MAX_KEEPALIVE", defaults.max_keepalive_connections
+                )
+            ),
+            keepalive_expiry=float(
+                os.getenv("ANTHROPIC_POOL_KEEPALIVE_EXPIRY", defaults.keepalive_expiry)
+            ),
+        )
+
+
+@dataclass
+class PoolMetrics:
+    """Counters for one pooled client; `connections_opened` stops growing once warm."""
+
+    requests: int = 0
+    connections_opened: int = 0
+    tls_handshakes: int = 0
+    client_reuses: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def increment(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self) -> dict[str, int]:
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "tls_handshakes": self.tls_handshakes,
+            "client_reuses": self.client_reuses,
+        }
+
+
+def _with_encoded_messages(request: httpx.Request) -> httpx.Request:
+    """Splice pre-encoded messages (see `payload_cache`) into the request body."""
+    if request.method != "POST" or not isinstance(request.stream, httpx.ByteStream):
+        return request
+    body = splice(request.content)
+    if body is None:
+        return request
+    headers = request.headers.copy()
+    del headers["Content-Length"]
+    return httpx.Request(
+        request.method,
+        request.url,
+        headers=headers,
+        content=body,
+        extensions=request.extensions,
+    )
+
+
+class _MeteredTransport(httpx.HTTPTransport):
+    """
+    Counts requests, and new connections via httpcore's trace extension. Also splices
+    pre-encoded messages into request bodies.
+    """
+
+    def __init__(self, metrics: PoolMetrics, **kwargs):
+        super().__init__(**kwargs)
+        self._metrics = metrics
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request = _with_encoded_messages(request)
+        self._metrics.increment("requests")
+        parent_trace = request.extensions.get("trace")
+
+        def trace(event_name: str, info: dict[str, Any]):
+            if event_name == "connection.connect_tcp.complete":
+                self._metrics.increment("connections_opened")
+            elif event_name == "connection.start_tls.complete":
+                self._metrics.increment("tls_handshakes")
+            if parent_trace is not None:
+                parent_trace(event_name, info)
+
+        request.extensions["trace"] = trace
+        return super().handle_request(request)
+
+
+class _MeteredAsyncTransport(httpx.AsyncHTTPTransport):
+    """The asynchronous counterpart of `_MeteredTransport`."""
+
+    def __init__(self, metrics: PoolMetrics, **kwargs):
+        super().__init__(**kwargs)
+        self._metrics = metrics
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request = _with_encoded_messages(request)
+        self._metrics.increment("requests")
+        parent_trace = request.extensions.get("trace")
+
+        async def trace(event_name: str, info: dict[str, Any]):
+            if event_name == "connection.connect_tcp.complete":
+                self._metrics.increment("connections_opened")
+            elif event_name == "connection.start_tls.complete":
+                self._metrics.increment("tls_handshakes")
+            if parent_trace is not None:
+                result = parent_trace(event_name, info)
+                if hasattr(result, "__await__"):
+                    await result
+
+        request.extensions["trace"] = trace
+        return await super().handle_async_request(request)
+
+
+ClientKey = tuple[str, str | None, str | None, str | None]
+
+
+class ClientRegistry:
+    """
+    Hands out one client per (provider, credentials, region, base URL), each backed by
+    an `httpx.Client` with a bounded keep-alive pool and its own `PoolMetrics`.
+
+    `get_async` does the same for asynchronous clients, whose pool is separate but
+    whose requests count towards the same metrics. Async clients are tied to the
+    event loop they are used on; use them from one loop, such as the background loop.
+    """
+
+    def __init__(self, limits: PoolLimits | None = None):
+        self.limits = limits or PoolLimits.from_env()
+        self._clients: dict[ClientKey, AnthropicClient] = {}
+        self._async_clients: dict[ClientKey, AsyncAnthropicClient] = {}
+        self._metrics: dict[ClientKey, PoolMetrics] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        provider: str,
+        api_key: str | None = None,
+        region: str | None = None,
+        base_url: str | None = None,
+    ) -> AnthropicClient:
+        key = self.key(provider, api_key, region, base_url)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._metrics[key].increment("client_reuses")
+                return client
+            metrics = self._metrics.get(key) or PoolMetrics()
+            client = self._create(key[0], api_key, region, base_url, metrics)
+            self._clients[key] = client
+            self._metrics[key] = metrics
+            return client
+
+    def get_async(
+        self,
+        provider: str,
+        api_key: str | None = None,
+        region: str | None = None,
+        base_url: str | None = None,
+    ) -> AsyncAnthropicClient:
+        key = self.key(provider, api_key, region, base_url)
+        with self._lock:
+            client = self._async_clients.get(key)
+            if client is not None:
+                self._metrics[key].increment("client_reuses")
+                return client
+            metrics = self._metrics.get(key) or PoolMetrics()
+            client = self._create(
+                key[0], api_key, region, base_url, metrics, asynchronous=True
+            )
+            self._async_clients[key] = client
+            self._metrics[key] = metrics
+            return client
+
+    @staticmethod
+    def key(
+        provider: str,
+        api_key: str | None = None,
+        region: str | None = None,
+        base_url: str | None = None,
+    ) -> ClientKey:
+        # never keep the raw credential around as a dictionary key
+        credential = hashlib.sha256(api_key.encode()).hexdigest() if api_key else None
+        # accepts any of the APIProvider enums as well as plain strings
+        provider = getattr(provider, "value", provider)
+        return (str(provider), credential, region, base_url)
+
+    def metrics(self) -> dict[ClientKey, dict[str, int]]:
+        with self._lock:
+            return {key: metrics.as_dict() for key, metrics in self._metrics.items()}
+
+    def metrics_for(
+        self,
+        provider: str,
+        api_key: str | None = None,
+        region: str | None = None,
+        base_url: str | None = None,
+    ) -> dict[str, int] | None:
+        metrics = self._metrics.get(self.key(provider, api_key, region, base_url))
+        return metrics.as_dict() if metrics else None
+
+    def close(self):
+        """
+        Close the synchronous clients. Async clients can only be closed on their event
+        loop (see `aclose`); here they are just dropped.
+        """
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+            self._async_clients.clear()
+            self._metrics.clear()
+
+    async def aclose(self):
+        """Close the asynchronous clients, on the loop they were used on."""
+        with self._lock:
+            clients = list(self._async_clients.values())
+            self._async_clients.clear()
+        for client in clients:
+            await client.close()
+
+    def _create(
+        self,
+        provider: str,
+        api_key: str | None,
+        region: str | None,
+        base_url: str | None,
+        metrics: PoolMetrics,
+        asynchronous: bool = False,
+    ) -> Any:
+        if provider not in ("anthropic", "bedrock", "vertex"):
+            raise ValueError(f"Provider {provider} not supported")
+        limits = httpx.Limits(
+            max_connections=self.limits.max_connections,
+            max_keepalive_connections=self.limits.max_keepalive_connections,
+            keepalive_expiry=self.limits.keepalive_expiry,
+        )
+        if asynchronous:
+            http_client = httpx.AsyncClient(
+                transport=_MeteredAsyncTransport(metrics, limits=limits),
+                timeout=self.limits.timeout,
+            )
+            anthropic, bedrock, vertex = (
+                AsyncAnthropic,
+                AsyncAnthropicBedrock,
+                AsyncAnthropicVertex,
+            )
+        else:
+            http_client = httpx.Client(
+                transport=_MeteredTransport(metrics, limits=limits),
+                timeout=self.limits.timeout,
+            )
+            anthropic, bedrock, vertex = Anthropic, AnthropicBedrock, AnthropicVertex
+        kwargs: dict[str, Any] = {"base_url": base_url, "http_client": http_client}
+        if provider == "anthropic":
+            return anthropic(api_key=api_key, **kwargs)
+        if provider == "bedrock":
+            return bedrock(aws_region=region, **kwargs)
+        if region:
+            kwargs["region"] = region
+        return vertex(**kwargs)
+
+
+_default_registry: ClientRegistry | None = None
+_default_registry_lock = threading.Lock()
+
+
+def get_client_registry() -> ClientRegistry:
+    """Return the process-wide client registry."""
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = ClientRegistry()
+        return _default_registry
+
+
+def get_client(
+    provider: str,
+    api_key: str | None = None,
+    region: str | None = None,
+    base_url: str | None = None,
+) -> AnthropicClient:
+    """Shorthand for `get_client_registry().get(...)`."""
+    return get_client_registry().get(provider, api_key, region, base_url)
+
+
+def get_async_client(
+    provider: str,
+    api_key: str | None = None,
+    region: str | None = None,
+    base_url: str | None = None,
+) -> AsyncAnthropicClient:
+    """Shorthand for `get_client_registry().get_async(...)`."""
+    return get_client_registry().get_async(provider, api_key, region, base_url)
@@ -0,0 +1,184 @@
+"""
+Conversation history with incremental indexes of the screenshots it carries and of
+the messages it holds, so that pruning old images and checking for duplicates cost
+time proportional to what changed rather than to the length of the session.
+"""
+import hashlib
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any
+
+from anthropic.types.beta import BetaMessageParam
+
+from .blobs import ImageRef
+from .payload_cache import encode_message
+
+
+def _is_image(content: Any) -> bool:
+    return isinstance(content, dict) and content.get("type") == "image"
+
+
+class IncrementalIndex(ABC):
+    """
+    Base for indexes over a message list that is mostly appended to. Messages are
+    indexed lazily: every `update` looks only at those appended since the previous
+    one. If the list was rewritten underneath (truncated, or its indexed tail
+    replaced), the index starts over with one full scan.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._scanned = 0
+        self._last: Any = None
+
+    @abstractmethod
+    def _add(self, message: BetaMessageParam):
+        """Index one more message."""
+
+    def _scan(self, messages: list[BetaMessageParam]):
+        if self._scanned > len(messages) or (
+            self._scanned and messages[self._scanned - 1] is not self._last
+        ):
+            self._reset()
+        for message in messages[self._scanned :]:
+            self._add(message)
+        self._scanned = len(messages)
+        self._last = messages[-1] if messages else None
+
+
+class ImageIndex(IncrementalIndex):
+    """
+    Image-bearing tool_result blocks of a message list, oldest first, together with the
+    number of images each still holds.
+    """
+
+    def _reset(self):
+        super()._reset()
+        self._blocks: deque[list[Any]] = deque()  # [tool_result, image_count] pairs
+        self._entries: dict[int, list[Any]] = {}  # the pairs by id of their tool_result
+        self._total = 0
+
+    @property
+    def total(self) -> int:
+        return self._total
+
+    def _add(self, message: BetaMessageParam):
+        content = message["content"]
+        if not isinstance(content, list):
+            return
+        for item in content:
+            if not (isinstance(item, dict) and item.get("type") == "tool_result"):
+                continue
+            count = sum(1 for c in item.get("content", ()) if _is_image(c))
+            if count:
+                entry = [item, count]
+                self._blocks.append(entry)
+                self._entries[id(item)] = entry
+                self._total += count
+
+    def update(self, messages: list[BetaMessageParam]) -> int:
+        """Index messages appended since the last call; returns the image count."""
+        self._scan(messages)
+        return self._total
+
+    def forget(self, tool_result: dict[str, Any], n: int):
+        """Account for `n` images that someone else removed from `tool_result`."""
+        entry = self._entries.get(id(tool_result))
+        if entry is None or entry[0] is not tool_result:
+            return
+        n = min(n, entry[1])
+        entry[1] -= n
+        self._total -= n
+
+    def remove_oldest(self, n: int) -> int:
+        """Drop the `n` oldest images from their tool_result blocks; returns the count."""
+        removed = 0
+        while removed < n and self._blocks:
+            entry = self._blocks[0]
+            tool_result, count = entry
+            remaining = 0
+            if isinstance(tool_result.get("content"), list):
+                new_content = []
+                skip = n - removed
+                for content in tool_result["content"]:
+                    if _is_image(content):
+                        if skip:
+                            skip -= 1
+                            removed += 1
+                            continue
+                        remaining += 1
+                    new_content.append(content)
+                tool_result["content"] = new_content
+            # recounted, in case somebody else removed images from the block meanwhile
+            self._total -= count - remaining
+            entry[1] = remaining
+            if not remaining:
+                self._blocks.popleft()
+                self._entries.pop(id(tool_result), None)
+        return removed
+
+
+def message_key(message: BetaMessageParam) -> str:
+    """
+    A content hash of `message`, equal for equal messages whether their blocks are
+    dicts or pydantic objects. Images count by their blob key, not their data.
+    """
+    digest = hashlib.sha1()
+    for part in encode_message(message):
+        digest.update(part.key.encode() if isinstance(part, ImageRef) else part)
+    return digest.hexdigest()
+
+
+class MessageKeys(IncrementalIndex):
+    """The `message_key`s of a message list, for constant-time membership tests."""
+
+    def _reset(self):
+        super()._reset()
+        self._keys: set[str] = set()
+
+    def _add(self, message: BetaMessageParam):
+        self._keys.add(message_key(message))
+
+    def contains(self, messages: list[BetaMessageParam], message: BetaMessageParam) -> bool:
+        """Whether `messages` already holds a message equal to `message`."""
+        self._scan(messages)
+        return message_key(message) in self._keys
+
+
+class Conversation(list):
+    """
+    A message list (it is a plain `list` to every caller) that keeps an `ImageIndex`
+    and `MessageKeys` alongside, so `filter_to_n_most_recent_images` and duplicate
+    checks do not rescan the whole history.
+    """
+
+    def __init__(self, messages=()):
+        super().__init__(messages)
+        self.images = ImageIndex()
+        self.keys = MessageKeys()
+
+
+def filter_to_n_most_recent_images(
+    messages: list[BetaMessageParam],
+    images_to_keep: int | None,
+    min_removal_threshold: int = 10,
+) -> int:
+    """
+    With the assumption that images are screenshots that are of diminishing value as
+    the conversation progresses, remove all but the final `images_to_keep` tool_result
+    images in place, with a chunk of min_removal_threshold to reduce the amount we
+    break the implicit prompt cache. Returns the number of images removed.
+
+    On a `Conversation` only new messages are scanned; a plain list is scanned whole.
+    """
+    if images_to_keep is None:
+        return 0
+    index = messages.images if isinstance(messages, Conversation) else ImageIndex()
+    images_to_remove = index.update(messages) - images_to_keep
+    # for better cache behavior, we want to remove in chunks
+    images_to_remove -= images_to_remove % min_removal_threshold
+    if images_to_remove <= 0:
+        return 0
+    return index.remove_oldest(images_to_remove)
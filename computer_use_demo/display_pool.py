@@ -0,0 +1,306 @@
+"""
+A pool of pre-started displays. Starting Xvfb with its desktop takes seconds; leasing
+one that is already up takes a list pop. Returned displays are reset and health-checked
+off the caller's path before the next lease.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any
+
+from .displays import DisplayError, DisplayNumbers, XvfbDisplay
+
+logger = logging.getLogger(__name__)
+
+
+class PoolExhaustedError(DisplayError):
+    """No display became free before the lease's timeout."""
+
+
+@dataclass
+class PoolStats:
+    leases: int = 0
+    warm_leases: int = 0  # served by a display that was already up
+    cold_starts: int = 0  # leases that had to start a display
+    waits: int = 0  # leases that waited for a display to come back
+    lease_seconds: float = 0.0  # total time spent in `lease`
+    max_lease_seconds: float = 0.0
+    started: int = 0
+    resets: int = 0
+    reset_seconds: float = 0.0
+    unhealthy: int = 0  # displays found broken and replaced
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "leases": self.leases,
+            "warm_leases": self.warm_leases,
+            "cold_starts": self.cold_starts,
+            "waits": self.waits,
+            "lease_seconds": round(self.lease_seconds, 6),
+            "max_lease_seconds": round(self.max_lease_seconds, 6),
+            "started": self.started,
+            "resets": self.resets,
+            "reset_seconds": round(self.reset_seconds, 6),
+            "unhealthy": self.unhealthy,
+        }
+
+
+class DisplayPool:
+    """
+    Keeps `size` displays made by `factory(number)` running, idle ones ready to lease.
+    When all are leased, `lease` starts another, up to `max_size` displays in all, and
+    then waits for one to be returned.
+
+    `release` hands a display back: a background thread resets it (see
+    `XvfbDisplay.reset`), checks it with `xdpyinfo` and puts it back in the pool, or
+    replaces it if it is broken. Displays above `size` are stopped instead. Idle
+    displays are checked every `health_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[int], XvfbDisplay],
+        size: int = 0,
+        max_size: int | None = None,
+        numbers: DisplayNumbers | None = None,
+        health_interval: float = 30.0,
+    ):
+        self.factory = factory
+        self.size = size
+        self.max_size = max(size, max_size) if max_size is not None else None
+        self.numbers = numbers or DisplayNumbers()
+        self.health_interval = health_interval
+        self.stats = PoolStats()
+        self._idle: deque[XvfbDisplay] = deque()
+        self._leased: set[XvfbDisplay] = set()
+        self._returned: deque[XvfbDisplay] = deque()
+        self._resetting = 0  # returned, not yet idle again or stopped
+        self._starting = 0
+        self._condition = threading.Condition()
+        self._closed = False
+        self._maintainer: threading.Thread | None = None
+
+    @classmethod
+    def for_concurrency(
+        cls, factory: Callable[[int], XvfbDisplay], concurrency: int, spare: int = 1, **kwargs
+    ) -> "DisplayPool":
+        """
+        A pool that serves `concurrency` sessions without cold starts; `spare` more
+        cover displays that are still being reset. Unless `max_size` says otherwise,
+        it never runs more displays than that.
+        """
+        kwargs.setdefault("max_size", concurrency + spare)
+        return cls(factory, size=concurrency + spare, **kwargs)
+
+    @property
+    def total(self) -> int:
+        """Displays running or starting, whether idle, leased or being reset."""
+        return len(self._idle) + len(self._leased) + self._resetting + self._starting
+
+    def start(self) -> "DisplayPool":
+        """Start the pool's displays, in parallel, and the thread that maintains them."""
+        self._fill()
+        self._maintainer = threading.Thread(
+            target=self._maintain, name="display-pool", daemon=True
+        )
+        self._maintainer.start()
+        return self
+
+    def lease(self, timeout: float | None = None) -> XvfbDisplay:
+        """A display for one session; give it back with `release`."""
+        start = time.monotonic()
+        waited = False
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise DisplayError("the display pool is closed")
+                if self._idle:
+                    display = self._idle.popleft()
+                    self._leased.add(display)
+                    self.stats.warm_leases += 1
+                    break
+                if self.max_size is None or self.total < self.max_size:
+                    self._starting += 1
+                    display = None
+                    break
+                waited = True
+                remaining = None if timeout is None else timeout - (time.monotonic() - start)
+                if remaining is not None and remaining <= 0:
+                    raise PoolExhaustedError(f"no display became free within {timeout} seconds")
+                self._condition.wait(remaining)
+        if display is None:
+            display = self._start_one()
+            with self._condition:
+                self._leased.add(display)
+                self.stats.cold_starts += 1
+        elapsed = time.monotonic() - start
+        with self._condition:
+            self.stats.leases += 1
+            self.stats.waits += waited
+            self.stats.lease_seconds += elapsed
+            self.stats.max_lease_seconds = max(self.stats.max_lease_seconds, elapsed)
+        return display
+
+    def release(self, display: XvfbDisplay):
+        """Give a leased display back; it is reset in the background."""
+        with self._condition:
+            self._leased.discard(display)
+            self._resetting += 1
+            if self._maintainer is not None:
+                self._returned.append(display)
+                self._condition.notify_all()
+                return
+        # not started: there is no thread to hand it to
+        self._recycle(display)
+
+    def metrics(self) -> dict[str, Any]:
+        with self._condition:
+            return {
+                **self.stats.as_dict(),
+                "idle": len(self._idle),
+                "leased": len(self._leased),
+                "resetting": self._resetting,
+                "starting": self._starting,
+            }
+
+    def close(self):
+        """Stop every display, leased ones included."""
+        with self._condition:
+            self._closed = True
+            displays = [*self._idle, *self._leased, *self._returned]
+            self._idle.clear()
+            self._leased.clear()
+            self._resetting -= len(self._returned)
+            self._returned.clear()
+            self._condition.notify_all()
+        if self._maintainer is not None:
+            self._maintainer.join()
+        for display in displays:
+            self._stop(display)
+
+    def _start_one(self) -> XvfbDisplay:
+        """Start a display for a slot already counted in `_starting`."""
+        number = self.numbers.acquire()
+        try:
+            display = self.factory(number).start()
+        except BaseException:
+            self.numbers.release(number)
+            with self._condition:
+                self._starting -= 1
+                self._condition.notify_all()
+            raise
+        with self._condition:
+            self._starting -= 1
+            self.stats.started += 1
+        return display
+
+    def _fill(self):
+        """Start displays until the pool has `size` of them."""
+        with self._condition:
+            missing = max(0, self.size - self.total)
+            self._starting += missing
+        if not missing:
+            return
+
+        def start_idle():
+            try:
+                display = self._start_one()
+            except Exception:
+                logger.exception("starting a pooled display failed")
+                return
+            with self._condition:
+                if self._closed:
+                    closed = True
+                else:
+                    closed = False
+                    self._idle.append(display)
+                    self._condition.notify_all()
+            if closed:
+                self._stop(display)
+
+        with ThreadPoolExecutor(missing, thread_name_prefix="display-start") as pool:
+            for _ in range(missing):
+                pool.submit(start_idle)
+
+    def _maintain(self):
+        last_check = time.monotonic()
+        while True:
+            with self._condition:
+                while not self._returned and not self._closed:
+                    timeout = self.health_interval - (time.monotonic() - last_check)
+                    if timeout <= 0:
+                        break
+                    self._condition.wait(timeout)
+                if self._closed:
+                    return
+                returned = self._returned.popleft() if self._returned else None
+            if returned is not None:
+                self._recycle(returned)
+            else:
+                self._check_idle()
+                last_check = time.monotonic()
+            self._fill()
+
+    def _recycle(self, display: XvfbDisplay):
+        start = time.monotonic()
+        with self._condition:
+            surplus = self.total > self.size
+        if surplus:
+            self._stop(display)
+            self._done_resetting()
+            return
+        try:
+            display.reset()
+            healthy = display.healthy()
+        except Exception:
+            logger.exception("resetting display %s failed", display.name)
+            healthy = False
+        with self._condition:
+            self.stats.resets += 1
+            self.stats.reset_seconds += time.monotonic() - start
+            if not healthy:
+                self.stats.unhealthy += 1
+        if not healthy:
+            logger.warning("display %s is unhealthy, replacing it", display.name)
+            self._stop(display)
+            self._done_resetting()
+            return
+        with self._condition:
+            self._resetting -= 1
+            if self._closed:
+                closed = True
+            else:
+                closed = False
+                self._idle.append(display)
+                self._condition.notify_all()
+        if closed:
+            self._stop(display)
+
+    def _done_resetting(self):
+        with self._condition:
+            self._resetting -= 1
+            self._condition.notify_all()
+
+    def _check_idle(self):
+        with self._condition:
+            idle = list(self._idle)
+        for display in idle:
+            if display.healthy():
+                continue
+            with self._condition:
+                if display not in self._idle:
+                    continue  # leased meanwhile
+                self._idle.remove(display)
+                self.stats.unhealthy += 1
+            logger.warning("idle display %s is unhealthy, replacing it", display.name)
+            self._stop(display)
+
+    def _stop(self, display: XvfbDisplay):
+        try:
+            display.stop()
+        finally:
+            self.numbers.release(display.number)
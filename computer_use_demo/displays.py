@@ -0,0 +1,332 @@
+"""
+Virtual X displays for agent sessions, started the way `image/xvfb_startup.sh` and
+`image/start_all.sh` start the shared one, and resource accounting for the processes
+a session runs.
+"""
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+DPI = 96
+
+
+class DisplayError(RuntimeError):
+    pass
+
+
+def display_in_use(number: int) -> bool:
+    return Path(f"/tmp/.X{number}-lock").exists() or Path(f"/tmp/.X11-unix/X{number}").exists()
+
+
+class DisplayNumbers:
+    """Hands out display numbers from `base` up that no X server is using."""
+
+    def __init__(self, base: int = 100):
+        self.base = base
+        self._taken: set[int] = set()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> int:
+        with self._lock:
+            number = self.base
+            while number in self._taken or display_in_use(number):
+                number += 1
+            self._taken.add(number)
+            return number
+
+    def release(self, number: int):
+        with self._lock:
+            self._taken.discard(number)
+
+
+class XvfbDisplay:
+    """
+    One Xvfb server on display `:number`. `env()` is the environment for programs that
+    should draw on it (a session's bash, xdotool, screenshots).
+    """
+
+    def __init__(
+        self,
+        number: int,
+        width: int = 1280,
+        height: int = 800,
+        dpi: int = DPI,
+        background: str = "black",
+    ):
+        self.number = number
+        self.width = width
+        self.height = height
+        self.dpi = dpi
+        # the root window's color, restored by `reset`
+        self.background = background
+        self.process: subprocess.Popen | None = None
+
+    @property
+    def name(self) -> str:
+        return f":{self.number}"
+
+    def command(self) -> list[str]:
+        return [
+            "Xvfb",
+            self.name,
+            "-ac",
+            "-screen",
+            "0",
+            f"{self.width}x{self.height}x24",
+            "-retro",
+            "-dpi",
+            str(self.dpi),
+            "-nolisten",
+            "tcp",
+        ]
+
+    def env(self) -> dict[str, str]:
+        return {
+            **os.environ,
+            "DISPLAY": self.name,
+            "DISPLAY_NUM": str(self.number),
+            "WIDTH": str(self.width),
+            "HEIGHT": str(self.height),
+        }
+
+    def start(self, timeout: float = 10.0) -> "XvfbDisplay":
+        """Start Xvfb and wait until it accepts clients."""
+        if display_in_use(self.number):
+            raise DisplayError(f"display {self.name} is already in use")
+        self.process = subprocess.Popen(
+            self.command(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        deadline = time.monotonic() + timeout
+        while not self.ready():
+            if self.process.poll() is not None:
+                stderr = self.process.stderr.read().decode(errors="replace")
+                raise DisplayError(f"Xvfb {self.name} exited: {stderr.strip()}")
+            if time.monotonic() > deadline:
+                self.stop()
+                raise DisplayError(f"Xvfb {self.name} did not start within {timeout} seconds")
+            time.sleep(0.05)
+        logger.info("Xvfb started on display %s (pid %s)", self.name, self.process.pid)
+        return self
+
+    def ready(self) -> bool:
+        """Whether the server answers `xdpyinfo`."""
+        xdpyinfo = shutil.which("xdpyinfo")
+        if xdpyinfo is None:
+            # without the probe, settle for the socket being there
+            return Path(f"/tmp/.X11-unix/X{self.number}").exists()
+        return (
+            subprocess.run(
+                [xdpyinfo], env=self.env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            ).returncode
+            == 0
+        )
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def healthy(self) -> bool:
+        return self.alive() and self.ready()
+
+    def pids(self) -> list[int]:
+        return [self.process.pid] if self.alive() else []
+
+    def clients(self) -> list[int]:
+        """Processes started to draw on this display, other than the display's own."""
+        own = set(self.pids())
+        marker = f"DISPLAY={self.name}".encode()
+        clients = []
+        for entry in Path("/proc").iterdir():
+            if not entry.name.isdigit() or int(entry.name) in own:
+                continue
+            try:
+                environ = (entry / "environ").read_bytes()
+            except OSError:
+                continue
+            if marker in environ.split(b"\0"):
+                clients.append(int(entry.name))
+        return clients
+
+    def reset(self):
+        """
+        Bring the display back to how it started, for its next user: kill the programs
+        drawing on it, and restore the resolution and the background.
+        """
+        for pid in self.clients():
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        self._x_command("xrandr", "-s", f"{self.width}x{self.height}")
+        self._x_command("xsetroot", "-solid", self.background)
+
+    def _x_command(self, program: str, *args: str):
+        path = shutil.which(program)
+        if path is None:
+            return
+        subprocess.run(
+            [path, *args], env=self.env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+
+    def stop(self, timeout: float = 5.0):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        logger.info("Xvfb on display %s stopped", self.name)
+        self.process = None
+
+
+class DesktopDisplay(XvfbDisplay):
+    """
+    An Xvfb display with the window manager and panel of `image/start_all.sh`, for
+    agents that expect a desktop rather than a bare X server.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._programs: list[subprocess.Popen] = []
+
+    def programs(self) -> list[tuple[list[str], dict[str, str], str]]:
+        """Command, extra environment and the window class that shows it is up."""
+        return [
+            (["tint2", "-c", os.path.expanduser("~/.config/tint2/tint2rc")], {}, "tint2"),
+            (["mutter", "--replace", "--sm-disable"], {"XDG_SESSION_TYPE": "x11"}, "mutter"),
+        ]
+
+    def start(self, timeout: float = 10.0) -> "DesktopDisplay":
+        super().start(timeout)
+        try:
+            for command, env, window_class in self.programs():
+                self._programs.append(
+                    subprocess.Popen(
+                        command,
+                        env={**self.env(), **env},
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
+                    )
+                )
+                self._wait_for_window(window_class, timeout)
+        except BaseException:
+            self.stop()
+            raise
+        return self
+
+    def _wait_for_window(self, window_class: str, timeout: float):
+        xdotool = shutil.which("xdotool")
+        if xdotool is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (
+            subprocess.run(
+                [xdotool, "search", "--class", window_class],
+                env=self.env(),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            ).returncode
+            != 0
+        ):
+            if time.monotonic() > deadline:
+                raise DisplayError(f"{window_class} did not start on {self.name}")
+            time.sleep(0.1)
+
+    def alive(self) -> bool:
+        return super().alive() and all(program.poll() is None for program in self._programs)
+
+    def pids(self) -> list[int]:
+        return super().pids() + [
+            program.pid for program in self._programs if program.poll() is None
+        ]
+
+    def stop(self, timeout: float = 5.0):
+        for program in self._programs:
+            if program.poll() is None:
+                program.terminate()
+                try:
+                    program.wait(timeout)
+                except subprocess.TimeoutExpired:
+                    program.kill()
+        self._programs = []
+        super().stop(timeout)
+
+
+@dataclass
+class ResourceUsage:
+    cpu_seconds: float = 0.0  # user + system time, including reaped children
+    rss_bytes: int = 0
+    processes: int = 0
+
+    def __add__(self, other: "ResourceUsage") -> "ResourceUsage":
+        return ResourceUsage(
+            self.cpu_seconds + other.cpu_seconds,
+            self.rss_bytes + other.rss_bytes,
+            self.processes + other.processes,
+        )
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "cpu_seconds": round(self.cpu_seconds, 3),
+            "rss_bytes": self.rss_bytes,
+            "processes": self.processes,
+        }
+
+
+_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _stat(pid: int) -> list[str] | None:
+    try:
+        data = Path(f"/proc/{pid}/stat").read_text()
+    except OSError:
+        return None
+    # the command name may contain spaces; fields resume after its closing paren
+    return data[data.rindex(")") + 2 :].split()
+
+
+def _children() -> dict[int, list[int]]:
+    children: dict[int, list[int]] = {}
+    for entry in Path("/proc").iterdir():
+        if entry.name.isdigit():
+            fields = _stat(int(entry.name))
+            if fields is not None:
+                children.setdefault(int(fields[1]), []).append(int(entry.name))
+    return children
+
+
+def process_tree_usage(pids: list[int]) -> ResourceUsage:
+    """CPU time and resident memory of `pids` and all their descendants (Linux only)."""
+    if not pids or not Path("/proc/self/stat").exists():
+        return ResourceUsage()
+    children = _children()
+    usage = ResourceUsage()
+    seen: set[int] = set()
+    stack = list(pids)
+    while stack:
+        pid = stack.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        fields = _stat(pid)
+        if fields is None:
+            continue
+        # utime, stime, cutime, cstime and rss, counted from the state field
+        utime, stime, cutime, cstime = (int(value) for value in fields[11:15])
+        usage += ResourceUsage(
+            (utime + stime + cutime + cstime) / _TICKS, int(fields[21]) * _PAGE, 1
+        )
+        stack.extend(children.get(pid, ()))
+    return usage
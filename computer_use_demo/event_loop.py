@@ -0,0 +1,117 @@
+"""
+A persistent asyncio event loop running on a background thread, so that synchronous
+callers can drive async tools without creating a new loop for every call.
+"""
+import asyncio
+import concurrent.futures
+import threading
+from collections.abc import Coroutine
+from typing import Any, TypeVar
+
+T = TypeVar("T")
+
+
+class BackgroundEventLoop:
+    """
+    Owns one event loop on a daemon thread. Async resources created on it (such as the
+    bash tool's subprocess) stay usable across calls, because every coroutine submitted
+    through `submit` or `run` executes on the same loop.
+    """
+
+    def __init__(self, name: str = "computer-use-event-loop"):
+        self.name = name
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self.start()
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        """Start the loop thread if it is not running yet; safe to call repeatedly."""
+        with self._lock:
+            if self._loop is not None and self.is_running:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+            return loop
+
+    def submit(
+        self, coro: Coroutine[Any, Any, T]
+    ) -> "concurrent.futures.Future[T]":
+        """Schedule `coro` on the loop from any thread and return a future for it."""
+        return asyncio.run_coroutine_threadsafe(coro, self.start())
+
+    def run(self, coro: Coroutine[Any, Any, T], timeout: float | None = None) -> T:
+        """Run `coro` on the loop and block the calling thread until it finishes."""
+        if self.in_loop_thread():
+            coro.close()
+            raise RuntimeError(
+                "BackgroundEventLoop.run() would deadlock when called from its own loop; await the coroutine instead."
+            )
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def in_loop_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def stop(self, timeout: float | None = 5.0):
+        """Cancel outstanding tasks, stop the loop and join its thread."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None or thread is None:
+            return
+
+        async def _cancel_all():
+            tasks = [
+                task
+                for task in asyncio.all_tasks()
+                if task is not asyncio.current_task()
+            ]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if thread.is_alive():
+            try:
+                asyncio.run_coroutine_threadsafe(_cancel_all(), loop).result(timeout)
+            except (concurrent.futures.TimeoutError, RuntimeError):
+                pass
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout)
+        if not loop.is_running():
+            loop.close()
+
+
+_default_loop: BackgroundEventLoop | None = None
+_default_loop_lock = threading.Lock()
+
+
+def get_background_loop() -> BackgroundEventLoop:
+    """Return the process-wide background loop, starting it on first use."""
+    global _default_loop
+    with _default_loop_lock:
+        if _default_loop is None:
+            _default_loop = BackgroundEventLoop()
+        _default_loop.start()
+        return _default_loop
@@ -0,0 +1,340 @@
+"""
+Event bus between the sampling loop and its consumers (UI callbacks, logging,
+telemetry). Each subscriber has a bounded queue and a worker thread. A full queue drops
+events according to its policy, except for the UI callbacks moved onto the bus with
+`route`, whose events are never dropped: publishing waits for room instead.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from enum import StrEnum
+from typing import Any
+
+from .blobs import ImageRef
+
+logger = logging.getLogger(__name__)
+
+# a subscriber to the events of every session, whatever their `session`
+_ALL_SESSIONS: Any = object()
+
+
+class DropPolicy(StrEnum):
+    DROP_OLDEST = "drop_oldest"  # keep the latest state, e.g. for telemetry
+    DROP_NEWEST = "drop_newest"  # keep what is already queued, e.g. for logs
+    # wait up to `block_timeout` (without a limit if None) for room, then drop the
+    # newest; back-pressure
+    BLOCK = "block"
+
+
+@dataclass
+class Event:
+    kind: str
+    payload: Any
+    session: str | None = None
+    timestamp: float = field(default_factory=time.time)
+
+
+@dataclass
+class SubscriberStats:
+    delivered: int = 0
+    dropped: int = 0
+    errors: int = 0
+    max_queue_depth: int = 0
+
+
+class _Subscriber:
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Event], None],
+        kinds: frozenset[str] | None,
+        session: Any,
+        maxsize: int,
+        policy: DropPolicy,
+        block_timeout: float | None,
+    ):
+        self.name = name
+        self.handler = handler
+        self.kinds = kinds
+        self.session = session
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.stats = SubscriberStats()
+        self._queue: deque[Event] = deque()
+        self._condition = threading.Condition()
+        self._busy = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"event-bus-{name}", daemon=True)
+        self._thread.start()
+
+    def offer(self, event: Event):
+        with self._condition:
+            if len(self._queue) >= self.maxsize:
+                if self.policy == DropPolicy.BLOCK:
+                    self._condition.wait_for(
+                        lambda: len(self._queue) < self.maxsize or self._closed,
+                        timeout=self.block_timeout,
+                    )
+                if len(self._queue) >= self.maxsize:
+                    self.stats.dropped += 1
+                    if self.policy != DropPolicy.DROP_OLDEST:
+                        return
+                    self._queue.popleft()
+            self._queue.append(event)
+            self.stats.max_queue_depth = max(self.stats.max_queue_depth, len(self._queue))
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    return
+                event = self._queue.popleft()
+                self._busy = True
+                self._condition.notify_all()
+            try:
+                self.handler(event)
+                self.stats.delivered += 1
+            except Exception:
+                self.stats.errors += 1
+                logger.exception("event subscriber %s failed on %s", self.name, event.kind)
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def flush(self, timeout: float | None) -> bool:
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._queue and not self._busy, timeout=timeout
+            )
+
+    def close(self, timeout: float | None):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+
+class EventBus:
+    """
+    Fan-out of loop events to subscribers, each on its own thread behind a bounded
+    queue. `publish` costs a lock and an append per interested subscriber; the time
+    it takes is accumulated in `publish_seconds` so that the overhead can be checked.
+    """
+
+    def __init__(self):
+        self._subscribers: list[_Subscriber] = []
+        self._lock = threading.Lock()
+        self.published = 0
+        self.publish_seconds = 0.0
+
+    def subscribe(
+        self,
+        handler: Callable[[Event], None],
+        *,
+        kinds: set[str] | None = None,
+        session: str | None = _ALL_SESSIONS,
+        name: str | None = None,
+        maxsize: int = 1024,
+        policy: DropPolicy = DropPolicy.DROP_OLDEST,
+        block_timeout: float | None = 0.05,
+    ) -> _Subscriber:
+        """
+        Call `handler` with the events of `kinds` (default: all) published for
+        `session` (default: any session), on a thread of its own.
+        """
+        subscriber = _Subscriber(
+            name or getattr(handler, "__name__", "subscriber"),
+            handler,
+            frozenset(kinds) if kinds else None,
+            session,
+            maxsize,
+            policy,
+            block_timeout,
+        )
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber, timeout: float | None = 5.0):
+        """Stop delivering to `subscriber` once it has handled what it already queued."""
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+        subscriber.close(timeout)
+
+    def publish(self, kind: str, payload: Any = None, session: str | None = None):
+        start = time.perf_counter()
+        event = Event(kind, payload, session)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            if subscriber.kinds is not None and kind not in subscriber.kinds:
+                continue
+            # other sessions' events never take up room in this session's queue
+            if subscriber.session is not _ALL_SESSIONS and subscriber.session != session:
+                continue
+            subscriber.offer(event)
+        with self._lock:
+            self.published += 1
+            self.publish_seconds += time.perf_counter() - start
+
+    def publisher(self, kind: str, session: str | None = None) -> Callable[..., None]:
+        """A callback that publishes its arguments, as a tuple, in a `kind` event."""
+
+        def publish(*args):
+            self.publish(kind, args, session)
+
+        return publish
+
+    def route(
+        self,
+        callbacks: dict[str, Callable[..., Any] | None],
+        session: str | None = None,
+        *,
+        maxsize: int = 1024,
+        policy: DropPolicy = DropPolicy.BLOCK,
+        block_timeout: float | None = None,
+    ) -> tuple[dict[str, Callable[..., None] | None], _Subscriber]:
+        """
+        Move `callbacks` (by event kind) off the caller's thread. Returns the publishers
+        to call instead, and the subscriber that runs the callbacks, to `unsubscribe`
+        when done. All kinds share one subscriber, so callbacks still run in the order
+        they were published. These are what the user sees, so by default nothing is
+        dropped: a full queue, which only happens when a callback is slow, makes the
+        publisher wait for room.
+        """
+        active = {kind: callback for kind, callback in callbacks.items() if callback}
+
+        def deliver(event: Event):
+            active[event.kind](*event.payload)
+
+        subscriber = self.subscribe(
+            deliver,
+            kinds=set(active),
+            session=session,
+            name=f"callbacks-{session}",
+            maxsize=maxsize,
+            policy=policy,
+            block_timeout=block_timeout,
+        )
+        publishers = {
+            kind: self.publisher(kind, session) if kind in active else None
+            for kind in callbacks
+        }
+        return publishers, subscriber
+
+    def flush(self, timeout: float | None = 5.0) -> bool:
+        """Wait until every subscriber has handled what was published so far."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            subscribers = list(self._subscribers)
+        return all(
+            subscriber.flush(
+                None if deadline is None else max(0.0, deadline - time.monotonic())
+            )
+            for subscriber in subscribers
+        )
+
+    def close(self, timeout: float | None = 5.0):
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for subscriber in subscribers:
+            subscriber.close(timeout)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        return {
+            "published": self.published,
+            "mean_publish_us": (
+                1e6 * self.publish_seconds / self.published if self.published else 0.0
+            ),
+            "subscribers": {s.name: vars(s.stats).copy() for s in subscribers},
+        }
+
+
+def summarize(value: Any, max_text: int = 500) -> Any:
+    """
+    A JSON-friendly copy of `value` for logs, with every base64 image replaced by a
+    reference (a short content hash) and its size, and long strings truncated.
+    """
+    if hasattr(value, "http_response") and hasattr(value, "parse"):
+        value = value.parse()  # a raw API response; the parsed message is cached
+    if hasattr(value, "model_dump"):
+        value = value.model_dump(exclude_none=True)
+    elif hasattr(value, "__dataclass_fields__"):
+        value = {name: getattr(value, name) for name in value.__dataclass_fields__}
+    if isinstance(value, dict):
+        if value.get("type") == "image" and isinstance(value.get("source"), dict):
+            return {"type": "image", **_image_ref(value["source"].get("data", ""))}
+        return {
+            key: (
+                _image_ref(item)
+                if key == "base64_image" and isinstance(item, (str, ImageRef))
+                else summarize(item, max_text)
+            )
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [summarize(item, max_text) for item in value]
+    if isinstance(value, str) and len(value) > max_text:
+        return f"{value[:max_text]}... ({len(value)} chars)"
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return repr(value)[:max_text]
+
+
+def _image_ref(data: str | ImageRef) -> dict[str, Any]:
+    if isinstance(data, ImageRef):
+        return {"ref": data.key[:12], "bytes": data.size}
+    return {
+        "ref": hashlib.sha1(data.encode()).hexdigest()[:12],
+        "bytes": len(data) * 3 // 4 - data.count("=", -2),
+    }
+
+
+class StructuredLogger:
+    """Subscriber that writes each event as one JSON line, images as references."""
+
+    def __init__(self, log: logging.Logger | None = None, level: int = logging.INFO):
+        self.log = log or logging.getLogger("computer_use_demo.events.log")
+        self.level = level
+
+    def __call__(self, event: Event):
+        if not self.log.isEnabledFor(self.level):
+            return
+        record = {
+            "ts": round(event.timestamp, 3),
+            "kind": event.kind,
+            "session": event.session,
+            "payload": summarize(event.payload),
+        }
+        self.log.log(self.level, json.dumps(record, default=str))
+
+
+_default_bus: EventBus | None = None
+_default_bus_lock = threading.Lock()
+
+
+def get_event_bus() -> EventBus:
+    """
+    Return the process-wide event bus, with a `StructuredLogger` subscribed that drops
+    new events rather than slow down the loop when logging falls behind.
+    """
+    global _default_bus
+    with _default_bus_lock:
+        if _default_bus is None:
+            _default_bus = EventBus()
+            _default_bus.subscribe(
+                StructuredLogger(), name="structured-log", policy=DropPolicy.DROP_NEWEST
+            )
+        return _default_bus
@@ -0,0 +1,636 @@
+"""
+Headless batch runs of the agent. `JobQueue` takes tasks (a prompt, provider, model
+and screen), runs them through `sampling_loop_sync` on a bounded number of sessions
+and keeps their progress and artifacts; `JobServer` puts a local HTTP/JSON API in
+front of it, so scripts can push tasks through without a browser UI:
+
+    POST /jobs                      submit a task, returns the job
+    GET  /jobs                      the jobs in memory
+    GET  /jobs/<id>                 one job, from its artifacts once evicted
+    GET  /jobs/<id>/events?after=N  progress as JSON lines, until the job ends
+    POST /jobs/<id>/cancel          cancel a queued or running job
+    GET  /artifacts/<id>/<file>     a job's artifacts
+
+Run it with `python -m computer_use_demo.jobs`.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+from enum import StrEnum
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+
+from .blobs import as_bytes
+from .event_loop import BackgroundEventLoop, get_background_loop
+from .events import summarize
+from .media import MediaLibrary
+from .scheduler import Priority
+from .sessions import SessionManager, display_pool_from_env
+from .tools import ToolRegistry, ToolResult
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ("anthropic", "gpt4")
+API_KEY_ENV = {"anthropic": "ANTHROPIC_API_KEY", "gpt4": "OPENAI_API_KEY"}
+JOBS_USER = "jobs"
+
+
+class JobStatus(StrEnum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+FINAL_STATUSES = frozenset({JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.CANCELLED})
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+@dataclass
+class JobRequest:
+    prompt: str
+    provider: str = "anthropic"
+    model: str | None = None
+    screen: int = 0
+    max_tokens: int = 4096
+    only_n_most_recent_images: int | None = 3
+    # taken from the environment if not given; never written to the artifacts
+    api_key: str | None = field(default=None, repr=False)
+
+    @classmethod
+    def from_json(cls, data: Any) -> "JobRequest":
+        """A request from a submitted JSON body; ValueError if it is not valid."""
+        if not isinstance(data, dict):
+            raise ValueError("the body must be a JSON object")
+        unknown = set(data) - set(cls.__dataclass_fields__)
+        if unknown:
+            raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+        if not isinstance(data.get("prompt"), str) or not data["prompt"].strip():
+            raise ValueError("prompt must be a non-empty string")
+        if data.get("provider", "anthropic") not in PROVIDERS:
+            raise ValueError(f"provider must be one of {', '.join(PROVIDERS)}")
+        for name in ("screen", "max_tokens", "only_n_most_recent_images"):
+            value = data.get(name)
+            if value is not None and (not isinstance(value, int) or value < 0):
+                raise ValueError(f"{name} must be a non-negative integer")
+        return cls(**data)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__dataclass_fields__ if name != "api_key"}
+
+
+class Job:
+    """
+    One task and what became of it. Progress is a list of events, each a dict with a
+    sequence number `seq`; `wait_for_events` blocks until there are new ones.
+    """
+
+    def __init__(self, request: JobRequest, artifacts_dir: Path):
+        self.id = uuid.uuid4().hex
+        self.request = request
+        self.directory = artifacts_dir / self.id
+        self.status = JobStatus.QUEUED
+        self.error: str | None = None
+        self.created = time.time()
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.messages: list[Any] = [
+            {"role": "user", "content": [{"type": "text", "text": request.prompt}]}
+        ]
+        self.events: list[dict[str, Any]] = []
+        self.counts = {"api_calls": 0, "tool_calls": 0, "screenshots": 0}
+        self.api_seconds = 0.0
+        # the largest prompt sent for the job, in tokens as the API counted them
+        self.max_input_tokens: int | None = None
+        self.cancel_requested = False
+        # set once a final status has been recorded along with the artifacts
+        self._done = False
+        self._condition = threading.Condition()
+        self.add_event("status", status=self.status.value)
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def add_event(self, kind: str, **payload: Any):
+        with self._condition:
+            self.events.append(
+                {"seq": len(self.events), "ts": round(time.time(), 3), "kind": kind, **payload}
+            )
+            self._condition.notify_all()
+
+    def set_status(self, status: JobStatus, error: str | None = None):
+        with self._condition:
+            now = time.time()
+            if status == JobStatus.RUNNING:
+                self.started = now
+            elif status in FINAL_STATUSES:
+                self.finished = now
+            self.status = status
+            self.error = error
+        self.add_event("status", status=status.value, **({"error": error} if error else {}))
+
+    def settle(self):
+        """Mark the job done, once its final status and artifacts are in place."""
+        with self._condition:
+            self._done = True
+            self._condition.notify_all()
+
+    def wait_for_events(self, after: int, timeout: float | None = None) -> list[dict[str, Any]]:
+        """The events from sequence number `after` on, waiting for some if there are none."""
+        with self._condition:
+            self._condition.wait_for(lambda: len(self.events) > after or self.done, timeout)
+            return self.events[after:]
+
+    def save_screenshot(self, image: Any) -> str:
+        """Write a screenshot to the job's artifacts; its path relative to them."""
+        with self._condition:
+            self.counts["screenshots"] += 1
+            number = self.counts["screenshots"]
+        path = Path("screenshots") / f"{number:04d}.png"
+        (self.directory / "screenshots").mkdir(parents=True, exist_ok=True)
+        (self.directory / path).write_bytes(as_bytes(image))
+        return path.as_posix()
+
+    def final_text(self) -> str | None:
+        """The text of the last assistant message, i.e. the agent's answer."""
+        for message in reversed(self.messages):
+            if message.get("role") != "assistant":
+                continue
+            content = message.get("content")
+            if isinstance(content, str):
+                return content
+            texts = [
+                getattr(block, "text", None) if not isinstance(block, dict) else block.get("text")
+                for block in content or []
+            ]
+            return "\n".join(text for text in texts if text) or None
+        return None
+
+    def timings(self) -> dict[str, float | None]:
+        def between(start: float | None, end: float | None) -> float | None:
+            return round(end - start, 3) if start is not None and end is not None else None
+
+        return {
+            "queued_seconds": between(self.created, self.started or self.finished),
+            "run_seconds": between(self.started, self.finished),
+            "api_seconds": round(self.api_seconds, 3),
+        }
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status.value,
+            "error": self.error,
+            "request": self.request.as_dict(),
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "timings": self.timings(),
+            "max_input_tokens": self.max_input_tokens,
+            **self.counts,
+            "events": len(self.events),
+        }
+
+    def write_artifacts(self):
+        """The job, its final messages and its progress, next to its screenshots."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        (self.directory / "job.json").write_text(json.dumps(self.as_dict(), indent=2))
+        # images in the messages become short references; the screenshots are files
+        (self.directory / "messages.json").write_text(
+            json.dumps(summarize(self.messages, max_text=sys.maxsize), indent=2, default=str)
+        )
+        with self._condition:
+            events = list(self.events)
+        (self.directory / "events.jsonl").write_text(
+            "".join(json.dumps(event, default=str) + "\n" for event in events)
+        )
+
+
+# runs a job with the given tools, stopping soon after the event is set
+JobRunner = Callable[[Job, ToolRegistry, threading.Event], Iterator[Any]]
+
+
+def run_agent(job: Job, tools: ToolRegistry, cancel_event: threading.Event) -> Iterator[Any]:
+    """The agent's sampling loop on the job's messages, reporting into its events."""
+    # the loop pulls in the actors and their clients; only load them to run jobs
+    from .autopc.actor.base import APIProvider
+    from .loop import PROVIDER_TO_DEFAULT_MODEL_NAME, sampling_loop_sync
+
+    request = job.request
+
+    def output_callback(block):
+        if getattr(block, "type", None) == "tool_use":
+            job.counts["tool_calls"] += 1
+        job.add_event("output", block=summarize(block))
+
+    def tool_output_callback(result: ToolResult, tool_use_id: str):
+        payload: dict[str, Any] = {"tool_use_id": tool_use_id}
+        if result.output:
+            payload["output"] = summarize(result.output)
+        if result.error:
+            payload["error"] = summarize(result.error)
+        if result.base64_image:
+            payload["screenshot"] = job.save_screenshot(result.base64_image)
+        job.add_event("tool_output", **payload)
+
+    def api_response_callback(response):
+        job.counts["api_calls"] += 1
+        elapsed = getattr(response, "elapsed", None)
+        seconds = elapsed.total_seconds() if elapsed is not None else None
+        if seconds is not None:
+            job.api_seconds += seconds
+        parse = getattr(response, "parse", None)
+        usage = getattr(parse() if parse is not None else response, "usage", None)
+        input_tokens = None
+        if usage is not None:
+            # the whole prompt, whether or not it was read from the cache
+            input_tokens = sum(
+                getattr(usage, name, None) or 0
+                for name in ("input_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+            )
+        if input_tokens is not None:
+            job.max_input_tokens = max(job.max_input_tokens or 0, input_tokens)
+        job.add_event("api_response", seconds=seconds, input_tokens=input_tokens)
+
+    return sampling_loop_sync(
+        model=request.model or PROVIDER_TO_DEFAULT_MODEL_NAME.get(request.provider, ""),
+        provider=APIProvider(request.provider),
+        system_prompt_suffix="",
+        messages=job.messages,
+        output_callback=output_callback,
+        tool_output_callback=tool_output_callback,
+        api_response_callback=api_response_callback,
+        api_key=request.api_key or os.getenv(API_KEY_ENV[request.provider], ""),
+        only_n_most_recent_images=request.only_n_most_recent_images,
+        max_tokens=request.max_tokens,
+        selected_screen=request.screen,
+        tool_registry=tools,
+        session_id=job.id,
+        # interactive sessions go first when the account's rate limits are reached
+        priority=Priority.BATCH,
+        cancel_event=cancel_event,
+    )
+
+
+@dataclass
+class JobStats:
+    submitted: int = 0
+    rejected: int = 0  # the queue was full
+    queued: int = 0
+    running: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    cancelled: int = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return dict(vars(self))
+
+
+class JobQueue:
+    """
+    Runs submitted jobs, at most `workers` at a time and in the order they came;
+    at most `max_queued` more wait. Each running job is a session of
+    `session_manager`, so with a display pool every job gets a display of its own.
+
+    Artifacts go to `artifacts_dir/<job id>/`. The last `keep_finished` finished jobs
+    stay in memory; older ones are read back from their `job.json`.
+    """
+
+    def __init__(
+        self,
+        artifacts_dir: str | Path,
+        workers: int = 1,
+        max_queued: int = 1000,
+        keep_finished: int = 1000,
+        runner: JobRunner = run_agent,
+        session_manager: SessionManager | None = None,
+        event_loop: BackgroundEventLoop | None = None,
+    ):
+        self.artifacts_dir = Path(artifacts_dir)
+        self.artifacts_dir.mkdir(parents=True, exist_ok=True)
+        self.workers = workers
+        self.max_queued = max_queued
+        self.keep_finished = keep_finished
+        self.runner = runner
+        self.session_manager = session_manager or SessionManager(
+            max_concurrent=workers, max_per_user=workers
+        )
+        self.event_loop = event_loop or get_background_loop()
+        self.stats = JobStats()
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._waiting: set[str] = set()  # queued for a worker
+        self._lock = threading.Lock()
+        # created on the event loop by the first job
+        self._slots: asyncio.Semaphore | None = None
+
+    def submit(self, request: JobRequest) -> Job:
+        with self._lock:
+            if self.stats.queued >= self.max_queued:
+                self.stats.rejected += 1
+                raise QueueFullError(f"{self.stats.queued} jobs are already waiting")
+            job = Job(request, self.artifacts_dir)
+            self._jobs[job.id] = job
+            self._waiting.add(job.id)
+            self.stats.submitted += 1
+            self.stats.queued += 1
+        self.event_loop.submit(self._run(job))
+        logger.info("job %s queued", job.id)
+        return job
+
+    def get(self, job_id: str) -> Job | dict[str, Any] | None:
+        """The job, or the `job.json` of one no longer held in memory."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        if not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        try:
+            return json.loads((self.artifacts_dir / job_id / "job.json").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def jobs(self) -> list[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job that has not finished; False if there is no such job."""
+        job = self._jobs.get(job_id)
+        if job is None or job.status in FINAL_STATUSES:
+            return False
+        job.cancel_requested = True
+        with self._lock:
+            waiting = job_id in self._waiting
+            if waiting:
+                self._waiting.discard(job_id)
+                self.stats.queued -= 1
+        if waiting:
+            # its turn still comes, but it gives the worker straight back
+            self._finish(job, JobStatus.CANCELLED)
+        else:
+            self.session_manager.cancel(job_id)
+        return True
+
+    def metrics(self) -> dict[str, Any]:
+        return {**self.stats.as_dict(), "sessions": self.session_manager.stats.as_dict()}
+
+    def close(self):
+        for job in self.jobs():
+            self.cancel(job.id)
+        self.session_manager.shutdown()
+
+    async def _run(self, job: Job):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        try:
+            # the job only takes a session (and a display) once a worker is free
+            async with self._slots:
+                with self._lock:
+                    if job.id not in self._waiting:
+                        return  # cancelled while it waited
+                    self._waiting.discard(job.id)
+                    self.stats.queued -= 1
+                await self._run_session(job)
+        except Exception as error:
+            logger.exception("job %s failed", job.id)
+            self._finish(job, JobStatus.FAILED, f"{type(error).__name__}: {error}")
+        else:
+            self._finish(job, JobStatus.CANCELLED if job.cancel_requested else JobStatus.SUCCEEDED)
+
+    async def _run_session(self, job: Job):
+        manager = self.session_manager
+        session = manager.open(job.id, user=JOBS_USER)
+        session.selected_screen = job.request.screen
+        with self._lock:
+            self.stats.running += 1
+        try:
+            tools = await manager.tools(session, workspace_root=os.getenv("WORKSPACE_ROOT"))
+            job.set_status(JobStatus.RUNNING)
+
+            def steps(cancel_event: threading.Event) -> Iterator[Any]:
+                if job.cancel_requested:
+                    cancel_event.set()  # cancelled while its display was being set up
+                return self.runner(job, tools, cancel_event)
+
+            async for _ in manager.run(session, steps):
+                pass  # the runner reports progress itself
+        finally:
+            # a cancelled loop may still be finishing a step on the display and adding
+            # to the messages; the display is only reused, and the artifacts written,
+            # once it has stopped
+            await manager.wait_stopped(session)
+            with self._lock:
+                self.stats.running -= 1
+            manager.close(job.id)
+
+    def _finish(self, job: Job, status: JobStatus, error: str | None = None):
+        job.set_status(status, error)
+        try:
+            job.write_artifacts()
+        except OSError:
+            logger.exception("writing the artifacts of job %s failed", job.id)
+        with self._lock:
+            setattr(self.stats, status.value, getattr(self.stats, status.value) + 1)
+            job.settle()
+            finished = [other.id for other in self._jobs.values() if other.done]
+            for job_id in finished[: max(0, len(finished) - self.keep_finished)]:
+                del self._jobs[job_id]
+        logger.info("job %s %s", job.id, status.value)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "JobServer"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        queue = self.server.queue
+        if parts[0] == "artifacts":
+            self._artifact("/" + "/".join(parts[1:]))
+        elif parts == ["jobs"]:
+            self._json(200, [job.as_dict() for job in queue.jobs()])
+        elif parts == ["metrics"]:
+            self._json(200, queue.metrics())
+        elif len(parts) == 2 and parts[0] == "jobs":
+            job = queue.get(parts[1])
+            if job is None:
+                self._json(404, {"error": "no such job"})
+            else:
+                self._json(200, job if isinstance(job, dict) else job.as_dict())
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "events":
+            job = queue.get(parts[1])
+            if not isinstance(job, Job):
+                self._json(404, {"error": "no such job in memory"})
+                return
+            try:
+                after = int(parse_qs(url.query).get("after", ["0"])[0])
+            except ValueError:
+                self._json(400, {"error": "after must be an integer"})
+                return
+            self._stream(job, after)
+        else:
+            self._json(404, {"error": "not found"})
+
+    def do_POST(self):
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        queue = self.server.queue
+        if parts == ["jobs"]:
+            try:
+                length = int(self.headers.get("Content-Length", "0"))
+                request = JobRequest.from_json(json.loads(self.rfile.read(length) or b"null"))
+            except ValueError as error:  # includes malformed JSON
+                self._json(400, {"error": str(error)})
+                return
+            try:
+                job = queue.submit(request)
+            except QueueFullError as error:
+                self._json(503, {"error": str(error)}, {"Retry-After": "60"})
+                return
+            self._json(202, job.as_dict(), {"Location": f"/jobs/{job.id}"})
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "cancel":
+            if queue.cancel(parts[1]):
+                self._json(202, {"id": parts[1], "cancelling": True})
+            else:
+                self._json(404, {"error": "no such job, or it has finished"})
+        else:
+            self._json(404, {"error": "not found"})
+
+    def _json(self, status: int, body: Any, headers: dict[str, str] | None = None):
+        data = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, job: Job, after: int):
+        """Events as JSON lines, as they happen; the response ends with the job."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        while True:
+            events = job.wait_for_events(after, timeout=15)
+            if events:
+                self.wfile.write(
+                    "".join(json.dumps(event, default=str) + "\n" for event in events).encode()
+                )
+                self.wfile.flush()
+                after += len(events)
+            elif job.done:
+                return
+
+    def _artifact(self, path: str):
+        response = self.server.artifacts.respond(self.command, path, dict(self.headers))
+        self.send_response(response.status)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        if "Content-Length" not in response.headers:
+            self.send_header("Content-Length", str(len(response.body)))
+        self.end_headers()
+        self.wfile.write(response.body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class JobServer(ThreadingHTTPServer):
+    """The HTTP/JSON API of a `JobQueue`, one thread per connection."""
+
+    daemon_threads = True
+
+    def __init__(self, queue: JobQueue, host: str = "127.0.0.1", port: int = 8090):
+        if ":" in host:
+            self.address_family = socket.AF_INET6
+        self.queue = queue
+        self.artifacts = MediaLibrary(queue.artifacts_dir)
+        super().__init__((host, port), _Handler)
+        self._thread: threading.Thread | None = None
+
+    def handle_error(self, request, client_address):
+        error = sys.exc_info()[1]
+        if isinstance(error, ConnectionError):
+            # e.g. a client that stopped following a job's events
+            logger.debug("%s went away: %s", client_address, error)
+        else:
+            logger.exception("error serving %s", client_address)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> "JobServer":
+        """Serve from a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name="job-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def job_server_from_env() -> JobServer:
+    """
+    A server on `JOBS_HOST`:`JOBS_PORT` (default 127.0.0.1:8090) for a queue writing to
+    `JOBS_DIR` (default /tmp/jobs), with at most `JOBS_MAX_QUEUED` (default 1000) jobs
+    waiting. `JOBS_WORKERS` jobs run at once: by default 4 with `SESSION_DISPLAYS`, each
+    on a display of its own numbered from `JOBS_DISPLAY_BASE` (default 200), and 1
+    without, as they would share the screen.
+    """
+    workers = os.getenv("JOBS_WORKERS")
+    display_pool = display_pool_from_env(
+        int(workers or 4), base=int(os.getenv("JOBS_DISPLAY_BASE", "200"))
+    )
+    workers = int(workers) if workers else 4 if display_pool is not None else 1
+    queue = JobQueue(
+        os.getenv("JOBS_DIR", "/tmp/jobs"),
+        workers=workers,
+        max_queued=int(os.getenv("JOBS_MAX_QUEUED", "1000")),
+        session_manager=SessionManager(
+            max_concurrent=workers, max_per_user=workers, display_pool=display_pool
+        ),
+    )
+    return JobServer(
+        queue, host=os.getenv("JOBS_HOST", "127.0.0.1"), port=int(os.getenv("JOBS_PORT", "8090"))
+    )
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    server = job_server_from_env()
+    logger.info("serving jobs on port %s, %s at a time", server.port, server.queue.workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.queue.close()
+
+
+if __name__ == "__main__":
+    main()
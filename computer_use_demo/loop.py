@@ -2,16 +2,16 @@
 Agentic sampling loop that calls the Anthropic API and local implenmentation of anthropic-defined computer use tools.
 """
 import asyncio
+import logging
+import os
 import platform
+import threading
 from collections.abc import Callable
 from datetime import datetime
 from enum import StrEnum
 from typing import Any, cast
 
-from anthropic import Anthropic, AnthropicBedrock, AnthropicVertex, APIResponse
-from anthropic.types import (
-    ToolResultBlockParam,
-)
+from anthropic import APIResponse
 from anthropic.types.beta import (
     BetaContentBlock,
     BetaContentBlockParam,
@@ -24,7 +24,15 @@ from anthropic.types.beta import (
 from anthropic.types import TextBlock
 from anthropic.types.beta import BetaMessage, BetaTextBlock, BetaToolUseBlock
 
-from .tools import BashTool, ComputerTool, EditTool, ToolCollection, ToolResult
+from .blobs import materialize
+from .clients import get_client
+from .conversation import filter_to_n_most_recent_images
+from .event_loop import BackgroundEventLoop, get_background_loop
+from .events import EventBus
+from .render import ChatRenderer
+from .request_policy import RequestPolicy, RequestTarget
+from .scheduler import Priority
+from .tools import ToolDispatcher, ToolRegistry, ToolResult
 
 from PIL import Image
 from io import BytesIO
@@ -38,6 +46,8 @@ from computer_use_demo.autopc.actor.gpt4_actor import GPT4Actor
 from computer_use_demo.autopc.actor.base import APIProvider
 
 
+logger = logging.getLogger(__name__)
+
 BETA_FLAG = "computer-use-2024-10-22"
 
 
@@ -78,7 +88,7 @@ def decode_base64_image_and_save(base64_str):
     # 保存图像为screenshot.png
     import datetime
     image.save(f"{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.png")
-    print("screenshot saved")
+    logger.debug("screenshot saved")
     return f"{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.png"
 
 def decode_base64_image(base64_str):
@@ -103,15 +113,61 @@ async def sampling_loop(
     api_key: str,
     only_n_most_recent_images: int | None = None,
     max_tokens: int = 4096,
+    event_bus: EventBus | None = None,
+    session_id: str = "default",
 ):
     """
     Agentic sampling loop for the assistant/tool interaction of computer use.
+
+    With `event_bus`, the callbacks run on the bus instead of inside the loop.
     """
-    tool_collection = ToolCollection(
-        ComputerTool(),
-        BashTool(),
-        EditTool(),
-    )
+    subscriber = None
+    if event_bus is not None:
+        publishers, subscriber = event_bus.route(
+            {
+                "output": output_callback,
+                "tool_output": tool_output_callback,
+                "api_response": api_response_callback,
+            },
+            session=session_id,
+        )
+        output_callback = publishers["output"]
+        tool_output_callback = publishers["tool_output"]
+        api_response_callback = publishers["api_response"]
+    try:
+        return await _sampling_loop(
+            model=model,
+            provider=provider,
+            system_prompt_suffix=system_prompt_suffix,
+            messages=messages,
+            output_callback=output_callback,
+            tool_output_callback=tool_output_callback,
+            api_response_callback=api_response_callback,
+            api_key=api_key,
+            only_n_most_recent_images=only_n_most_recent_images,
+            max_tokens=max_tokens,
+        )
+    finally:
+        if subscriber is not None:
+            await asyncio.to_thread(event_bus.unsubscribe, subscriber)
+
+
+async def _sampling_loop(
+    *,
+    model: str,
+    provider: APIProvider,
+    system_prompt_suffix: str,
+    messages: list[BetaMessageParam],
+    output_callback: Callable[[BetaContentBlock], None],
+    tool_output_callback: Callable[[ToolResult, str], None],
+    api_response_callback: Callable[[APIResponse[BetaMessage]], None],
+    api_key: str,
+    only_n_most_recent_images: int | None,
+    max_tokens: int,
+):
+    tool_registry = ToolRegistry()
+    tool_collection = tool_registry.collection
+    dispatcher = ToolDispatcher(tool_collection, spawn=asyncio.ensure_future)
     system = (
         f"{SYSTEM_PROMPT}{' ' + system_prompt_suffix if system_prompt_suffix else ''}"
     )
@@ -119,26 +175,22 @@ async def sampling_loop(
     while True:
         # Action Generation
         if only_n_most_recent_images:
-            _maybe_filter_to_n_most_recent_images(messages, only_n_most_recent_images)
+            filter_to_n_most_recent_images(messages, only_n_most_recent_images)
 
-        if provider == APIProvider.ANTHROPIC:
-            client = Anthropic(api_key=api_key)
-        elif provider == APIProvider.VERTEX:
-            client = AnthropicVertex()
-        elif provider == APIProvider.BEDROCK:
-            client = AnthropicBedrock()
+        # pooled per provider and credentials, so turns reuse warm connections
+        client = get_client(provider, api_key=api_key)
 
         # Call the API
         # we use raw_response to provide debug information to streamlit. Your
         # implementation may be able call the SDK directly with:
         # `response = client.messages.create(...)` instead.
-        print(messages)
+        logger.debug("sending %d messages to %s", len(messages), model)
         raw_response = client.beta.messages.with_raw_response.create(
             max_tokens=max_tokens,
-            messages=messages,
+            messages=materialize(messages),
             model=model,
             system=system,
-            tools=tool_collection.to_params(),
+            tools=tool_registry.to_params(),
             betas=["computer-use-2024-10-22"],
             temperature=0.0,
         )
@@ -154,14 +206,21 @@ async def sampling_loop(
             }
         )
 
+        # independent tool calls run concurrently; results keep the block order
+        pending = {
+            content_block.id: dispatcher.submit(
+                content_block.name, cast(dict[str, Any], content_block.input)
+            )
+            for content_block in cast(list[BetaContentBlock], response.content)
+            if content_block.type == "tool_use"
+        }
+        dispatcher.reset()
+
         tool_result_content: list[BetaToolResultBlockParam] = []
         for content_block in cast(list[BetaContentBlock], response.content):
             output_callback(content_block)
             if content_block.type == "tool_use":
-                result = await tool_collection.run(
-                    name=content_block.name,
-                    tool_input=cast(dict[str, Any], content_block.input),
-                )
+                result = await pending[content_block.id]
                 tool_result_content.append(
                     _make_api_tool_result(result, content_block.id)
                 )
@@ -185,10 +244,147 @@ def sampling_loop_sync(
     api_key: str,
     only_n_most_recent_images: int | None = None,
     max_tokens: int = 4096,
-    selected_screen: int = 0
+    selected_screen: int = 0,
+    workspace_root: str | None = None,
+    event_loop: BackgroundEventLoop | None = None,
+    tool_registry: ToolRegistry | None = None,
+    stream: bool = False,
+    text_callback: Callable[[str], None] | None = None,
+    token_budget: int | None = None,
+    summary_model: str | None = None,
+    fallback_provider: str | None = None,
+    hedge: bool = False,
+    session_id: str = "default",
+    priority: Priority = Priority.INTERACTIVE,
+    event_bus: EventBus | None = None,
+    renderer: ChatRenderer | None = None,
+    cancel_event: threading.Event | None = None,
 ):
-    """Synchronous agentic sampling loop for the assistant/tool interaction."""
-    
+    """
+    Synchronous agentic sampling loop for the assistant/tool interaction.
+
+    Tool calls are executed on `event_loop` (the process-wide background loop by
+    default) rather than on a fresh loop per action. Pass the same `tool_registry`
+    across calls to keep one set of tools, and their state, for a whole session.
+
+    With `stream`, the Anthropic actor streams its response: text deltas go to
+    `text_callback` and each tool_use block is dispatched as soon as it is complete.
+
+    With `token_budget`, old tool outputs are compacted before a request would exceed
+    it; `summary_model` additionally lets old turns be collapsed into a summary.
+
+    Requests are retried with jittered backoff. With `fallback_provider` (credentials
+    from the environment), retries alternate with it, and with `hedge` a slow request
+    is duplicated to it and the loser cancelled.
+
+    Requests share the account's rate limits with every other session in the process;
+    `session_id` and `priority` decide where this loop queues when they are reached.
+
+    With `event_bus`, the callbacks are published as events and run on the bus's
+    threads, so a slow consumer cannot hold up the loop; they still run in order, and
+    those left over are delivered when the loop ends.
+
+    The chat rows it yields come from `renderer`; pass the session's renderer to get
+    only rows that are new since its last update.
+
+    Setting `cancel_event` stops the loop before its next request or after the row it
+    is yielding; tool calls of the interrupted turn are cancelled and answered as such,
+    so the history can be continued.
+    """
+    subscriber = None
+    if event_bus is not None:
+        publishers, subscriber = event_bus.route(
+            {
+                "output": output_callback,
+                "tool_output": tool_output_callback,
+                "api_response": api_response_callback,
+                "text": text_callback,
+            },
+            session=session_id,
+        )
+        output_callback = publishers["output"]
+        tool_output_callback = publishers["tool_output"]
+        api_response_callback = publishers["api_response"]
+        text_callback = publishers["text"]
+    try:
+        return (
+            yield from _sampling_loop_sync(
+                model=model,
+                provider=provider,
+                system_prompt_suffix=system_prompt_suffix,
+                messages=messages,
+                output_callback=output_callback,
+                tool_output_callback=tool_output_callback,
+                api_response_callback=api_response_callback,
+                api_key=api_key,
+                only_n_most_recent_images=only_n_most_recent_images,
+                max_tokens=max_tokens,
+                selected_screen=selected_screen,
+                workspace_root=workspace_root,
+                event_loop=event_loop,
+                tool_registry=tool_registry,
+                stream=stream,
+                text_callback=text_callback,
+                token_budget=token_budget,
+                summary_model=summary_model,
+                fallback_provider=fallback_provider,
+                hedge=hedge,
+                session_id=session_id,
+                priority=priority,
+                renderer=renderer,
+                cancel_event=cancel_event,
+            )
+        )
+    finally:
+        if subscriber is not None:
+            event_bus.unsubscribe(subscriber)
+
+
+def _sampling_loop_sync(
+    *,
+    model: str,
+    provider: APIProvider,
+    system_prompt_suffix: str,
+    messages: list[BetaMessageParam],
+    output_callback: Callable[[BetaContentBlock], None],
+    tool_output_callback: Callable[[ToolResult, str], None],
+    api_response_callback: Callable[[APIResponse[BetaMessage]], None],
+    api_key: str,
+    only_n_most_recent_images: int | None,
+    max_tokens: int,
+    selected_screen: int,
+    workspace_root: str | None,
+    event_loop: BackgroundEventLoop | None,
+    tool_registry: ToolRegistry | None,
+    stream: bool,
+    text_callback: Callable[[str], None] | None,
+    token_budget: int | None,
+    summary_model: str | None,
+    fallback_provider: str | None,
+    hedge: bool,
+    session_id: str,
+    priority: Priority,
+    renderer: ChatRenderer | None,
+    cancel_event: threading.Event | None,
+):
+    workspace_root = workspace_root or os.getenv("WORKSPACE_ROOT")
+    event_loop = event_loop or get_background_loop()
+    tool_registry = tool_registry or ToolRegistry(
+        selected_screen=selected_screen, workspace_root=workspace_root
+    )
+
+    request_policy = None
+    if fallback_provider:
+        request_policy = RequestPolicy(
+            RequestTarget(provider, model, api_key=api_key),
+            fallback=RequestTarget(
+                fallback_provider, PROVIDER_TO_DEFAULT_MODEL_NAME[fallback_provider]
+            ),
+            hedge=hedge,
+            session=session_id,
+            priority=priority,
+        )
+
     # Create appropriate actor based on provider
     if provider == APIProvider.ANTHROPIC:
         actor = AnthropicActor(
@@ -199,7 +395,16 @@ def sampling_loop_sync(
             api_response_callback=api_response_callback,
             max_tokens=max_tokens,
             only_n_most_recent_images=only_n_most_recent_images,
-            selected_screen=selected_screen
+            selected_screen=selected_screen,
+            workspace_root=workspace_root,
+            tool_registry=tool_registry,
+            stream=stream,
+            token_budget=token_budget,
+            summary_model=summary_model,
+            request_policy=request_policy,
+            event_loop=event_loop,
+            session_id=session_id,
+            priority=priority,
         )
     elif provider == APIProvider.GPT4:
         actor = GPT4Actor(
@@ -216,70 +421,82 @@ def sampling_loop_sync(
     executor = AnthropicExecutor(
         output_callback=output_callback,
         tool_output_callback=tool_output_callback,
-        selected_screen=selected_screen
+        selected_screen=selected_screen,
+        workspace_root=workspace_root,
+        event_loop=event_loop,
+        tool_registry=tool_registry,
+        renderer=renderer,
     )
     
-    print("Start the loop")
+    logger.info("starting the sampling loop for session %s", session_id)
     while True:
+        if cancel_event is not None and cancel_event.is_set():
+            logger.info("session %s cancelled", session_id)
+            return messages
         # from IPython.core.debugger import Pdb; Pdb().set_trace()
-        response = actor(messages=messages)
+        if getattr(actor, "stream", False):
+            try:
+                response = actor(
+                    messages=messages,
+                    on_text=text_callback,
+                    on_tool_use=executor.dispatch,
+                )
+            except BaseException:
+                # tools already started from a response that never completed
+                executor.cancel()
+                raise
+        else:
+            response = actor(messages=messages)
 
         # Example Action: BetaMessage(id='msg_01FsYVD9PkwPo6Q9vDa2SASb', content=[BetaTextBlock(text="I'll help you open a new tab. First, I'll check if a browser window is already open by taking a screenshot, and then proceed to open a new tab.", type='text'), BetaToolUseBlock(id='toolu_01C9MQvdzehkv457iee8T8M1', input={'action': 'screenshot'}, name='computer', type='tool_use')], model='claude-3-5-sonnet-20241022', role='assistant', stop_reason='tool_use', stop_sequence=None, type='message', usage=BetaUsage(cache_creation_input_tokens=None, cache_read_input_tokens=None, input_tokens=2157, output_tokens=90))
-        for message, tool_result_content in executor(response, messages):
-            yield message
-    
+        # the results are read from the executor: a response can run tools without
+        # yielding a chat row, e.g. when its message was already in the history
+        for message, _ in executor(response, messages):
+            try:
+                yield message
+            except GeneratorExit:
+                # the consumer went away mid-turn; leave a history that can be continued
+                executor.cancel()
+                _close_cancelled_turn(messages, executor.tool_results)
+                raise
+            if cancel_event is not None and cancel_event.is_set():
+                logger.info("session %s cancelled mid-turn", session_id)
+                executor.cancel()
+                _close_cancelled_turn(messages, executor.tool_results)
+                return messages
+
+        tool_result_content = executor.tool_results
         if not tool_result_content:
             return messages
 
         messages.append({"content": tool_result_content, "role": "user"})
 
-def _maybe_filter_to_n_most_recent_images(
-    messages: list[BetaMessageParam],
-    images_to_keep: int,
-    min_removal_threshold: int = 2, # 10
+
+def _close_cancelled_turn(
+    messages: list[BetaMessageParam], tool_result_content: list[BetaToolResultBlockParam]
 ):
-    """
-    With the assumption that images are screenshots that are of diminishing value as
-    the conversation progresses, remove all but the final `images_to_keep` tool_result
-    images in place, with a chunk of min_removal_threshold to reduce the amount we
-    break the implicit prompt cache.
-    """
-    if images_to_keep is None:
-        return messages
-
-    tool_result_blocks = cast(
-        list[ToolResultBlockParam],
-        [
-            item
-            for message in messages
-            for item in (
-                message["content"] if isinstance(message["content"], list) else []
+    """Answer the tool_use blocks of the last message that have no result yet."""
+    last = messages[-1]
+    if last["role"] != "assistant" or isinstance(last["content"], str):
+        return
+    answered = {result["tool_use_id"] for result in tool_result_content}
+    results = list(tool_result_content)
+    for block in last["content"]:
+        block_type = block["type"] if isinstance(block, dict) else block.type
+        if block_type != "tool_use":
+            continue
+        block_id = block["id"] if isinstance(block, dict) else block.id
+        if block_id not in answered:
+            results.append(
+                {
+                    "type": "tool_result",
+                    "tool_use_id": block_id,
+                    "content": "Cancelled by the user.",
+                    "is_error": True,
+                }
             )
-            if isinstance(item, dict) and item.get("type") == "tool_result"
-        ],
-    )
-
-    total_images = sum(
-        1
-        for tool_result in tool_result_blocks
-        for content in tool_result.get("content", [])
-        if isinstance(content, dict) and content.get("type") == "image"
-    )
-
-    images_to_remove = total_images - images_to_keep
-    # for better cache behavior, we want to remove in chunks
-    images_to_remove -= images_to_remove % min_removal_threshold
-
-    for tool_result in tool_result_blocks:
-        if isinstance(tool_result.get("content"), list):
-            new_content = []
-            for content in tool_result.get("content", []):
-                if isinstance(content, dict) and content.get("type") == "image":
-                    if images_to_remove > 0:
-                        images_to_remove -= 1
-                        continue
-                new_content.append(content)
-            tool_result["content"] = new_content
+    if results:
+        messages.append({"content": results, "role": "user"})
 
 
 def _make_api_tool_result(
@@ -0,0 +1,373 @@
+"""
+Serving of chat screenshots (from the blob store) and static content, with cache
+validation, byte ranges, gzip for text assets and thumbnails for small screens.
+
+`MediaLibrary` turns a request into a `MediaResponse` and knows nothing about the
+HTTP server; `MediaServer` is a threaded server around it, and the Gradio app routes
+its media requests to the same library.
+"""
+import email.utils
+import gzip
+import logging
+import mimetypes
+import os
+import re
+import socket
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass, field
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from PIL import Image
+
+from .blobs import BlobStore
+
+logger = logging.getLogger(__name__)
+
+# chat screenshots are served from here, by blob key
+MEDIA_PATH = "/media/blobs"
+# thumbnails fit in a box of this many pixels along the long edge
+THUMBNAIL_SIZES = {"small": 320, "medium": 640, "large": 1280}
+GZIP_TYPES = frozenset(
+    {"application/javascript", "application/json", "image/svg+xml", "application/xml"}
+)
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+@dataclass
+class MediaResponse:
+    status: int
+    headers: dict[str, str] = field(default_factory=dict)
+    body: bytes = b""
+    # a body that is only read once it is known to be sent: `size` bytes, of which
+    # `reader(start, stop)` reads a slice
+    size: int = 0
+    reader: Callable[[int, int], bytes] | None = None
+
+    @property
+    def length(self) -> int:
+        return self.size if self.reader is not None else len(self.body)
+
+    def load(self, start: int = 0, stop: int | None = None):
+        """Read the body, or its `start`:`stop` slice, if it has not been read yet."""
+        if self.reader is not None:
+            self.body = self.reader(start, self.size if stop is None else stop)
+            self.reader = None
+
+
+class LRUBytesCache:
+    """A thread-safe LRU of byte strings, bounded by their total size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict[tuple, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> bytes | None:
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key: tuple, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+def _read_file(path: Path, start: int, stop: int) -> bytes:
+    with path.open("rb") as file:
+        file.seek(start)
+        return file.read(max(0, stop - start))
+
+
+def make_thumbnail(data: bytes, edge: int) -> bytes:
+    with Image.open(BytesIO(data)) as image:
+        image.thumbnail((edge, edge))
+        buffer = BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+
+def _is_text(content_type: str) -> bool:
+    return content_type.startswith("text/") or content_type in GZIP_TYPES
+
+
+class MediaLibrary:
+    """
+    Answers GET and HEAD requests for blobs under `MEDIA_PATH` (with `?size=small`,
+    `medium` or `large` for a JPEG thumbnail) and for files under `static_dir`.
+
+    Blobs are content-addressed and served as immutable. Static files get an ETag
+    and Last-Modified. Both honor conditional requests and single byte ranges, and
+    text is gzipped for clients that accept it. Thumbnails and gzipped files are
+    kept in LRU caches.
+    """
+
+    def __init__(
+        self,
+        static_dir: str | Path | None = None,
+        blob_store: BlobStore | None = None,
+        cache_bytes: int = 32 * 1024 * 1024,
+        gzip_min_bytes: int = 512,
+    ):
+        self.static_dir = Path(static_dir).resolve() if static_dir else None
+        self.blob_store = blob_store
+        self.gzip_min_bytes = gzip_min_bytes
+        self.thumbnails = LRUBytesCache(cache_bytes)
+        self.compressed = LRUBytesCache(cache_bytes // 4)
+
+    def respond(
+        self, method: str, target: str, headers: Mapping[str, str]
+    ) -> MediaResponse:
+        """The response to `method` on `target` (path and query) with `headers`."""
+        if method not in ("GET", "HEAD"):
+            return MediaResponse(405, {"Allow": "GET, HEAD"})
+        url = urlsplit(target)
+        path = unquote(url.path)
+        try:
+            if path.startswith(MEDIA_PATH + "/") and self.blob_store is not None:
+                size = parse_qs(url.query).get("size", [None])[0]
+                response = self._blob(path[len(MEDIA_PATH) + 1 :], size)
+            else:
+                response = self._static(path)
+            response = self._negotiate(response, path, headers)
+            if method == "GET":
+                response.load()
+        except FileNotFoundError:
+            return MediaResponse(404, {"Content-Type": "text/plain"}, b"not found")
+        except ValueError as error:
+            return MediaResponse(400, {"Content-Type": "text/plain"}, str(error).encode())
+        if method == "HEAD":
+            response.headers["Content-Length"] = str(response.length)
+            response.reader, response.body = None, b""
+        return response
+
+    def _blob(self, key: str, size: str | None) -> MediaResponse:
+        if not re.fullmatch(r"[0-9a-f]{64}", key):
+            raise FileNotFoundError(key)
+        try:
+            blob_size = self.blob_store.size(key)
+        except KeyError:
+            raise FileNotFoundError(key) from None
+        headers = {
+            "Content-Type": "image/png",
+            "ETag": f'"{key}"',
+            "Cache-Control": "public, max-age=31536000, immutable",
+        }
+        if size is None:
+            # the key is the validator, so the bytes are only read if they are sent
+            return MediaResponse(
+                200, headers, size=blob_size, reader=partial(self._read_blob, key)
+            )
+        if size not in THUMBNAIL_SIZES:
+            raise ValueError(f"size must be one of {', '.join(THUMBNAIL_SIZES)}")
+        cached = self.thumbnails.get((key, size))
+        if cached is None:
+            cached = make_thumbnail(self._read_blob(key), THUMBNAIL_SIZES[size])
+            self.thumbnails.put((key, size), cached)
+        headers.update({"Content-Type": "image/jpeg", "ETag": f'"{key}-{size}"'})
+        return MediaResponse(200, headers, cached)
+
+    def _read_blob(self, key: str, start: int = 0, stop: int | None = None) -> bytes:
+        try:
+            return self.blob_store.read(key, start, stop)
+        except KeyError:
+            raise FileNotFoundError(key) from None
+
+    def _static(self, path: str) -> MediaResponse:
+        if self.static_dir is None:
+            raise FileNotFoundError(path)
+        file = (self.static_dir / path.lstrip("/")).resolve()
+        if not file.is_relative_to(self.static_dir):
+            raise FileNotFoundError(path)
+        if file.is_dir():
+            file = file / "index.html"
+        stat = file.stat()
+        content_type = mimetypes.guess_type(file.name)[0] or "application/octet-stream"
+        # the validators come from the stat; the file is only read if it is sent
+        return MediaResponse(
+            200,
+            {
+                "Content-Type": content_type,
+                "ETag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+                "Last-Modified": email.utils.formatdate(stat.st_mtime, usegmt=True),
+                "Cache-Control": "no-cache",
+            },
+            size=stat.st_size,
+            reader=partial(_read_file, file),
+        )
+
+    def _negotiate(
+        self, response: MediaResponse, path: str, headers: Mapping[str, str]
+    ) -> MediaResponse:
+        """Apply conditional request, byte range and content encoding headers."""
+        headers = {name.lower(): value for name, value in headers.items()}
+        etag = response.headers["ETag"]
+        response.headers["Accept-Ranges"] = "bytes"
+        if _not_modified(response, headers):
+            return MediaResponse(304, {"ETag": etag, **_caching(response.headers)})
+
+        content_type = response.headers["Content-Type"]
+        range_header = headers.get("range")
+        if range_header and headers.get("if-range", etag) == etag:
+            return _ranged(response, range_header)
+
+        if (
+            _is_text(content_type)
+            and response.length >= self.gzip_min_bytes
+            and "gzip" in headers.get("accept-encoding", "")
+        ):
+            key = (path, etag)
+            compressed = self.compressed.get(key)
+            if compressed is None:
+                response.load()
+                compressed = gzip.compress(response.body, compresslevel=6, mtime=0)
+                self.compressed.put(key, compressed)
+            response.reader, response.body = None, compressed
+            response.headers["Content-Encoding"] = "gzip"
+            # a different representation, so a different validator
+            response.headers["ETag"] = etag[:-1] + '-gzip"'
+        if _is_text(content_type):
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+def _caching(headers: Mapping[str, str]) -> dict[str, str]:
+    return {name: headers[name] for name in ("Cache-Control", "Last-Modified") if name in headers}
+
+
+def _not_modified(response: MediaResponse, headers: Mapping[str, str]) -> bool:
+    etag = response.headers["ETag"]
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip() for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags or etag[:-1] + '-gzip"' in tags
+    since = headers.get("if-modified-since")
+    modified = response.headers.get("Last-Modified")
+    if since and modified:
+        try:
+            return email.utils.parsedate_to_datetime(
+                modified
+            ) <= email.utils.parsedate_to_datetime(since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _ranged(response: MediaResponse, range_header: str) -> MediaResponse:
+    size = response.length
+    match = _RANGE.match(range_header.strip())
+    if match is None or match.groups() == ("", ""):
+        return response  # multiple or malformed ranges: send it all
+    start, end = match.groups()
+    if start:
+        first, last = int(start), min(int(end) if end else size - 1, size - 1)
+    else:
+        first, last = max(0, size - int(end)), size - 1
+    if first > last or first >= size:
+        return MediaResponse(416, {"Content-Range": f"bytes */{size}"})
+    response.status = 206
+    response.headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+    if response.reader is not None:
+        response.load(first, last + 1)  # only the range is read
+    else:
+        response.body = response.body[first : last + 1]
+    return response
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "MediaServer"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._respond()
+
+    def do_HEAD(self):
+        self._respond()
+
+    def _respond(self):
+        response = self.server.library.respond(self.command, self.path, dict(self.headers))
+        self.send_response(response.status)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        if "Content-Length" not in response.headers:
+            self.send_header("Content-Length", str(len(response.body)))
+        self.end_headers()
+        if response.body:
+            self.wfile.write(response.body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class MediaServer(ThreadingHTTPServer):
+    """
+    A `MediaLibrary` over HTTP/1.1 with keep-alive, one thread per connection, so a
+    slow client only holds up its own connection.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, library: MediaLibrary, host: str = "", port: int = 8080):
+        if ":" in host:
+            self.address_family = socket.AF_INET6
+        self.library = library
+        super().__init__((host, port), _Handler)
+        self._thread: threading.Thread | None = None
+
+    def handle_error(self, request, client_address):
+        error = sys.exc_info()[1]
+        if isinstance(error, ConnectionError):
+            # clients hang up mid-response all the time, e.g. phones leaving the page
+            logger.debug("%s went away: %s", client_address, error)
+        else:
+            logger.exception("error serving %s", client_address)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> "MediaServer":
+        """Serve from a background thread."""
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="media-server", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def media_server_from_env(blob_store: BlobStore | None = None) -> MediaServer:
+    """A server for `MEDIA_STATIC_DIR` on `MEDIA_HOST`:`MEDIA_PORT` (default 8080)."""
+    return MediaServer(
+        MediaLibrary(os.getenv("MEDIA_STATIC_DIR"), blob_store),
+        host=os.getenv("MEDIA_HOST", ""),
+        port=int(os.getenv("MEDIA_PORT", "8080")),
+    )
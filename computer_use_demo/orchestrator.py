@@ -0,0 +1,183 @@
+"""
+Fan-out of a task that splits into independent subtasks ("collect prices from five
+sites"). Each subtask runs as a job of a `JobQueue`: a session of its own, on a display
+of its own if the queue has a display pool, starting from a history of just its
+prompt. They run side by side instead of one after another in a single conversation,
+and no request carries the other subtasks' screenshots. The answers are merged back
+in subtask order.
+"""
+import logging
+import time
+from collections.abc import Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Any
+
+from .jobs import FINAL_STATUSES, Job, JobQueue, JobRequest, JobStatus, QueueFullError
+
+logger = logging.getLogger(__name__)
+
+TIMED_OUT = "timed_out"
+
+
+@dataclass
+class SubtaskResult:
+    index: int
+    prompt: str
+    status: str  # the job's final status, or TIMED_OUT
+    text: str | None = None  # the agent's answer
+    error: str | None = None
+    job_id: str | None = None
+    seconds: float | None = None  # from submission, time in the queue included
+    max_input_tokens: int | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "succeeded"
+
+    def as_dict(self) -> dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__dataclass_fields__}
+
+
+@dataclass
+class FanOutResult:
+    results: list[SubtaskResult]
+    seconds: float
+
+    @property
+    def ok(self) -> bool:
+        return all(result.ok for result in self.results)
+
+    @property
+    def max_input_tokens(self) -> int | None:
+        """The largest prompt any subtask sent."""
+        tokens = [r.max_input_tokens for r in self.results if r.max_input_tokens is not None]
+        return max(tokens) if tokens else None
+
+    def merged(self) -> str:
+        """The answers as one text, a section per subtask, failures included."""
+        sections = []
+        for result in self.results:
+            if result.ok:
+                body = result.text or "(no answer)"
+            elif result.status == TIMED_OUT:
+                body = f"(timed out after {result.seconds:.0f}s)"
+            else:
+                body = f"({result.status}: {result.error or 'no answer'})"
+            sections.append(f"## Subtask {result.index + 1}: {result.prompt}\n\n{body}")
+        return "\n\n".join(sections)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "ok": self.ok,
+            "seconds": round(self.seconds, 3),
+            "max_input_tokens": self.max_input_tokens,
+            "results": [result.as_dict() for result in self.results],
+        }
+
+
+class Orchestrator:
+    """
+    Runs lists of subtasks on `queue`, at most `concurrency` of one list at a time
+    (the queue's own worker limit still applies on top) and each for at most `timeout`
+    seconds. The timeout counts from when the subtask's job starts running, so time
+    spent waiting for a queue worker or a display does not count against it; a subtask
+    that runs over is cancelled.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        concurrency: int | None = None,
+        timeout: float | None = None,
+        cancel_grace: float = 30.0,
+    ):
+        self.queue = queue
+        self.concurrency = concurrency or queue.workers
+        self.timeout = timeout
+        # how long a cancelled subtask gets to stop before it is given up on
+        self.cancel_grace = cancel_grace
+
+    def run(
+        self,
+        subtasks: Sequence[str | JobRequest],
+        template: JobRequest | None = None,
+        concurrency: int | None = None,
+        timeout: float | None = None,
+        on_result: Callable[[SubtaskResult], None] | None = None,
+    ) -> FanOutResult:
+        """
+        Run `subtasks` and wait for all of them. Prompts given as strings take the
+        provider, model and other settings of `template`. `on_result` is called as
+        each subtask ends, in whatever order they do.
+        """
+        template = template or JobRequest(prompt="")
+        requests = [
+            subtask if isinstance(subtask, JobRequest) else replace(template, prompt=subtask)
+            for subtask in subtasks
+        ]
+        concurrency = max(1, min(concurrency or self.concurrency, len(requests) or 1))
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+
+        def run_one(index: int) -> SubtaskResult:
+            result = self._run_subtask(index, requests[index], timeout)
+            if on_result is not None:
+                on_result(result)
+            return result
+
+        with ThreadPoolExecutor(concurrency, thread_name_prefix="fan-out") as pool:
+            results = list(pool.map(run_one, range(len(requests))))
+        outcome = FanOutResult(results, time.monotonic() - start)
+        logger.info(
+            "fan-out of %d subtasks finished in %.1fs, %d succeeded",
+            len(results),
+            outcome.seconds,
+            sum(result.ok for result in results),
+        )
+        return outcome
+
+    def _run_subtask(self, index: int, request: JobRequest, timeout: float | None) -> SubtaskResult:
+        start = time.monotonic()
+        try:
+            job = self.queue.submit(request)
+        except QueueFullError as error:
+            return SubtaskResult(index, request.prompt, "failed", error=str(error))
+        deadline = None
+        if timeout is not None:
+            self._wait_started(job)
+            deadline = time.monotonic() + timeout
+        timed_out = not self._wait(job, deadline)
+        if timed_out:
+            logger.info("subtask %d (job %s) timed out", index, job.id)
+            self.queue.cancel(job.id)
+            self._wait(job, time.monotonic() + self.cancel_grace)
+        return SubtaskResult(
+            index,
+            request.prompt,
+            TIMED_OUT if timed_out else job.status.value,
+            text=job.final_text(),
+            error=job.error,
+            job_id=job.id,
+            seconds=time.monotonic() - start,
+            max_input_tokens=job.max_input_tokens,
+        )
+
+    @staticmethod
+    def _wait_started(job: Job):
+        """Wait until the job has left the queue, to run or because it ended there."""
+        while True:
+            seen = len(job.events)  # status changes are events
+            if job.status != JobStatus.QUEUED or job.done:
+                return
+            job.wait_for_events(seen)
+
+    @staticmethod
+    def _wait(job: Job, deadline: float | None) -> bool:
+        """Wait until the job is done or the deadline passes; whether it is done."""
+        while not job.done:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return job.status in FINAL_STATUSES
+            job.wait_for_events(len(job.events), timeout=remaining)
+        return True
@@ -0,0 +1,178 @@
+"""
+Pre-encoded `messages` for Messages API requests. Past messages do not change from one
+turn to the next, so each is serialized to JSON once and its bytes reused; the pooled
+clients' transports splice them into the request body in place of a small marker.
+"""
+import base64
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+import weakref
+from dataclasses import dataclass
+from typing import Any
+
+from .blobs import ImageRef
+from .tokens import message_tokens
+
+logger = logging.getLogger(__name__)
+
+MARKER_KEY = "$encoded_messages"
+# httpx before 0.28 serializes JSON with spaces after separators
+_MARKER = re.compile(rb'\[\s*\{\s*"\$encoded_messages"\s*:\s*"([0-9a-f]{32})"\s*\}\s*\]')
+# ImageRefs are serialized as this placeholder, and only turned into base64 on send
+_BLOB = re.compile(rb'"\\u0000blob:([0-9a-f]{64})"')
+
+Fragment = tuple[bytes | ImageRef, ...]
+
+
+class EncodedMessages(list):
+    """
+    What the SDK gets as `messages`: a one-element list holding a marker the transport
+    replaces with the encoded messages. `messages` keeps the originals, and `tokens`
+    their estimated sizes.
+    """
+
+    def __init__(self, messages: list[Any], fragments: list[Fragment], tokens: list[int]):
+        self.token = uuid.uuid4().hex
+        super().__init__([{MARKER_KEY: self.token}])
+        self.messages = messages
+        self.fragments = fragments
+        self.tokens = tokens
+        with _pending_lock:
+            _pending[self.token] = self
+
+    def body(self) -> bytes:
+        """The JSON array of all messages, with images base64-encoded."""
+        parts = [b"["]
+        for i, fragment in enumerate(self.fragments):
+            if i:
+                parts.append(b",")
+            for part in fragment:
+                if isinstance(part, ImageRef):
+                    parts += (b'"', base64.b64encode(part.data()), b'"')
+                else:
+                    parts.append(part)
+        parts.append(b"]")
+        return b"".join(parts)
+
+
+# requests in flight, by token; an entry goes away with the request's arguments
+_pending: "weakref.WeakValueDictionary[str, EncodedMessages]" = weakref.WeakValueDictionary()
+_pending_lock = threading.Lock()
+
+
+def splice(body: bytes) -> bytes | None:
+    """The request body with its marker replaced by the messages; None if it has none."""
+    match = _MARKER.search(body)
+    if match is None:
+        if MARKER_KEY.encode() in body:
+            # sending the marker itself would leave the request without its messages
+            raise RuntimeError("request has an encoded messages marker that cannot be spliced")
+        return None
+    with _pending_lock:
+        encoded = _pending.get(match.group(1).decode())
+    if encoded is None:
+        raise RuntimeError("request refers to encoded messages that no longer exist")
+    return body[: match.start()] + encoded.body() + body[match.end() :]
+
+
+def _jsonable(value: Any, refs: dict[str, ImageRef]) -> Any:
+    if isinstance(value, dict):
+        return {key: _jsonable(item, refs) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item, refs) for item in value]
+    if isinstance(value, ImageRef):
+        refs[value.key] = value
+        return f"\0blob:{value.key}"
+    if hasattr(value, "model_dump"):
+        # what the SDK does with the pydantic blocks of API responses
+        return value.model_dump(exclude_unset=True, mode="json")
+    return value
+
+
+def encode_message(message: Any) -> Fragment:
+    refs: dict[str, ImageRef] = {}
+    data = json.dumps(
+        _jsonable(message, refs), ensure_ascii=False, separators=(",", ":"), allow_nan=False
+    ).encode()
+    if not refs:
+        return (data,)
+    parts: list[bytes | ImageRef] = []
+    for i, piece in enumerate(_BLOB.split(data)):
+        # split() alternates text with the captured blob keys
+        parts.append(refs[piece.decode()] if i % 2 else piece)
+    return tuple(parts)
+
+
+def _fingerprint(message: Any) -> tuple:
+    """
+    The objects a message is made of, down to tool_result contents. History is edited
+    by replacing these (image pruning, compaction), so comparing them by identity tells
+    whether a cached encoding is still valid. Holding them also keeps ids from reuse.
+    """
+    content = message.get("content") if isinstance(message, dict) else None
+    if not isinstance(content, list):
+        return (message, content)
+    parts: list[Any] = [message, content]
+    for block in content:
+        parts.append(block)
+        if isinstance(block, dict):
+            parts.append(block.get("content"))
+    return tuple(parts)
+
+
+def _same(a: tuple, b: tuple) -> bool:
+    return len(a) == len(b) and all(x is y for x, y in zip(a, b))
+
+
+@dataclass
+class EncoderStats:
+    hits: int = 0
+    misses: int = 0
+    encode_seconds: float = 0.0  # CPU time spent in `encode`
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "encode_seconds": round(self.encode_seconds, 6),
+        }
+
+
+class MessageEncoder:
+    """
+    Caches the JSON encoding and token estimate of every message of one conversation.
+    Each `encode` re-encodes only new or edited messages and forgets those no longer
+    in the list.
+
+    Edit messages by replacing their content (or a tool_result's content), as the rest
+    of this package does; mutating a text block's fields in place goes unnoticed.
+    """
+
+    def __init__(self):
+        self._cache: dict[int, tuple[tuple, Fragment, int]] = {}
+        self.stats = EncoderStats()
+
+    def encode(self, messages: list[Any]) -> EncodedMessages:
+        start = time.process_time()
+        cache: dict[int, tuple[tuple, Fragment, int]] = {}
+        fragments = []
+        sizes = []
+        for message in messages:
+            fingerprint = _fingerprint(message)
+            cached = self._cache.get(id(message))
+            if cached is not None and _same(cached[0], fingerprint):
+                _, fragment, size = cached
+                self.stats.hits += 1
+            else:
+                fragment, size = encode_message(message), message_tokens(message)
+                self.stats.misses += 1
+            cache[id(message)] = (fingerprint, fragment, size)
+            fragments.append(fragment)
+            sizes.append(size)
+        self._cache = cache
+        self.stats.encode_seconds += time.process_time() - start
+        return EncodedMessages(list(messages), fragments, sizes)
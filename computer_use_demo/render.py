@@ -0,0 +1,106 @@
+"""
+Incremental rendering of the message history into (user, bot) chat rows for the
+Gradio view. Each message is rendered once, and screenshots are referenced by URL
+rather than embedded as base64, so an update only carries the rows that are new.
+"""
+import logging
+import os
+from collections import deque
+from collections.abc import Callable
+
+from anthropic.types import TextBlock
+from anthropic.types.beta import BetaMessageParam, BetaTextBlock, BetaToolUseBlock
+
+from .blobs import ImageRef
+from .conversation import IncrementalIndex
+from .media import MEDIA_PATH
+
+logger = logging.getLogger(__name__)
+
+Row = list[str | None]  # [user message, bot message]
+
+
+def blob_url(image: ImageRef) -> str:
+    base = os.getenv("MEDIA_BASE_URL", "").rstrip("/")
+    return f"{base}{MEDIA_PATH}/{image.key}"
+
+
+def _image_src(data: "str | ImageRef", image_url: Callable[[ImageRef], str]) -> str:
+    if isinstance(data, ImageRef):
+        return image_url(data)
+    # an image that never went through the blob store
+    return f"data:image/png;base64,{data}"
+
+
+def render_message(
+    message: BetaMessageParam, image_url: Callable[[ImageRef], str] = blob_url
+) -> Row | None:
+    """The chat row for a message, from its first content block; None if it has none."""
+    content = message["content"]
+    if isinstance(content, str):
+        return [content, None] if message["role"] == "user" else [None, content]
+    if not content:
+        return None
+    block = content[0]
+    if isinstance(block, TextBlock):
+        return [block.text, None]
+    if isinstance(block, BetaTextBlock):
+        return [None, block.text]
+    if isinstance(block, BetaToolUseBlock):
+        return [None, f"Tool Use: {block.name}\nInput: {block.input}"]
+    if isinstance(block, dict) and block.get("type") == "tool_result":
+        items = block.get("content")
+        if not isinstance(items, list) or not items:
+            return None
+        last = items[-1]
+        if last.get("type") == "image":
+            return [None, f'<img src="{_image_src(last["source"]["data"], image_url)}">']
+        if last.get("type") == "text":
+            return [None, last["text"]]
+    if isinstance(block, dict) and block.get("type") == "text":
+        text = block["text"]
+        return [text, None] if message["role"] == "user" else [None, text]
+    logger.debug("no display for a %s block", type(block).__name__)
+    return None
+
+
+class ChatRenderer(IncrementalIndex):
+    """
+    Chat rows of a message list, with a cursor into it: `update` renders only the
+    messages appended since the previous call and returns their rows. `rows` holds
+    every row so far, for the chat component. If the history is rewritten (e.g. by
+    compaction), the rows are rebuilt from the start.
+
+    The renderer keeps the last `max_images` images it rendered alive, so their URLs
+    stay valid while the rows are on screen; older ones go once nothing else refers
+    to them.
+    """
+
+    def __init__(
+        self, image_url: Callable[[ImageRef], str] = blob_url, max_images: int | None = 50
+    ):
+        self.image_url = image_url
+        self.max_images = max_images
+        self.rows: list[Row] = []
+        super().__init__()
+
+    def _reset(self):
+        super()._reset()
+        self.rows.clear()
+        self._images: deque[ImageRef] = deque(maxlen=self.max_images)
+        self._new: list[Row] = []
+
+    def _add(self, message: BetaMessageParam):
+        row = render_message(message, self._remember)
+        if row is not None:
+            self.rows.append(row)
+            self._new.append(row)
+
+    def _remember(self, image: ImageRef) -> str:
+        self._images.append(image)
+        return self.image_url(image)
+
+    def update(self, messages: list[BetaMessageParam]) -> list[Row]:
+        self._new = []
+        self._scan(messages)
+        return self._new
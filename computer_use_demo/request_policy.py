@@ -0,0 +1,368 @@
+"""
+Retry, deadline and hedging policy for Messages API requests, across the Anthropic,
+Bedrock and Vertex providers.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import Counter, deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any
+
+import anthropic
+import httpx
+from anthropic.types.beta import BetaMessage
+
+from .clients import get_async_client
+from .scheduler import Priority, estimate_input_tokens, get_scheduler
+
+logger = logging.getLogger(__name__)
+
+# 529 is "overloaded"; 408 and 409 are documented as safe to retry
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429, 500, 502, 503, 504, 529})
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 4
+    base_delay: float = 0.5  # seconds
+    max_delay: float = 16.0  # seconds
+    # deadline for a single request once admitted by the scheduler; None waits forever
+    attempt_timeout: float | None = 120.0
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        """Full-jitter exponential backoff before retry number `attempt` (from 1)."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+@dataclass(frozen=True)
+class RequestTarget:
+    """One provider to send requests to, with the model name it knows the model by."""
+
+    provider: str
+    model: str
+    api_key: str | None = None
+    region: str | None = None
+    base_url: str | None = None
+
+    @property
+    def name(self) -> str:
+        return str(getattr(self.provider, "value", self.provider))
+
+    def client(self):
+        # the policy retries on its own, so the SDK's built-in retries are disabled
+        return get_async_client(
+            self.provider, self.api_key, self.region, self.base_url
+        ).with_options(max_retries=0)
+
+    def scheduler(self):
+        return get_scheduler(self.provider, self.api_key, self.region, self.base_url)
+
+
+class LatencyTracker:
+    """Latencies of recent successful requests, for percentile-based hedging."""
+
+    def __init__(self, window: int = 100):
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> float | None:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+@dataclass
+class RequestMetrics:
+    requests: int = 0
+    attempts: int = 0
+    retries: int = 0
+    timeouts: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    failures: int = 0
+    errors: Counter = field(default_factory=Counter)  # by status code or error type
+    latency: dict[str, LatencyTracker] = field(default_factory=dict)  # by target
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failures": self.failures,
+            "errors": dict(self.errors),
+            "latency": {
+                name: {"p50": tracker.percentile(0.5), "p95": tracker.percentile(0.95)}
+                for name, tracker in self.latency.items()
+            },
+        }
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, anthropic.APIConnectionError)):
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def _error_kind(error: BaseException) -> str:
+    if isinstance(error, anthropic.APIStatusError):
+        return str(error.status_code)
+    return type(error).__name__
+
+
+def _retry_after(error: BaseException) -> float | None:
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class StreamedResponse:
+    """
+    What `RequestPolicy.stream` returns, in place of the `APIResponse` of `create`: the
+    HTTP response's `headers` and `elapsed`, and `parse()` for the final message.
+    """
+
+    def __init__(self, http_response: httpx.Response, message: BetaMessage):
+        self.http_response = http_response
+        self._message = message
+
+    @property
+    def headers(self) -> httpx.Headers:
+        return self.http_response.headers
+
+    @property
+    def elapsed(self) -> timedelta:
+        return self.http_response.elapsed
+
+    def parse(self) -> BetaMessage:
+        return self._message
+
+
+class RequestPolicy:
+    """
+    Sends `beta.messages.create` requests, and streams, with:
+
+    * jittered exponential backoff on retryable errors (429, 5xx, 529 overloaded,
+      connection errors), honoring `retry-after`; retries alternate between the
+      primary and the fallback target when one is configured;
+    * a deadline per request (`RetryPolicy.attempt_timeout`);
+    * with `hedge`, a duplicate request to the fallback target when the primary has
+      not answered within its recent p95 latency. Whichever answers first wins and the
+      other request is cancelled.
+
+    Every request, retries and hedges included, is first admitted by the target
+    account's shared `RequestScheduler`, as `session` with `priority`.
+
+    Requests use the pooled async clients and must run on one event loop, e.g. via
+    `BackgroundEventLoop.run(policy.create(...))`.
+    """
+
+    def __init__(
+        self,
+        primary: RequestTarget,
+        fallback: RequestTarget | None = None,
+        retry: RetryPolicy | None = None,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95,
+        initial_hedge_delay: float = 10.0,  # seconds, until enough latencies are known
+        min_hedge_delay: float = 0.5,  # seconds
+        min_samples: int = 5,
+        session: str = "default",
+        priority: Priority = Priority.INTERACTIVE,
+    ):
+        self.primary = primary
+        self.fallback = fallback
+        self.retry = retry or RetryPolicy()
+        self.hedge = hedge and fallback is not None
+        self.hedge_quantile = hedge_quantile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        self.session = session
+        self.priority = priority
+        self.metrics = RequestMetrics()
+
+    def _latency(self, target: RequestTarget) -> LatencyTracker:
+        return self.metrics.latency.setdefault(target.name, LatencyTracker())
+
+    def hedge_delay(self) -> float:
+        """How long to wait for the primary before sending the hedged duplicate."""
+        tracker = self._latency(self.primary)
+        if len(tracker) < self.min_samples:
+            return self.initial_hedge_delay
+        return max(self.min_hedge_delay, tracker.percentile(self.hedge_quantile) or 0.0)
+
+    async def create(self, **kwargs) -> Any:
+        """
+        `client.beta.messages.with_raw_response.create(**kwargs)` under this policy;
+        `model` is taken from the target that serves the request.
+        """
+        return await self._send(lambda target: self._attempt(target, kwargs))
+
+    async def stream(
+        self, on_event: Callable[[Any], None] | None = None, **kwargs
+    ) -> StreamedResponse:
+        """
+        `client.beta.messages.stream(**kwargs)` under this policy, passing each event
+        to `on_event` as it arrives. An attempt that fails before its first event is
+        retried like `create`'s; after that the error is raised, as another attempt
+        would repeat the events. Streams are not hedged, for the same reason.
+        """
+        delivered = False
+
+        def deliver(event: Any):
+            nonlocal delivered
+            delivered = True
+            if on_event is not None:
+                on_event(event)
+
+        return await self._send(
+            lambda target: self._call(target, kwargs, on_event=deliver),
+            can_retry=lambda: not delivered,
+        )
+
+    async def _send(
+        self,
+        attempt_on: Callable[[RequestTarget], Awaitable[Any]],
+        can_retry: Callable[[], bool] | None = None,
+    ) -> Any:
+        self.metrics.requests += 1
+        targets = [self.primary] + ([self.fallback] if self.fallback else [])
+        for attempt in range(1, self.retry.max_attempts + 1):
+            target = targets[(attempt - 1) % len(targets)]
+            self.metrics.attempts += 1
+            try:
+                return await attempt_on(target)
+            except Exception as error:
+                if isinstance(error, asyncio.TimeoutError):
+                    self.metrics.timeouts += 1
+                self.metrics.errors[_error_kind(error)] += 1
+                if (
+                    not is_retryable(error)
+                    or attempt == self.retry.max_attempts
+                    or (can_retry is not None and not can_retry())
+                ):
+                    self.metrics.failures += 1
+                    raise
+                delay = self.retry.backoff(attempt, _retry_after(error))
+                self.metrics.retries += 1
+                logger.warning(
+                    "request to %s failed (%s); retry %d/%d in %.2fs",
+                    target.name,
+                    _error_kind(error),
+                    attempt,
+                    self.retry.max_attempts - 1,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
+
+    async def _call(
+        self,
+        target: RequestTarget,
+        kwargs: dict[str, Any],
+        on_event: Callable[[Any], None] | None = None,
+    ) -> Any:
+        scheduler = target.scheduler()
+        reservation = await scheduler.acquire(
+            self.session,
+            self.priority,
+            input_tokens=estimate_input_tokens(kwargs),
+            output_tokens=kwargs.get("max_tokens", 0),
+        )
+        usage = None
+        try:
+            # the deadline starts once admitted; time spent queued does not count
+            async with asyncio.timeout(self.retry.attempt_timeout):
+                start = time.monotonic()
+                if on_event is None:
+                    response = await target.client().beta.messages.with_raw_response.create(
+                        **{**kwargs, "model": target.model}
+                    )
+                else:
+                    response = await self._stream(target, kwargs, on_event)
+            latency = time.monotonic() - start
+            self._latency(target).record(latency)
+            logger.debug("request to %s took %.2fs", target.name, latency)
+            usage = response.parse().usage
+            scheduler.observe(response.headers)
+            return response
+        except anthropic.RateLimitError as error:
+            scheduler.throttled(_retry_after(error))
+            raise
+        finally:
+            scheduler.settle(reservation, usage)
+
+    @staticmethod
+    async def _stream(
+        target: RequestTarget, kwargs: dict[str, Any], on_event: Callable[[Any], None]
+    ) -> StreamedResponse:
+        async with target.client().beta.messages.stream(
+            **{**kwargs, "model": target.model}
+        ) as stream:
+            async for event in stream:
+                on_event(event)
+            message = await stream.get_final_message()
+        return StreamedResponse(stream.response, message)
+
+    async def _attempt(self, target: RequestTarget, kwargs: dict[str, Any]) -> Any:
+        if not (self.hedge and target is self.primary):
+            return await self._call(target, kwargs)
+
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(self._call(self.primary, kwargs))
+        hedged = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+
+            self.metrics.hedges += 1
+            logger.info(
+                "%s has not answered within %.2fs; hedging to %s",
+                self.primary.name,
+                delay,
+                self.fallback.name,
+            )
+            hedged = asyncio.ensure_future(self._call(self.fallback, kwargs))
+            pending = {primary, hedged}
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedged:
+                            self.metrics.hedge_wins += 1
+                        return task.result()
+            # both failed; report the primary's error
+            return primary.result()
+        finally:
+            # cancel the loser, or both when the attempt's deadline has passed
+            for task in (primary, hedged):
+                if task is not None and not task.done():
+                    task.cancel()
@@ -0,0 +1,328 @@
+"""
+Process-wide scheduling of Messages API requests under the account's rate limits:
+requests, input tokens and output tokens per minute, per provider.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any
+
+from .clients import ClientKey, ClientRegistry
+from .tokens import message_tokens, text_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Lower values are served first."""
+
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+@dataclass(frozen=True)
+class RateLimits:
+    """Limits per `period` seconds; None means unlimited."""
+
+    requests: int | None = None
+    input_tokens: int | None = None
+    output_tokens: int | None = None
+    period: float = 60.0
+    # stay slightly below the limits, so clock skew does not turn into 429s
+    utilization: float = 0.95
+
+    @classmethod
+    def from_env(cls) -> "RateLimits":
+        def limit(name: str) -> int | None:
+            value = os.getenv(name)
+            return int(value) if value else None
+
+        return cls(
+            requests=limit("ANTHROPIC_REQUESTS_PER_MINUTE"),
+            input_tokens=limit("ANTHROPIC_INPUT_TOKENS_PER_MINUTE"),
+            output_tokens=limit("ANTHROPIC_OUTPUT_TOKENS_PER_MINUTE"),
+        )
+
+
+class TokenBucket:
+    """
+    Refills continuously at `limit / period` up to `limit`. The level may go negative
+    when a request turns out to have cost more than estimated; that debt is paid back
+    before anything else is admitted.
+    """
+
+    def __init__(
+        self,
+        limit: float,
+        period: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.capacity = limit
+        self.rate = limit / period
+        self.clock = clock
+        self._level = limit
+        self._updated = clock()
+
+    @property
+    def level(self) -> float:
+        now = self.clock()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+        return self._level
+
+    def time_until(self, amount: float) -> float:
+        """Seconds until `amount` is available; requests above capacity need a full bucket."""
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def consume(self, amount: float):
+        self._level = self.level - amount
+
+    def refund(self, amount: float):
+        """Give back (or, if negative, charge) the difference to an estimate."""
+        self._level = min(self.capacity, self.level + amount)
+
+    def clamp(self, remaining: float):
+        """Align with the server's view, e.g. an `anthropic-ratelimit-*-remaining` header."""
+        self._level = min(self.level, remaining)
+
+
+def estimate_input_tokens(request: Mapping[str, Any]) -> int:
+    """Rough input token count of a Messages API request."""
+    system = request.get("system") or ""
+    if not isinstance(system, str):
+        system = "".join(block.get("text", "") for block in system)
+    tools = request.get("tools") or []
+    messages = request.get("messages", [])
+    # pre-encoded messages (see payload_cache) carry estimates cached per message
+    sizes = getattr(messages, "tokens", None)
+    if sizes is None:
+        sizes = [message_tokens(message) for message in messages]
+    return text_tokens(system) + text_tokens(repr(tools)) + sum(sizes)
+
+
+@dataclass
+class Reservation:
+    session: str
+    priority: Priority
+    input_tokens: int
+    output_tokens: int
+    queued: float = 0.0  # seconds spent waiting for admission
+
+
+@dataclass
+class _Waiter:
+    reservation: Reservation
+    future: asyncio.Future
+    enqueued: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class SchedulerMetrics:
+    admitted: int = 0
+    queued: int = 0  # requests that had to wait at all
+    wait_seconds: float = 0.0
+    throttled: int = 0  # 429s reported back
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "throttled": self.throttled,
+        }
+
+
+class RequestScheduler:
+    """
+    Admits requests to one provider account when its request and token buckets allow.
+    Waiting requests are served by priority class, and round-robin across sessions
+    within a class, so a session with a long backlog cannot starve the others.
+
+    Input tokens are estimated from the request and output tokens reserved at
+    `max_tokens`; `settle` corrects both from the response's usage. A 429 pauses all
+    admissions for its `retry-after`, instead of letting every waiter retry at once.
+
+    Futures and timers belong to the event loop the scheduler is used on; like the
+    async clients, it is meant to be driven from the background loop.
+    """
+
+    def __init__(
+        self,
+        limits: RateLimits | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.clock = clock
+        self.metrics = SchedulerMetrics()
+        self._buckets: dict[str, TokenBucket] = {}
+        self._queues: dict[Priority, OrderedDict[str, deque[_Waiter]]] = {
+            priority: OrderedDict() for priority in Priority
+        }
+        self._paused_until = 0.0
+        self._timer: asyncio.TimerHandle | None = None
+        limits = limits or RateLimits.from_env()
+        # limits that were configured are kept; otherwise they come from the headers
+        self._explicit = any((limits.requests, limits.input_tokens, limits.output_tokens))
+        self.configure(limits)
+
+    def configure(self, limits: RateLimits):
+        self.limits = limits
+        self._buckets = {
+            name: TokenBucket(value * limits.utilization, limits.period, self.clock)
+            for name in ("requests", "input_tokens", "output_tokens")
+            if (value := getattr(limits, name))
+        }
+
+    @property
+    def pending(self) -> int:
+        return sum(len(q) for queues in self._queues.values() for q in queues.values())
+
+    async def acquire(
+        self,
+        session: str = "default",
+        priority: Priority = Priority.INTERACTIVE,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+    ) -> Reservation:
+        """Wait until the request may be sent; the returned reservation goes to `settle`."""
+        reservation = Reservation(session, Priority(priority), input_tokens, output_tokens)
+        waiter = _Waiter(reservation, asyncio.get_running_loop().create_future())
+        self._queues[reservation.priority].setdefault(session, deque()).append(waiter)
+        self._pump()
+        if not waiter.future.done():
+            self.metrics.queued += 1
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # admitted just as the caller gave up; hand the capacity back
+                self.settle(reservation)
+            else:
+                self._pump()  # let the next waiter through if this one was at the head
+            raise
+
+    def settle(self, reservation: Reservation, usage: Any | None = None):
+        """Correct the reserved tokens with the actual `usage` (None: nothing was used)."""
+        if usage is None:
+            actual_input = actual_output = 0
+        else:
+            actual_input = (getattr(usage, "input_tokens", 0) or 0) + (
+                getattr(usage, "cache_creation_input_tokens", 0) or 0
+            )
+            actual_output = getattr(usage, "output_tokens", 0) or 0
+        if "input_tokens" in self._buckets:
+            self._buckets["input_tokens"].refund(reservation.input_tokens - actual_input)
+        if "output_tokens" in self._buckets:
+            self._buckets["output_tokens"].refund(reservation.output_tokens - actual_output)
+        self._pump()
+
+    def throttled(self, retry_after: float | None):
+        """Report a 429: hold all admissions until the server's window has passed."""
+        self.metrics.throttled += 1
+        pause = retry_after if retry_after is not None else 1.0
+        self._paused_until = max(self._paused_until, self.clock() + pause)
+        logger.warning("rate limited by the server; pausing admissions for %.2fs", pause)
+
+    def observe(self, headers: Mapping[str, str]):
+        """
+        Learn from `anthropic-ratelimit-*` response headers: adopt the account's limits
+        if none were configured, and never assume more capacity than the server reports.
+        """
+        names = {
+            "requests": "requests",
+            "input-tokens": "input_tokens",
+            "output-tokens": "output_tokens",
+        }
+        if not self._explicit:
+            limits = {
+                field_name: int(headers[f"anthropic-ratelimit-{header}-limit"])
+                for header, field_name in names.items()
+                if f"anthropic-ratelimit-{header}-limit" in headers
+            }
+            if limits and any(
+                getattr(self.limits, name) != value for name, value in limits.items()
+            ):
+                logger.info("adopting rate limits from response headers: %s", limits)
+                self.configure(RateLimits(**{**self._limit_values(), **limits}))
+        for header, field_name in names.items():
+            remaining = headers.get(f"anthropic-ratelimit-{header}-remaining")
+            if remaining is not None and field_name in self._buckets:
+                self._buckets[field_name].clamp(float(remaining))
+
+    def _limit_values(self) -> dict[str, int | None]:
+        return {
+            "requests": self.limits.requests,
+            "input_tokens": self.limits.input_tokens,
+            "output_tokens": self.limits.output_tokens,
+        }
+
+    def _head(self) -> tuple[OrderedDict[str, deque[_Waiter]], str] | None:
+        for priority in Priority:
+            queues = self._queues[priority]
+            for session in list(queues):
+                waiters = queues[session]
+                while waiters and waiters[0].future.done():
+                    waiters.popleft()  # cancelled while waiting
+                if waiters:
+                    return queues, session
+                del queues[session]
+        return None
+
+    def _pump(self):
+        """Admit as many waiters as the buckets allow, in priority and session order."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while (head := self._head()) is not None:
+            queues, session = head
+            waiter = queues[session][0]
+            reservation = waiter.reservation
+            needs = {
+                "requests": 1,
+                "input_tokens": reservation.input_tokens,
+                "output_tokens": reservation.output_tokens,
+            }
+            wait = max(
+                [self._paused_until - self.clock()]
+                + [bucket.time_until(needs[name]) for name, bucket in self._buckets.items()]
+            )
+            if wait > 0:
+                # head-of-line: later waiters must not overtake it, or priorities and
+                # fairness would mean nothing
+                loop = waiter.future.get_loop()
+                self._timer = loop.call_later(wait, self._pump)
+                return
+            for name, bucket in self._buckets.items():
+                bucket.consume(needs[name])
+            queues[session].popleft()
+            # the session goes to the back of the line of its priority class
+            queues.move_to_end(session)
+            reservation.queued = time.monotonic() - waiter.enqueued
+            self.metrics.admitted += 1
+            self.metrics.wait_seconds += reservation.queued
+            waiter.future.set_result(reservation)
+
+
+_schedulers: dict[ClientKey, RequestScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(
+    provider: str,
+    api_key: str | None = None,
+    region: str | None = None,
+    base_url: str | None = None,
+) -> RequestScheduler:
+    """The process-wide scheduler for one account, keyed like the pooled clients."""
+    key = ClientRegistry.key(provider, api_key, region, base_url)
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = _schedulers[key] = RequestScheduler()
+        return scheduler
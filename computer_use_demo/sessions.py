@@ -0,0 +1,463 @@
+"""
+Agent sessions of the app. A `Session` holds what used to be module globals (the
+selected screen), its tools and the cancel flag of its running loop. The
+`SessionManager` runs the synchronous sampling loops on a pool of its own, so async
+handlers never tie up the web server's threads, and caps how many run at once,
+overall and per user. It can also give every session an X display of its own, so
+agents of different users do not click over each other, and tears sessions down on
+logout or when idle.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections.abc import AsyncIterator, Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, TypeVar
+
+from .display_pool import DisplayPool, PoolExhaustedError
+from .displays import DesktopDisplay, DisplayNumbers, ResourceUsage, XvfbDisplay, process_tree_usage
+from .tools import ToolRegistry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+ANONYMOUS = "anonymous"
+
+
+class SessionBusyError(RuntimeError):
+    """The session already has a loop running."""
+
+
+@dataclass
+class Session:
+    id: str
+    user: str = ANONYMOUS
+    selected_screen: int = 0
+    # set to stop the running loop; every run gets a fresh one
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    display: XvfbDisplay | None = None
+    tools: ToolRegistry | None = None
+    last_active: float = field(default_factory=time.monotonic)
+    _worker: "asyncio.Future[None] | None" = field(default=None, repr=False)
+    _wake: Callable[[], None] | None = field(default=None, repr=False)
+    _desktop: "asyncio.Future[ToolRegistry] | None" = field(default=None, repr=False)
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def cancel(self):
+        """
+        Stop the running loop, if any. Its handler returns right away; the loop itself
+        stops at its next step, and the session takes no new run until it has.
+        """
+        self.cancel_event.set()
+        if self._wake is not None:
+            self._wake()
+
+    def usage(self) -> ResourceUsage:
+        """CPU and memory of the session's display and the processes its tools started."""
+        pids = self.display.pids() if self.display is not None else []
+        if self.tools is not None:
+            pids += self.tools.pids()
+        return process_tree_usage(pids)
+
+    def close(self):
+        """Stop the running loop and the session's tools, and let go of its display."""
+        self.cancel()
+        self.close_desktop()
+
+    def close_desktop(self) -> XvfbDisplay | None:
+        """Close the session's tools and let go of its display, which is returned."""
+        display = self.display
+        if self.tools is not None:
+            self.tools.close()
+            self.tools = None
+        self.display = None
+        self._desktop = None
+        return display
+
+
+@dataclass
+class SessionStats:
+    started: int = 0
+    finished: int = 0
+    cancelled: int = 0
+    failed: int = 0
+    queued: int = 0  # runs waiting for a slot right now
+    running: int = 0
+    wait_seconds: float = 0.0  # total time runs waited for a slot
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "started": self.started,
+            "finished": self.finished,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+            "queued": self.queued,
+            "running": self.running,
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
+
+
+_ITEM, _ERROR, _DONE = range(3)
+
+
+class SessionManager:
+    """
+    Sessions by id, and the runs of their loops: at most `max_concurrent` at once, at
+    most `max_per_user` of them for any one user. Runs beyond that wait their turn.
+
+    With `display_pool`, each session's tools get a display of their own, leased
+    from the pool and returned to it when the session closes. When the pool has none
+    left, the session idle the longest gives its display back; its tools are opened
+    again, on a fresh display, when it next runs. Sessions idle for
+    `idle_timeout` seconds are closed by `reap_idle`, which `start_reaper` runs
+    periodically.
+
+    Use it from one event loop (the web server's).
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 8,
+        max_per_user: int = 2,
+        display_pool: DisplayPool | None = None,
+        idle_timeout: float | None = None,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.display_pool = display_pool
+        self.idle_timeout = idle_timeout
+        self.stats = SessionStats()
+        self._sessions: dict[str, Session] = {}
+        self._lock = threading.Lock()
+        self._reaper: threading.Thread | None = None
+        self._stopping = threading.Event()
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._user_slots: dict[str, asyncio.Semaphore] = {}
+        self._pool = ThreadPoolExecutor(max_concurrent, thread_name_prefix="agent-session")
+
+    def open(self, session_id: str, user: str = ANONYMOUS) -> Session:
+        """The session with this id, created on first use."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = Session(session_id, user)
+            session.last_active = time.monotonic()
+            return session
+
+    def get(self, session_id: str) -> Session | None:
+        return self._sessions.get(session_id)
+
+    def close(self, session_id: str):
+        """End a session, e.g. on logout: its loop, tools and display."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.cancel()
+            display = session.close_desktop()
+            if display is not None:
+                self.display_pool.release(display)
+            logger.info("session %s closed", session_id)
+
+    async def aclose(self, session_id: str):
+        """
+        `close`, from the event loop, once a running loop has stopped: its display is
+        not handed to another session while the loop can still draw on it.
+        """
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.cancel()
+            await self.wait_stopped(session)
+        self.close(session_id)
+
+    async def tools(self, session: Session, workspace_root: str | None = None) -> ToolRegistry:
+        """The session's tools, created on first use, on its own display if configured."""
+        session.last_active = time.monotonic()
+        if session._desktop is None:
+            session._desktop = asyncio.ensure_future(self._open_desktop(session, workspace_root))
+        try:
+            tools = await asyncio.shield(session._desktop)
+        except BaseException:
+            if session._desktop is not None and session._desktop.done():
+                session._desktop = None  # try again next time
+            raise
+        # the screen may have been switched since the tools were created
+        tools.selected_screen = session.selected_screen
+        return tools
+
+    async def _open_desktop(self, session: Session, workspace_root: str | None) -> ToolRegistry:
+        display = None
+        if self.display_pool is not None:
+            display = await self._lease_display()
+        session.display = display
+        session.tools = ToolRegistry(
+            selected_screen=session.selected_screen,
+            workspace_root=workspace_root,
+            display=display.name if display is not None else None,
+            env=display.env() if display is not None else None,
+        )
+        return session.tools
+
+    async def _lease_display(self) -> XvfbDisplay:
+        timeout = 0.0
+        while True:
+            try:
+                # a warm lease is a pop from a list; only a cold start needs the thread
+                return await asyncio.to_thread(self.display_pool.lease, timeout)
+            except PoolExhaustedError:
+                pass
+            # every display is taken: take one back from an idle session, or wait for
+            # a running one to become idle
+            self._reclaim_display()
+            timeout = 1.0
+
+    def _reclaim_display(self) -> bool:
+        """Return the display of the session idle the longest to the pool, if any."""
+        with self._lock:
+            idle = [
+                session
+                for session in self._sessions.values()
+                if session.display is not None and not session.running
+            ]
+        if not idle:
+            return False
+        session = min(idle, key=lambda session: session.last_active)
+        logger.info("taking back the display of idle session %s", session.id)
+        self.display_pool.release(session.close_desktop())
+        return True
+
+    def usage(self) -> dict[str, ResourceUsage]:
+        """Resource usage by session id."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {session.id: session.usage() for session in sessions}
+
+    def reap_idle(self, now: float | None = None) -> list[str]:
+        """Close the sessions idle for longer than `idle_timeout`; their ids."""
+        if self.idle_timeout is None:
+            return []
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            idle = [
+                session.id
+                for session in self._sessions.values()
+                if not session.running and now - session.last_active > self.idle_timeout
+            ]
+        for session_id in idle:
+            logger.info("session %s idle for over %ss", session_id, self.idle_timeout)
+            self.close(session_id)
+        return idle
+
+    def start_reaper(self, interval: float = 60.0):
+        """Run `reap_idle` every `interval` seconds on a daemon thread."""
+        if self._reaper is not None:
+            return
+
+        def reap():
+            while not self._stopping.wait(interval):
+                try:
+                    self.reap_idle()
+                except Exception:
+                    logger.exception("reaping idle sessions failed")
+
+        self._reaper = threading.Thread(target=reap, name="session-reaper", daemon=True)
+        self._reaper.start()
+
+    async def wait_stopped(self, session: Session):
+        """
+        Wait until the session's loop has actually stopped. `run` returns as soon as a
+        run is cancelled, while the loop may still finish its current step.
+        """
+        if session._worker is not None:
+            await asyncio.shield(session._worker)
+
+    def cancel(self, session_id: str) -> bool:
+        """Cancel the session's running loop; False if it has none."""
+        session = self._sessions.get(session_id)
+        if session is None or not session.running:
+            return False
+        session.cancel()
+        return True
+
+    async def run(
+        self, session: Session, steps: Callable[[threading.Event], Iterator[T]]
+    ) -> AsyncIterator[T]:
+        """
+        Iterate `steps(cancel_event)` on the pool once a slot is free, yielding what it
+        yields. The iterator should stop soon after `cancel_event` is set; this returns
+        as soon as it is, and also cancels the run when the caller stops iterating.
+        """
+        if session.running:
+            if not session.cancel_event.is_set():
+                raise SessionBusyError(f"session {session.id} is already running")
+            # a cancelled run that has not reached its next step yet
+            await asyncio.shield(session._worker)
+        session.cancel_event = cancel_event = threading.Event()
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[tuple[int, Any]] = asyncio.Queue()
+        # the session counts as running from here until its loop has stopped
+        session._worker = stopped = loop.create_future()
+        session._wake = lambda: loop.call_soon_threadsafe(queue.put_nowait, (_DONE, None))
+
+        def put(kind: int, value: Any = None):
+            loop.call_soon_threadsafe(queue.put_nowait, (kind, value))
+
+        def work():
+            iterator = steps(cancel_event)
+            try:
+                for item in iterator:
+                    if cancel_event.is_set():
+                        # resume it once, so it sees the cancel at its own checkpoint and
+                        # cleans up (the loop answers the interrupted tool calls there);
+                        # closing it would raise GeneratorExit past that code
+                        next(iterator, None)
+                        break
+                    put(_ITEM, item)
+            except BaseException as error:  # noqa: BLE001
+                put(_ERROR, error)
+            finally:
+                close = getattr(iterator, "close", None)
+                if close is not None:
+                    close()
+                put(_DONE)
+
+        user_slots = self._user_slots.get(session.user)
+        if user_slots is None:
+            user_slots = self._user_slots[session.user] = asyncio.Semaphore(self.max_per_user)
+
+        released = False
+
+        def release(_=None):
+            # slots are held until the loop has actually stopped, not just its handler
+            nonlocal released
+            if released:
+                return
+            released = True
+            self._slots.release()
+            user_slots.release()
+            self.stats.running -= 1
+            if not stopped.done():
+                stopped.set_result(None)
+
+        enqueued = time.monotonic()
+        self.stats.queued += 1
+        acquired = False
+        try:
+            await user_slots.acquire()
+            try:
+                await self._slots.acquire()
+            except BaseException:
+                user_slots.release()
+                raise
+            acquired = True
+        finally:
+            self.stats.queued -= 1
+            if not acquired:
+                stopped.set_result(None)
+        self.stats.wait_seconds += time.monotonic() - enqueued
+        self.stats.running += 1
+
+        if cancel_event.is_set():
+            # cancelled while it waited
+            release()
+            session._wake = None
+            self.stats.cancelled += 1
+            return
+
+        self.stats.started += 1
+        worker = loop.run_in_executor(self._pool, work)
+        worker.add_done_callback(release)
+        logger.info("session %s of %s started", session.id, session.user)
+        outcome = "cancelled"
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == _ERROR:
+                    outcome = "failed"
+                    await worker
+                    release()
+                    raise value
+                session.last_active = time.monotonic()
+                if kind == _DONE:
+                    if not cancel_event.is_set():
+                        outcome = "finished"
+                        # it is about to return; let it, so the session is free again
+                        await worker
+                        release()
+                    break
+                yield value
+        finally:
+            session._wake = None
+            if outcome == "cancelled":
+                # also when the caller went away, e.g. the browser tab was closed
+                cancel_event.set()
+                logger.info("session %s cancelled", session.id)
+            setattr(self.stats, outcome, getattr(self.stats, outcome) + 1)
+
+    def shutdown(self):
+        self._stopping.set()
+        for session_id in list(self._sessions):
+            self.close(session_id)
+        if self.display_pool is not None:
+            self.display_pool.close()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+_default_manager: SessionManager | None = None
+_default_manager_lock = threading.Lock()
+
+
+def display_pool_from_env(concurrency: int, base: int | None = None) -> DisplayPool | None:
+    """
+    The displays `SESSION_DISPLAYS` asks for, started: `xvfb` for a bare X server,
+    `desktop` for one with the window manager and panel; None if it is not set. The
+    pool holds `SESSION_DISPLAY_POOL` displays (default: one per concurrent session,
+    plus a spare) and runs at most `SESSION_DISPLAY_MAX` (default: that many, or one
+    per concurrent session and a spare if that is more), sized `WIDTH`x`HEIGHT` and
+    numbered from `base`, by default `SESSION_DISPLAY_BASE` (100).
+    """
+    kind = os.getenv("SESSION_DISPLAYS")
+    if not kind:
+        return None
+    factory = partial(
+        DesktopDisplay if kind == "desktop" else XvfbDisplay,
+        width=int(os.getenv("WIDTH", "1280")),
+        height=int(os.getenv("HEIGHT", "800")),
+    )
+    if base is None:
+        base = int(os.getenv("SESSION_DISPLAY_BASE", "100"))
+    numbers = DisplayNumbers(base)
+    pool_size = os.getenv("SESSION_DISPLAY_POOL")
+    size = int(pool_size) if pool_size else concurrency + 1
+    max_size = int(os.getenv("SESSION_DISPLAY_MAX", "0")) or max(size, concurrency + 1)
+    return DisplayPool(factory, size=size, max_size=max_size, numbers=numbers).start()
+
+
+def get_session_manager() -> SessionManager:
+    """
+    The process-wide session manager, sized by `SESSION_MAX_CONCURRENT` (default 8)
+    and `SESSION_MAX_PER_USER` (default 2). With `SESSION_DISPLAYS`, every session gets
+    a display of its own (see `display_pool_from_env`). `SESSION_IDLE_TIMEOUT` closes
+    sessions idle for that many seconds.
+    """
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            max_concurrent = int(os.getenv("SESSION_MAX_CONCURRENT", "8"))
+            idle_timeout = os.getenv("SESSION_IDLE_TIMEOUT")
+            _default_manager = SessionManager(
+                max_concurrent=max_concurrent,
+                max_per_user=int(os.getenv("SESSION_MAX_PER_USER", "2")),
+                display_pool=display_pool_from_env(max_concurrent),
+                idle_timeout=float(idle_timeout) if idle_timeout else None,
+            )
+            if idle_timeout:
+                _default_manager.start_reaper(min(60.0, float(idle_timeout) / 2))
+        return _default_manager
@@ -0,0 +1,80 @@
+"""
+Rough input token counts of Messages API content, from its length in characters and,
+for images, the size the API bills them at. Used to keep requests under a budget
+(compaction) and to reserve rate limit capacity before sending them (scheduler).
+"""
+import base64
+import binascii
+import json
+import math
+from io import BytesIO
+from typing import Any
+
+from anthropic.types.beta import BetaMessageParam
+from PIL import Image
+
+from .blobs import ImageRef
+
+CHARS_PER_TOKEN = 4
+# the API downscales images whose long edge exceeds this before counting tokens
+MAX_IMAGE_EDGE = 1568
+# what an image costs when its resolution cannot be read
+DEFAULT_IMAGE_TOKENS = 1600
+
+
+def text_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def image_tokens(width: int, height: int) -> int:
+    """Tokens billed for an image of this size, as documented for the Messages API."""
+    scale = min(1.0, MAX_IMAGE_EDGE / max(width, height, 1))
+    return math.ceil(width * scale * height * scale / 750)
+
+
+def image_size(data: str | ImageRef) -> tuple[int, int] | None:
+    """Width and height of a base64-encoded image, from its header where possible."""
+    if isinstance(data, ImageRef):
+        return data.dimensions
+    try:
+        # a PNG's IHDR chunk sits in the first 24 bytes, i.e. 32 base64 characters
+        head = base64.b64decode(data[:32])
+        if head.startswith(b"\x89PNG\r\n\x1a\n"):
+            return int.from_bytes(head[16:20], "big"), int.from_bytes(head[20:24], "big")
+        with Image.open(BytesIO(base64.b64decode(data))) as image:
+            return image.size
+    except (binascii.Error, ValueError, OSError):
+        return None
+
+
+def as_dict(block: Any) -> dict[str, Any]:
+    if isinstance(block, dict):
+        return block
+    # pydantic content blocks, as appended from API responses
+    return block.model_dump(exclude_none=True)
+
+
+def block_tokens(block: Any) -> int:
+    """Estimated input tokens of one content block."""
+    block = as_dict(block)
+    kind = block.get("type")
+    if kind == "text":
+        return text_tokens(block.get("text", ""))
+    if kind == "image":
+        size = image_size(block.get("source", {}).get("data", ""))
+        return image_tokens(*size) if size else DEFAULT_IMAGE_TOKENS
+    if kind == "tool_result":
+        content = block.get("content", "")
+        if isinstance(content, str):
+            return text_tokens(content) + 10
+        return sum(block_tokens(item) for item in content) + 10
+    if kind == "tool_use":
+        return text_tokens(json.dumps(block.get("input", {}))) + 10
+    return text_tokens(json.dumps(block, default=str))
+
+
+def message_tokens(message: BetaMessageParam) -> int:
+    content = message["content"]
+    if isinstance(content, str):
+        return text_tokens(content) + 4
+    return sum(block_tokens(block) for block in content) + 4
@@ -2,13 +2,19 @@ from .base import CLIResult, ToolResult
 from .bash import BashTool
 from .collection import ToolCollection
 from .computer import ComputerTool
+from .dispatch import ToolDispatcher
 from .edit import EditTool
+from .registry import ToolRegistry
+from .search import SearchTool
 
 __ALL__ = [
     BashTool,
     CLIResult,
     ComputerTool,
     EditTool,
+    SearchTool,
     ToolCollection,
+    ToolDispatcher,
+    ToolRegistry,
     ToolResult,
 ]
@@ -4,6 +4,11 @@ from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
 
+from ..blobs import ImageRef
+
+# (resource, exclusive): e.g. ("display", True), or ("fs:/tmp/a.txt", False) to read it
+Resource = tuple[str, bool]
+
 
 class BaseAnthropicTool(metaclass=ABCMeta):
     """Abstract base class for Anthropic-defined tools."""
@@ -13,6 +18,14 @@ class BaseAnthropicTool(metaclass=ABCMeta):
         """Executes the tool with the given arguments."""
         ...
 
+    def resources(self, **kwargs) -> list[Resource]:
+        """
+        What a call with these arguments touches. Calls of one response run concurrently
+        unless they share a resource that either of them holds exclusively; by default a
+        tool holds everything and runs alone.
+        """
+        return [("*", True)]
+
     @abstractmethod
     def to_params(
         self,
@@ -26,7 +39,8 @@ class ToolResult:
 
     output: str | None = None
     error: str | None = None
-    base64_image: str | None = None
+    # a base64 string, or a handle to the image in the blob store
+    base64_image: str | ImageRef | None = None
     system: str | None = None
 
     def __bool__(self):
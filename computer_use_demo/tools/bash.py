@@ -4,7 +4,7 @@ from typing import ClassVar, Literal
 
 from anthropic.types.beta import BetaToolBash20241022Param
 
-from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
+from .base import BaseAnthropicTool, CLIResult, Resource, ToolError, ToolResult
 
 
 class _BashSession:
@@ -18,9 +18,10 @@ class _BashSession:
     _timeout: float = 120.0  # seconds
     _sentinel: str = "<<exit>>"
 
-    def __init__(self):
+    def __init__(self, env: dict[str, str] | None = None):
         self._started = False
         self._timed_out = False
+        self._env = env
 
     async def start(self):
         if self._started:
@@ -28,10 +29,10 @@ class _BashSession:
 
         self._process = await asyncio.create_subprocess_shell(
             self.command,
-            shell=False,
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
+            env=self._env,
         )
 
         self._started = True
@@ -89,8 +90,10 @@ class _BashSession:
                 f"timed out: bash has not returned in {self._timeout} seconds and must be restarted",
             ) from None
 
-        error = await self._process.stderr.read()
-        error = error.decode()
+        # the shell stays alive between commands, so stderr never reaches EOF; take
+        # whatever the command has written so far instead of waiting for it
+        error = self._process.stderr._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
+        self._process.stderr._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
 
         return CLIResult(output=output.strip(), error=error.strip())
 
@@ -105,23 +108,39 @@ class BashTool(BaseAnthropicTool):
     name: ClassVar[Literal["bash"]] = "bash"
     api_type: ClassVar[Literal["bash_20241022"]] = "bash_20241022"
 
-    def __init__(self):
+    def __init__(self, env: dict[str, str] | None = None):
         self._session = None
+        # the shell's environment, e.g. the DISPLAY of the session's own screen
+        self.env = env
         super().__init__()
 
+    @property
+    def pid(self) -> int | None:
+        """The process id of the shell, while it runs."""
+        session = self._session
+        if session is None or not session._started or session._process.returncode is not None:
+            return None
+        return session._process.pid
+
+    def close(self):
+        """Terminate the shell, if one was started; the next command starts a new one."""
+        if self._session is not None and self._session._started:
+            self._session.stop()
+        self._session = None
+
     async def __call__(
         self, command: str | None = None, restart: bool = False, **kwargs
     ):
         if restart:
             if self._session:
                 self._session.stop()
-            self._session = _BashSession()
+            self._session = _BashSession(self.env)
             await self._session.start()
 
             return ToolResult(system="tool has been restarted.")
 
         if self._session is None:
-            self._session = _BashSession()
+            self._session = _BashSession(self.env)
             await self._session.start()
 
         if command is not None:
@@ -129,6 +148,11 @@ class BashTool(BaseAnthropicTool):
 
         raise ToolError("no command provided.")
 
+    def resources(self, **kwargs) -> list[Resource]:
+        # one shell, whose cwd and environment carry over between commands, and
+        # which may write anywhere and drive the screen (xdotool, GUI programs)
+        return [("shell", True), ("fs", True), ("display", True)]
+
     def to_params(self) -> BetaToolBash20241022Param:
         return {
             "type": self.api_type,
@@ -1,51 +1,76 @@
 """Collection classes for managing multiple tools."""
 
 from typing import Any
-import time
+import asyncio
 
 from anthropic.types.beta import BetaToolUnionParam
 
 from .base import (
     BaseAnthropicTool,
+    Resource,
     ToolError,
     ToolFailure,
     ToolResult,
 )
+from .watch import WorkspaceWatcher
 
 
 class ToolCollection:
-    """Optimized tool collection with caching and error handling."""
+    """Tool collection with error handling and an optional workspace change feed."""
 
-    def __init__(self, *tools: BaseAnthropicTool):
+    def __init__(
+        self, *tools: BaseAnthropicTool, watcher: WorkspaceWatcher | None = None
+    ):
         self.tools = {tool.to_params()["name"]: tool for tool in tools}
-        self._result_cache = {}
-        self._cache_ttl = 60  # Cache results for 60 seconds
+        self.watcher = watcher
+        # calls currently running; concurrent calls share one watcher window
+        self._running = 0
 
-    async def run(self, *, name: str, tool_input: dict[str, Any]) -> ToolResult:
-        """Execute tool with caching and error handling."""
-        cache_key = f"{name}:{hash(str(tool_input))}"
+    def to_params(
+        self,
+    ) -> list[BetaToolUnionParam]:
+        return [tool.to_params() for tool in self.tools.values()]
 
-        # Check cache
-        if self._check_cache(cache_key):
-            return self._result_cache[cache_key]
+    def resources(self, name: str, tool_input: dict[str, Any]) -> list[Resource]:
+        """What a call would touch, for `ToolDispatcher`; unknown calls hold everything."""
+        tool = self.tools.get(name)
+        try:
+            return tool.resources(**tool_input) if tool else []
+        except Exception:
+            return [("*", True)]
 
+    async def run(self, *, name: str, tool_input: dict[str, Any]) -> ToolResult:
+        """Execute tool with error handling, attaching workspace changes if watched."""
         tool = self.tools.get(name)
         if not tool:
             return ToolResult(error=f"Tool {name} not found")
 
+        if not self.watcher:
+            return await self._call(tool, tool_input)
+
+        self._running += 1
         try:
-            result = await tool(**tool_input)
-            # Cache successful results
-            if not result.error:
-                self._cache_result(cache_key, result)
-            return result
+            if self._running == 1:
+                await asyncio.to_thread(self.watcher.begin)
+            result = await self._call(tool, tool_input)
+            # with concurrent calls, each reports what changed since the previous report;
+            # a cancelled call reports nothing, and the next window starts afresh
+            changes = await asyncio.to_thread(self.watcher.collect)
+        finally:
+            self._running -= 1
+        return _with_change_summary(result, changes.summary())
 
+    @staticmethod
+    async def _call(tool: BaseAnthropicTool, tool_input: dict[str, Any]) -> ToolResult:
+        try:
+            return await tool(**tool_input)
         except Exception as e:
             return ToolResult(error=str(e))
 
-    def _check_cache(self, key: str) -> bool:
-        """Check if valid cache entry exists."""
-        if key not in self._result_cache:
-            return False
-        timestamp, _ = self._result_cache[key]
-        return time.time() - timestamp < self._cache_ttl
+
+def _with_change_summary(result: ToolResult, summary: str) -> ToolResult:
+    """Attach a filesystem change summary as system information on the result."""
+    if not summary:
+        return result
+    system = f"{result.system}\n{summary}" if result.system else summary
+    return result.replace(system=system)
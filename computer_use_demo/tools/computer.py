@@ -2,23 +2,25 @@ import subprocess
 import platform
 import pyautogui
 import asyncio
-import base64
 import os
+import shlex
 import time
 if platform.system() == "Darwin":
     import Quartz  # uncomment this line if you are on macOS
 from enum import StrEnum
 from pathlib import Path
-from typing import Literal, TypedDict
+from typing import ClassVar, Literal, TypedDict
 from uuid import uuid4
 from screeninfo import get_monitors
 
 from PIL import ImageGrab, Image
 from functools import partial
+from io import BytesIO
 
 from anthropic.types.beta import BetaToolComputerUse20241022Param
 
-from .base import BaseAnthropicTool, ToolError, ToolResult
+from ..blobs import ImageRef, get_blob_store
+from .base import BaseAnthropicTool, Resource, ToolError, ToolResult
 from .run import run
 
 OUTPUT_DIR = "./tmp/outputs"
@@ -97,12 +99,36 @@ def get_screen_details():
 
 class ComputerTool(BaseAnthropicTool):
     """Handles computer interactions with improved error handling and performance."""
-    
-    def __init__(self):
+
+    name: ClassVar[Literal["computer"]] = "computer"
+    api_type: ClassVar[Literal["computer_20241022"]] = "computer_20241022"
+
+    def __init__(self, selected_screen: int = 0, display: str | None = None):
+        self.selected_screen = selected_screen
+        # an X display of the session's own (e.g. ":101"); None means the shared screen
+        self.display = display
+        self.xdotool = f"DISPLAY={display} xdotool" if display else "xdotool"
         self._screenshot_cache = {}
         self._last_action_time = 0
         self.min_action_delay = 0.05  # 50ms minimum between actions
         
+    @property
+    def options(self) -> ComputerToolOptions:
+        # screenshots are always resized to the target dimension before being sent
+        target = getattr(self, "target_dimension", MAX_SCALING_TARGETS["WXGA"])
+        return {
+            "display_width_px": target["width"],
+            "display_height_px": target["height"],
+            "display_number": None,
+        }
+
+    def resources(self, **kwargs) -> list[Resource]:
+        # input and screenshots must happen in the order the model asked for them
+        return [("display", True)]
+
+    def to_params(self) -> BetaToolComputerUse20241022Param:
+        return {"name": self.name, "type": self.api_type, **self.options}
+
     async def __call__(self, action: Action, **kwargs) -> ToolResult:
         try:
             # Rate limiting
@@ -138,7 +164,16 @@ class ComputerTool(BaseAnthropicTool):
         batch_size = TYPING_GROUP_SIZE
         for i in range(0, len(text), batch_size):
             batch = text[i:i + batch_size]
-            pyautogui.write(batch, interval=TYPING_DELAY_MS/1000)
+            if self.display:
+                # pyautogui types on the display it was imported for; a session's own
+                # display is driven through xdotool
+                _, _, stderr = await run(
+                    f"{self.xdotool} type --delay {TYPING_DELAY_MS} -- {shlex.quote(batch)}"
+                )
+                if stderr:
+                    return ToolResult(error=stderr)
+            else:
+                pyautogui.write(batch, interval=TYPING_DELAY_MS/1000)
             await asyncio.sleep(0.01)  # Prevent UI freeze
             
         return await self._handle_screenshot()
@@ -195,21 +230,22 @@ class ComputerTool(BaseAnthropicTool):
             bbox = (screen['x'], screen['y'], screen['x'] + screen['width'], screen['y'] + screen['height'])
 
         else:  # Linux or other OS
-            cmd = "xrandr | grep ' primary' | awk '{print $4}'"
-            try:
-                output = subprocess.check_output(cmd, shell=True).decode()
-                resolution = output.strip().split()[0]
-                width, height = map(int, resolution.split('x'))
-                bbox = (0, 0, width, height)  # Assuming single primary screen for simplicity
-            except subprocess.CalledProcessError:
-                raise RuntimeError("Failed to get screen resolution on Linux.")
+            width, height = self.get_screen_size()
+            bbox = (0, 0, width, height)  # Assuming single primary screen for simplicity
 
         # Take screenshot using the bounding box
-        screenshot = ImageGrab.grab(bbox=bbox)
+        if self.display:
+            screenshot = ImageGrab.grab(bbox=bbox, xdisplay=self.display)
+        else:
+            screenshot = ImageGrab.grab(bbox=bbox)
 
         # Set offsets (for potential future use)
-        self.offset_x = screen['x'] if system == "Darwin" else screen.x
-        self.offset_y = screen['y'] if system == "Darwin" else screen.y
+        if system == "Darwin":
+            self.offset_x, self.offset_y = screen['x'], screen['y']
+        elif system == "Windows":
+            self.offset_x, self.offset_y = screen.x, screen.y
+        else:
+            self.offset_x = self.offset_y = 0
 
         if not hasattr(self, 'target_dimension'):
             screenshot = self.padding_image(screenshot)
@@ -218,17 +254,21 @@ class ComputerTool(BaseAnthropicTool):
         # Resize if target_dimensions are specified
         print(f"offset is {self.offset_x}, {self.offset_y}")
         print(f"target_dimension is {self.target_dimension}")
+        # Resizing and PNG/base64 encoding are CPU-bound; run them off the event loop
+        # so that other tools of the same response make progress meanwhile
+        base64_image = await asyncio.to_thread(
+            self._encode_screenshot, screenshot, path
+        )
+        return ToolResult(base64_image=base64_image)
+
+    def _encode_screenshot(self, screenshot: Image.Image, path: Path) -> ImageRef:
+        """Resize to the target dimension, save to `path` and add it to the blob store."""
         screenshot = screenshot.resize((self.target_dimension["width"], self.target_dimension["height"]))
-
-
-        # Save the screenshot
-        screenshot.save(str(path))
-
-        if path.exists():
-            # Return a ToolResult instance instead of a dictionary
-            return ToolResult(base64_image=base64.b64encode(path.read_bytes()).decode())
-        
-        raise ToolError(f"Failed to take screenshot: {path} does not exist.")
+        buffer = BytesIO()
+        screenshot.save(buffer, format="PNG")
+        data = buffer.getvalue()
+        path.write_bytes(data)
+        return get_blob_store().put(data, "image/png")
 
     def padding_image(self, screenshot):
         """Pad the screenshot to 16:10 aspect ratio, when the aspect ratio is not 16:10."""
@@ -338,8 +378,9 @@ class ComputerTool(BaseAnthropicTool):
 
         else:  # Linux or other OS
             cmd = "xrandr | grep ' primary' | awk '{print $4}'"
+            env = {**os.environ, "DISPLAY": self.display} if self.display else None
             try:
-                output = subprocess.check_output(cmd, shell=True).decode()
+                output = subprocess.check_output(cmd, shell=True, env=env).decode()
                 resolution = output.strip().split()[0]
                 width, height = map(int, resolution.split('x'))
                 return width, height
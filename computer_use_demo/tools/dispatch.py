@@ -0,0 +1,69 @@
+"""Dependency-aware dispatch of the tool_use blocks of one model response."""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Coroutine
+from typing import Any
+
+from .base import Resource, ToolResult
+from .collection import ToolCollection
+
+Spawn = Callable[[Coroutine[Any, Any, ToolResult]], Awaitable[ToolResult]]
+
+
+def conflicts(a: list[Resource], b: list[Resource]) -> bool:
+    """
+    Whether two calls must keep their relative order: they share a resource and at
+    least one of them holds it exclusively. Resources are hierarchical, so "fs" covers
+    "fs:/some" which covers "fs:/some/path", and "*" covers everything.
+    """
+    for key_a, exclusive_a in a:
+        for key_b, exclusive_b in b:
+            if (exclusive_a or exclusive_b) and (
+                "*" in (key_a, key_b) or _covers(key_a, key_b) or _covers(key_b, key_a)
+            ):
+                return True
+    return False
+
+
+def _covers(outer: str, inner: str) -> bool:
+    return inner == outer or (
+        inner.startswith(outer) and inner[len(outer)] in ":/"
+    )
+
+
+class ToolDispatcher:
+    """
+    Starts tool calls as soon as they are submitted, each one waiting only for the
+    earlier calls it conflicts with (see `BaseAnthropicTool.resources`). Computer
+    actions therefore keep their order while, say, file views run alongside them.
+
+    `spawn` schedules a coroutine and returns something awaitable: a background loop's
+    `submit` from synchronous code, or `asyncio.ensure_future` from inside a loop.
+    """
+
+    def __init__(self, collection: ToolCollection, spawn: Spawn):
+        self.collection = collection
+        self.spawn = spawn
+        self._submitted: list[tuple[list[Resource], Awaitable[ToolResult]]] = []
+
+    def submit(self, name: str, tool_input: dict[str, Any]) -> Awaitable[ToolResult]:
+        resources = self.collection.resources(name, tool_input)
+        dependencies = [
+            future for held, future in self._submitted if conflicts(held, resources)
+        ]
+
+        async def run_after_dependencies() -> ToolResult:
+            for dependency in dependencies:
+                try:
+                    await asyncio.wrap_future(dependency)  # type: ignore[arg-type]
+                except Exception:
+                    pass  # the failure is reported by the call that raised it
+            return await self.collection.run(name=name, tool_input=tool_input)
+
+        future = self.spawn(run_after_dependencies())
+        self._submitted.append((resources, future))
+        return future
+
+    def reset(self):
+        """Forget submitted calls, e.g. once all results of a response are in."""
+        self._submitted.clear()
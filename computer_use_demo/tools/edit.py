@@ -1,11 +1,14 @@
+import asyncio
+import os
 from collections import defaultdict
 from pathlib import Path
 from typing import Literal, get_args
 
 from anthropic.types.beta import BetaToolTextEditor20241022Param
 
-from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
-from .run import maybe_truncate, run
+from .base import BaseAnthropicTool, CLIResult, Resource, ToolError, ToolResult
+from .run import maybe_truncate
+from .walk import DirectoryWalker
 
 Command = Literal[
     "view",
@@ -27,11 +30,18 @@ class EditTool(BaseAnthropicTool):
     name: Literal["str_replace_editor"] = "str_replace_editor"
 
     _file_history: dict[Path, list[str]]
+    _walker: DirectoryWalker
 
-    def __init__(self):
+    def __init__(self, walker: DirectoryWalker | None = None):
         self._file_history = defaultdict(list)
+        self._walker = walker or DirectoryWalker()
         super().__init__()
 
+    def resources(self, *, command: str = "", path: str = "", **kwargs) -> list[Resource]:
+        # views of different files, or of the same file, can run side by side
+        key = "fs:" + os.path.normpath(path).rstrip("/")
+        return [(key, command != "view")]
+
     def to_params(self) -> BetaToolTextEditor20241022Param:
         return {
             "name": self.name,
@@ -114,14 +124,15 @@ class EditTool(BaseAnthropicTool):
                     "The `view_range` parameter is not allowed when `path` points to a directory."
                 )
 
-            _, stdout, stderr = await run(
-                rf"find {path} -maxdepth 2 -not -path '*/\.*'"
-            )
+            listing = await asyncio.to_thread(self._walker.walk, path)
+            stdout = listing.render()
+            stderr = "\n".join(listing.errors)
             if not stderr:
-                stdout = f"Here's the files and directories up to 2 levels deep in {path}, excluding hidden items:\n{stdout}\n"
+                stdout = f"Here's the files and directories up to {self._walker.max_depth} levels deep in {path}, excluding hidden items:\n{stdout}\n"
             return CLIResult(output=stdout, error=stderr)
 
-        file_content = self.read_file(path)
+        # off the event loop, so views run alongside the other tools of a response
+        file_content = await asyncio.to_thread(self.read_file, path)
         init_line = 1
         if view_range:
             if len(view_range) != 2 or not all(isinstance(i, int) for i in view_range):
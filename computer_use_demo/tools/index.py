@@ -0,0 +1,284 @@
+"""Incrementally maintained trigram index over the text files of a workspace."""
+
+import fnmatch
+import os
+import re
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+
+DEFAULT_IGNORE: tuple[str, ...] = (
+    "__pycache__",
+    "node_modules",
+    "*.pyc",
+    "*.so",
+    "*.png",
+    "*.jpg",
+    "*.gif",
+    "*.zip",
+)
+MAX_FILE_SIZE: int = 1024 * 1024  # bytes
+MAX_LINE_LEN: int = 200
+BINARY_SNIFF_LEN: int = 8192
+
+TOO_LARGE = "too large"
+BINARY = "binary"
+
+
+@dataclass(frozen=True)
+class SearchMatch:
+    path: str
+    line_number: int
+    line: str
+
+    def __str__(self):
+        return f"{self.path}:{self.line_number}:{self.line}"
+
+
+@dataclass(frozen=True)
+class _FileEntry:
+    mtime_ns: int
+    size: int
+    trigrams: frozenset[str]
+
+
+def trigrams(text: str) -> set[str]:
+    """Return the set of case-folded trigrams in `text`."""
+    text = text.lower()
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """
+    Maps every trigram to the set of files containing it, so a search only has to read
+    the handful of files that can possibly match.
+
+    The index is kept current by mtime polling (`refresh`), throttled to once every
+    `refresh_interval` seconds, or by pushing known changed paths to `update_paths`.
+    Files left out (over `max_file_size`, or binary) are remembered by mtime and size,
+    so they are not read again until they change, and listed by `skipped`.
+    """
+
+    def __init__(
+        self,
+        root: str | os.PathLike,
+        ignore: Iterable[str] = DEFAULT_IGNORE,
+        max_file_size: int = MAX_FILE_SIZE,
+        refresh_interval: float = 2.0,
+    ):
+        self.root = os.path.abspath(os.fspath(root))
+        self.ignore = tuple(ignore)
+        self.max_file_size = max_file_size
+        self.refresh_interval = refresh_interval
+        self._files: dict[str, _FileEntry] = {}
+        # path -> (mtime_ns, size, reason) of files that are not indexed
+        self._skipped: dict[str, tuple[int, int, str]] = {}
+        self._postings: dict[str, set[str]] = {}
+        self._last_refresh: float | None = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._files)
+
+    def refresh(self, force: bool = False) -> int:
+        """Re-stat the workspace and reindex changed files; returns how many changed."""
+        with self._lock:
+            now = time.monotonic()
+            if (
+                not force
+                and self._last_refresh is not None
+                and now - self._last_refresh < self.refresh_interval
+            ):
+                return 0
+            seen: set[str] = set()
+            changed = 0
+            for path, stat in self._iter_files():
+                seen.add(path)
+                entry = self._files.get(path)
+                if entry and (entry.mtime_ns, entry.size) == (
+                    stat.st_mtime_ns,
+                    stat.st_size,
+                ):
+                    continue
+                skipped = self._skipped.get(path)
+                if skipped and skipped[:2] == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                changed += self._reindex(path, stat)
+            for path in self._skipped.keys() - seen:
+                del self._skipped[path]
+            for path in self._files.keys() - seen:
+                self._remove(path)
+                changed += 1
+            self._last_refresh = time.monotonic()
+            return changed
+
+    def update_paths(self, paths: Iterable[str]):
+        """Reindex (or drop) specific paths that are known to have changed."""
+        with self._lock:
+            for path in paths:
+                path = os.path.abspath(path)
+                if not self._is_indexable_path(path):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    self._remove(path)
+                    continue
+                if os.path.isdir(path):
+                    continue
+                self._reindex(path, stat)
+
+    def search(
+        self,
+        pattern: str,
+        *,
+        regex: bool = False,
+        case_sensitive: bool = True,
+        path: str | None = None,
+        max_results: int = 100,
+    ) -> list[SearchMatch]:
+        """Return up to `max_results` matching lines, ordered by path and line number."""
+        flags = 0 if case_sensitive else re.IGNORECASE
+        compiled = re.compile(pattern if regex else re.escape(pattern), flags)
+        literals = _required_literals(pattern) if regex else [pattern]
+        scope = os.path.abspath(path) if path else self.root
+
+        self.refresh()
+        with self._lock:
+            candidates = self._candidates(literals)
+            if candidates is None:
+                candidates = set(self._files)
+        candidates = {p for p in candidates if _is_within(p, scope)}
+
+        matches: list[SearchMatch] = []
+        for candidate in sorted(candidates):
+            try:
+                with open(candidate, encoding="utf-8", errors="replace") as f:
+                    for line_number, line in enumerate(f, start=1):
+                        if compiled.search(line):
+                            line = line.rstrip("\n")[:MAX_LINE_LEN]
+                            matches.append(SearchMatch(candidate, line_number, line))
+                            if len(matches) >= max_results:
+                                return matches
+            except OSError:
+                continue
+        return matches
+
+    def skipped(self, path: str | None = None, reason: str | None = None) -> list[str]:
+        """Files under `path` that are not indexed (for `reason` only, if given)."""
+        scope = os.path.abspath(path) if path else self.root
+        with self._lock:
+            return sorted(
+                p
+                for p, (_, _, why) in self._skipped.items()
+                if _is_within(p, scope) and reason in (None, why)
+            )
+
+    def _candidates(self, literals: list[str]) -> set[str] | None:
+        """Intersect posting lists for every trigram of the required literals."""
+        result: set[str] | None = None
+        for trigram in set().union(*(trigrams(literal) for literal in literals)):
+            files = self._postings.get(trigram, set())
+            result = set(files) if result is None else result & files
+            if not result:
+                return set()
+        return result
+
+    def _iter_files(self) -> Iterator[tuple[str, os.stat_result]]:
+        stack = [self.root]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                if self._is_ignored(entry.name):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.path, entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+
+    def _reindex(self, path: str, stat: os.stat_result) -> int:
+        self._remove(path)
+        if stat.st_size > self.max_file_size:
+            self._skipped[path] = (stat.st_mtime_ns, stat.st_size, TOO_LARGE)
+            return 0
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return 0
+        if b"\0" in data[:BINARY_SNIFF_LEN]:
+            self._skipped[path] = (stat.st_mtime_ns, stat.st_size, BINARY)
+            return 0
+        entry = _FileEntry(
+            stat.st_mtime_ns,
+            stat.st_size,
+            frozenset(trigrams(data.decode("utf-8", errors="replace"))),
+        )
+        self._files[path] = entry
+        for trigram in entry.trigrams:
+            self._postings.setdefault(trigram, set()).add(path)
+        return 1
+
+    def _remove(self, path: str):
+        self._skipped.pop(path, None)
+        entry = self._files.pop(path, None)
+        if entry is None:
+            return
+        for trigram in entry.trigrams:
+            files = self._postings.get(trigram)
+            if files is not None:
+                files.discard(path)
+                if not files:
+                    del self._postings[trigram]
+
+    def _is_ignored(self, name: str) -> bool:
+        return name.startswith(".") or any(
+            fnmatch.fnmatch(name, pattern) for pattern in self.ignore
+        )
+
+    def _is_indexable_path(self, path: str) -> bool:
+        if not _is_within(path, self.root):
+            return False
+        relative = os.path.relpath(path, self.root)
+        return not any(self._is_ignored(part) for part in relative.split(os.sep))
+
+
+def _is_within(path: str, prefix: str) -> bool:
+    return path == prefix or path.startswith(prefix.rstrip(os.sep) + os.sep)
+
+
+def _required_literals(pattern: str) -> list[str]:
+    """
+    Extract literal runs that every match of the regex must contain.
+
+    Only top-level literal sequences are used, which is conservative but always sound:
+    anything we don't understand just ends the current run.
+    """
+    try:
+        from re import _parser  # type: ignore[attr-defined]
+
+        parsed = _parser.parse(pattern)
+    except Exception:
+        return []
+
+    literals: list[str] = []
+    run: list[str] = []
+    for op, value in parsed:
+        if op is _parser.LITERAL:
+            run.append(chr(value))
+            continue
+        if run:
+            literals.append("".join(run))
+            run = []
+    if run:
+        literals.append("".join(run))
+    return literals
@@ -0,0 +1,140 @@
+"""Per-session registry that owns exactly one instance of each tool."""
+
+import threading
+from collections.abc import Callable
+from functools import partial
+
+from anthropic.types.beta import BetaToolUnionParam
+
+from .base import BaseAnthropicTool
+from .bash import BashTool
+from .collection import ToolCollection
+from .computer import ComputerTool
+from .edit import EditTool
+from .search import SearchTool
+from .watch import WorkspaceWatcher
+
+
+class ToolRegistry:
+    """
+    Creates the tools of one agent session once and hands the same instances to
+    everyone in that session: the actor gets their (cached) schemas, the executor a
+    `ToolCollection` over them. Both need every tool, so the first of them builds
+    all of them. Stateful pieces such as the bash session, screenshot
+    cache, edit history and search index therefore exist once per session.
+    """
+
+    def __init__(
+        self,
+        selected_screen: int = 0,
+        workspace_root: str | None = None,
+        factories: dict[str, Callable[[], BaseAnthropicTool]] | None = None,
+        display: str | None = None,
+        env: dict[str, str] | None = None,
+    ):
+        self._selected_screen = selected_screen
+        self.workspace_root = workspace_root
+        # with a display of the session's own, the computer tool and every program
+        # started from bash use it instead of the shared screen
+        self.display = display
+        if factories is None:
+            factories = {
+                ComputerTool.name: self._computer_tool,
+                BashTool.name: partial(BashTool, env=env),
+                EditTool.name: EditTool,
+            }
+            if workspace_root:
+                # the workspace search tool is opt-in, since it indexes the whole tree
+                factories[SearchTool.name] = partial(SearchTool, workspace_root)
+        self._factories = factories
+        self._tools: dict[str, BaseAnthropicTool] = {}
+        self._params: list[BetaToolUnionParam] | None = None
+        self._collection: ToolCollection | None = None
+        self._watcher: WorkspaceWatcher | None = None
+        self._lock = threading.RLock()
+
+    def _computer_tool(self) -> ComputerTool:
+        return ComputerTool(selected_screen=self._selected_screen, display=self.display)
+
+    @property
+    def selected_screen(self) -> int:
+        return self._selected_screen
+
+    @selected_screen.setter
+    def selected_screen(self, screen: int):
+        """Point the computer tool at another screen, whose size its schema carries."""
+        with self._lock:
+            if screen == self._selected_screen:
+                return
+            self._selected_screen = screen
+            computer = self._tools.get(ComputerTool.name)
+            if isinstance(computer, ComputerTool):
+                computer.selected_screen = screen
+            self._params = None
+
+    @property
+    def names(self) -> list[str]:
+        return list(self._factories)
+
+    def get(self, name: str) -> BaseAnthropicTool | None:
+        """Return the session's instance of tool `name`, creating it if no one has yet."""
+        with self._lock:
+            tool = self._tools.get(name)
+            if tool is None and name in self._factories:
+                tool = self._tools[name] = self._factories[name]()
+            return tool
+
+    def to_params(self) -> list[BetaToolUnionParam]:
+        """The tool definitions sent with every request, computed once per session."""
+        with self._lock:
+            if self._params is None:
+                self._params = [self.get(name).to_params() for name in self._factories]
+            return self._params
+
+    def invalidate_params(self):
+        """Recompute schemas on next use, e.g. after the screen resolution changed."""
+        with self._lock:
+            self._params = None
+
+    @property
+    def watcher(self) -> WorkspaceWatcher | None:
+        """The workspace change feed, started on first use if a root is configured."""
+        with self._lock:
+            if self._watcher is None and self.workspace_root:
+                self._watcher = WorkspaceWatcher(self.workspace_root)
+                search_tool = self.get(SearchTool.name)
+                if isinstance(search_tool, SearchTool):
+                    self._watcher.add_listener(
+                        lambda changes: search_tool.index.update_paths(changes.paths)
+                    )
+            return self._watcher
+
+    @property
+    def collection(self) -> ToolCollection:
+        """A `ToolCollection` over the session's tool instances, for the executor."""
+        with self._lock:
+            if self._collection is None:
+                self._collection = ToolCollection(
+                    *(self.get(name) for name in self._factories),
+                    watcher=self.watcher,
+                )
+            return self._collection
+
+    def pids(self) -> list[int]:
+        """Processes the session's tools started, e.g. its bash shell."""
+        with self._lock:
+            bash = self._tools.get(BashTool.name)
+            pid = bash.pid if isinstance(bash, BashTool) else None
+            return [pid] if pid is not None else []
+
+    def close(self):
+        with self._lock:
+            bash = self._tools.get(BashTool.name)
+            if isinstance(bash, BashTool):
+                bash.close()
+            if self._watcher is not None:
+                self._watcher.close()
+                self._watcher = None
+            self._tools.clear()
+            self._params = None
+            self._collection = None
@@ -0,0 +1,112 @@
+import asyncio
+import re
+from pathlib import Path
+from typing import ClassVar, Literal
+
+from anthropic.types.beta import BetaToolParam
+
+from .base import BaseAnthropicTool, CLIResult, Resource, ToolError
+from .index import TOO_LARGE, TrigramIndex
+from .run import maybe_truncate
+
+DEFAULT_MAX_RESULTS: int = 50
+MAX_SKIPPED_LISTED: int = 10
+
+
+class SearchTool(BaseAnthropicTool):
+    """
+    A tool that searches the text files of a workspace through an in-process trigram
+    index, returning `file:line:text` matches without spawning `grep`.
+    """
+
+    name: ClassVar[Literal["search"]] = "search"
+
+    _index: TrigramIndex
+
+    def __init__(self, root: str | Path, index: TrigramIndex | None = None):
+        self._index = index if index is not None else TrigramIndex(root)
+        super().__init__()
+
+    @property
+    def index(self) -> TrigramIndex:
+        return self._index
+
+    def resources(self, **kwargs) -> list[Resource]:
+        return [("fs", False)]
+
+    def to_params(self) -> BetaToolParam:
+        return {
+            "name": self.name,
+            "description": (
+                f"Search the text files under {self._index.root} for a string or regular "
+                "expression. Returns matching lines as `path:line:text`. Prefer this over "
+                "running `grep` with the bash tool."
+            ),
+            "input_schema": {
+                "type": "object",
+                "properties": {
+                    "pattern": {
+                        "type": "string",
+                        "description": "The text (or regular expression, if `regex` is true) to search for.",
+                    },
+                    "path": {
+                        "type": "string",
+                        "description": "Absolute path of a directory or file to restrict the search to.",
+                    },
+                    "regex": {
+                        "type": "boolean",
+                        "description": "Interpret `pattern` as a Python regular expression.",
+                    },
+                    "case_sensitive": {"type": "boolean"},
+                    "max_results": {"type": "integer"},
+                },
+                "required": ["pattern"],
+            },
+        }
+
+    async def __call__(
+        self,
+        *,
+        pattern: str | None = None,
+        path: str | None = None,
+        regex: bool = False,
+        case_sensitive: bool = True,
+        max_results: int = DEFAULT_MAX_RESULTS,
+        **kwargs,
+    ):
+        if not pattern:
+            raise ToolError("Parameter `pattern` is required.")
+        if path and not Path(path).is_absolute():
+            raise ToolError(
+                f"The path {path} is not an absolute path, it should start with `/`."
+            )
+        try:
+            # the first search builds the index, which can take a while on big trees
+            matches = await asyncio.to_thread(
+                self._index.search,
+                pattern,
+                regex=regex,
+                case_sensitive=case_sensitive,
+                path=path,
+                max_results=max_results,
+            )
+        except re.error as e:
+            raise ToolError(f"Invalid regular expression `{pattern}`: {e}") from None
+
+        if not matches:
+            output = f"No matches found for `{pattern}`."
+        else:
+            output = "\n".join(str(match) for match in matches)
+            if len(matches) >= max_results:
+                output += f"\n[results limited to {max_results} matches]"
+        too_large = self._index.skipped(path, TOO_LARGE)
+        if too_large:
+            listed = ", ".join(too_large[:MAX_SKIPPED_LISTED])
+            more = len(too_large) - MAX_SKIPPED_LISTED
+            if more > 0:
+                listed += f" and {more} more"
+            output += (
+                f"\n[{len(too_large)} file(s) over {self._index.max_file_size} bytes were "
+                f"not searched: {listed}]"
+            )
+        return CLIResult(output=maybe_truncate(output))
@@ -0,0 +1,175 @@
+"""In-process, cached directory walker used for directory views."""
+
+import fnmatch
+import os
+import threading
+from collections import OrderedDict, deque
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+DEFAULT_MAX_DEPTH: int = 2
+DEFAULT_MAX_ENTRIES: int = 1000
+DEFAULT_CACHE_SIZE: int = 64
+
+
+@dataclass(frozen=True)
+class DirectoryListing:
+    """The bounded result of walking a directory tree."""
+
+    root: str
+    paths: tuple[str, ...]
+    omitted_entries: int = 0
+    unexpanded_dirs: int = 0
+    errors: tuple[str, ...] = ()
+
+    @property
+    def truncated(self) -> bool:
+        return bool(self.omitted_entries or self.unexpanded_dirs)
+
+    def render(self) -> str:
+        """Render the listing one path per line, like `find` does."""
+        lines = [self.root, *self.paths]
+        if self.truncated:
+            lines.append(
+                f"[{self.omitted_entries} more entries omitted, "
+                f"{self.unexpanded_dirs} directories not expanded]"
+            )
+        return "\n".join(lines)
+
+
+class DirectoryWalker:
+    """
+    Walks a directory tree with `os.scandir`, bounded by depth and entry count.
+
+    Results are cached per (root, depth, entry cap) together with the mtime of every
+    directory that was scanned, so a repeated listing of an unchanged tree costs one
+    `stat` per directory instead of a full rescan.
+    """
+
+    def __init__(
+        self,
+        max_depth: int = DEFAULT_MAX_DEPTH,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ignore: Iterable[str] = (),
+        include_hidden: bool = False,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+    ):
+        self.max_depth = max_depth
+        self.max_entries = max_entries
+        self.ignore = tuple(ignore)
+        self.include_hidden = include_hidden
+        self._cache_size = cache_size
+        self._cache: OrderedDict[
+            tuple[str, int, int], tuple[dict[str, int], DirectoryListing]
+        ] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def walk(
+        self,
+        path: str | os.PathLike,
+        max_depth: int | None = None,
+        max_entries: int | None = None,
+    ) -> DirectoryListing:
+        """List `path` up to `max_depth` levels deep, keeping at most `max_entries`."""
+        root = os.fspath(path)
+        max_depth = self.max_depth if max_depth is None else max_depth
+        max_entries = self.max_entries if max_entries is None else max_entries
+        key = (root, max_depth, max_entries)
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and self._is_fresh(cached[0]):
+                self._cache.move_to_end(key)
+                return cached[1]
+
+        dir_mtimes: dict[str, int] = {}
+        listing = self._scan(root, max_depth, max_entries, dir_mtimes)
+
+        with self._lock:
+            self._cache[key] = (dir_mtimes, listing)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return listing
+
+    def invalidate(self, path: str | os.PathLike | None = None):
+        """Drop cached listings, either all of them or those rooted under `path`."""
+        with self._lock:
+            if path is None:
+                self._cache.clear()
+                return
+            prefix = os.fspath(path)
+            for key in [k for k in self._cache if _is_within(k[0], prefix)]:
+                del self._cache[key]
+
+    def is_ignored(self, name: str) -> bool:
+        if not self.include_hidden and name.startswith("."):
+            return True
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.ignore)
+
+    def _is_fresh(self, dir_mtimes: dict[str, int]) -> bool:
+        try:
+            return all(
+                os.stat(directory).st_mtime_ns == mtime
+                for directory, mtime in dir_mtimes.items()
+            )
+        except OSError:
+            return False
+
+    def _scan(
+        self, root: str, max_depth: int, max_entries: int, dir_mtimes: dict[str, int]
+    ) -> DirectoryListing:
+        paths: list[str] = []
+        errors: list[str] = []
+        omitted = 0
+        unexpanded = 0
+
+        # breadth-first, so that the entry cap keeps the shallow overview of the tree
+        queue: deque[tuple[str, int]] = deque([(root, 0)])
+        while queue:
+            directory, depth = queue.popleft()
+            try:
+                # stat before listing, so a change made mid-scan invalidates the entry
+                dir_mtimes[directory] = os.stat(directory).st_mtime_ns
+                with os.scandir(directory) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError as e:
+                errors.append(f"{directory}: {e.strerror or e}")
+                continue
+
+            for entry in entries:
+                if self.is_ignored(entry.name):
+                    continue
+                expandable = depth + 1 < max_depth and _is_dir(entry)
+                if len(paths) >= max_entries:
+                    omitted += 1
+                    unexpanded += expandable
+                    continue
+                paths.append(entry.path)
+                if expandable:
+                    queue.append((entry.path, depth + 1))
+
+        # keep the same pre-order as `find`: children follow their parent directory
+        return DirectoryListing(
+            root=root,
+            paths=tuple(_preorder(root, paths)),
+            omitted_entries=omitted,
+            unexpanded_dirs=unexpanded,
+            errors=tuple(errors),
+        )
+
+
+def _is_dir(entry: os.DirEntry) -> bool:
+    try:
+        return entry.is_dir(follow_symlinks=False)
+    except OSError:
+        return False
+
+
+def _is_within(path: str, prefix: str) -> bool:
+    return path == prefix or path.startswith(prefix.rstrip(os.sep) + os.sep)
+
+
+def _preorder(root: str, paths: list[str]) -> list[str]:
+    """Order paths so that each directory's children directly follow it."""
+    return sorted(paths, key=lambda p: os.path.relpath(p, root).split(os.sep))
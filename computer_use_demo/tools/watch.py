@@ -0,0 +1,338 @@
+"""Watches a workspace root and reports what changed while a tool was running."""
+
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import os
+import platform
+import struct
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass, field
+
+from .index import DEFAULT_IGNORE
+
+MAX_LISTED_PATHS: int = 20
+MAX_LISTED_GROUPS: int = 10
+
+# see inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+@dataclass
+class ChangeSet:
+    """Paths created, modified and deleted under `root` during one tool call."""
+
+    root: str
+    created: set[str] = field(default_factory=set)
+    modified: set[str] = field(default_factory=set)
+    deleted: set[str] = field(default_factory=set)
+    overflowed: bool = False
+
+    def __bool__(self):
+        return bool(self.created or self.modified or self.deleted or self.overflowed)
+
+    def __len__(self):
+        return len(self.created) + len(self.modified) + len(self.deleted)
+
+    @property
+    def paths(self) -> set[str]:
+        return self.created | self.modified | self.deleted
+
+    def record_created(self, path: str):
+        if path in self.deleted:
+            # deleted and re-created, e.g. by an editor writing through a temp file
+            self.deleted.discard(path)
+            self.modified.add(path)
+        else:
+            self.created.add(path)
+
+    def record_modified(self, path: str):
+        if path not in self.created:
+            self.modified.add(path)
+
+    def record_deleted(self, path: str):
+        if path in self.created:
+            self.created.discard(path)
+            return
+        self.modified.discard(path)
+        self.deleted.add(path)
+
+    def summary(
+        self,
+        max_paths: int = MAX_LISTED_PATHS,
+        max_groups: int = MAX_LISTED_GROUPS,
+    ) -> str:
+        """
+        A compact, size-capped description of the changes. Small change sets list
+        every path; larger ones are aggregated into per-directory counts.
+        """
+        if not self:
+            return ""
+        lines = [f"Filesystem changes under {self.root}:"]
+        if self.overflowed:
+            lines.append("  (too many events to track individually; list may be partial)")
+        aggregate = len(self) > max_paths
+        for label, paths in (
+            ("created", self.created),
+            ("modified", self.modified),
+            ("deleted", self.deleted),
+        ):
+            if not paths:
+                continue
+            relative = sorted(os.path.relpath(p, self.root) for p in paths)
+            if not aggregate:
+                lines.append(f"  {label}: {', '.join(relative)}")
+                continue
+            groups: dict[str, int] = {}
+            for path in relative:
+                group = os.path.dirname(path) or "."
+                groups[group] = groups.get(group, 0) + 1
+            ranked = sorted(groups.items(), key=lambda item: (-item[1], item[0]))
+            shown = [f"{group}/ ({count})" for group, count in ranked[:max_groups]]
+            if len(ranked) > max_groups:
+                shown.append(f"{len(ranked) - max_groups} more directories")
+            lines.append(f"  {label} {len(relative)} files: {', '.join(shown)}")
+        return "\n".join(lines)
+
+
+class _PollingBackend:
+    """Diffs two mtime snapshots of the workspace."""
+
+    def __init__(self, watcher: "WorkspaceWatcher"):
+        self._watcher = watcher
+        self._snapshot: dict[str, tuple[int, int]] = {}
+
+    def begin(self):
+        self._snapshot = dict(self._scan())
+
+    def collect(self, changes: ChangeSet):
+        current = dict(self._scan())
+        for path, signature in current.items():
+            previous = self._snapshot.get(path)
+            if previous is None:
+                changes.record_created(path)
+            elif previous != signature:
+                changes.record_modified(path)
+        for path in self._snapshot.keys() - current.keys():
+            changes.record_deleted(path)
+        self._snapshot = current
+
+    def close(self):
+        self._snapshot = {}
+
+    def _scan(self) -> Iterator[tuple[str, tuple[int, int]]]:
+        stack = [self._watcher.root]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                if self._watcher.is_ignored(entry.name):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        # directories only count when they appear or disappear
+                        stack.append(entry.path)
+                        yield entry.path, (0, 0)
+                    else:
+                        stat = entry.stat(follow_symlinks=False)
+                        yield entry.path, (stat.st_mtime_ns, stat.st_size)
+                except OSError:
+                    continue
+
+
+class _InotifyBackend:
+    """Recursive inotify watches, read without blocking at the end of each call."""
+
+    def __init__(self, watcher: "WorkspaceWatcher"):
+        libc_name = ctypes.util.find_library("c")
+        if platform.system() != "Linux" or not libc_name:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._watcher = watcher
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches: dict[int, str] = {}
+        try:
+            self._add_tree(watcher.root, None)
+        except OSError:
+            self.close()
+            raise
+
+    def begin(self):
+        # discard whatever happened between tool calls
+        self._read_events(None)
+
+    def collect(self, changes: ChangeSet):
+        self._read_events(changes)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        self._watches.clear()
+
+    def _add_tree(self, root: str, changes: ChangeSet | None):
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(directory), WATCH_MASK
+            )
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err in (errno.ENOENT, errno.EACCES, errno.ENOTDIR):
+                    continue
+                # most likely ENOSPC: max_user_watches is exhausted
+                raise OSError(err, f"inotify_add_watch failed for {directory}")
+            self._watches[wd] = directory
+            try:
+                with os.scandir(directory) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                if self._watcher.is_ignored(entry.name):
+                    continue
+                if changes is not None:
+                    changes.record_created(entry.path)
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                except OSError:
+                    continue
+
+    def _read_events(self, changes: ChangeSet | None):
+        while True:
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            if not buffer:
+                return
+            for wd, mask, name in _parse_events(buffer):
+                if mask & IN_Q_OVERFLOW:
+                    if changes is not None:
+                        changes.overflowed = True
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                directory = self._watches.get(wd)
+                if directory is None or mask & IN_DELETE_SELF:
+                    continue
+                if name and self._watcher.is_ignored(name):
+                    continue
+                path = os.path.join(directory, name) if name else directory
+                is_dir = bool(mask & IN_ISDIR)
+                if is_dir and mask & (IN_CREATE | IN_MOVED_TO):
+                    # new subtrees need their own watches; report their contents
+                    try:
+                        self._add_tree(path, changes)
+                    except OSError:
+                        if changes is not None:
+                            changes.overflowed = True
+                if changes is None:
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changes.record_created(path)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    changes.record_deleted(path)
+                elif not is_dir and mask & (IN_MODIFY | IN_CLOSE_WRITE | IN_ATTRIB):
+                    changes.record_modified(path)
+
+
+def _parse_events(buffer: bytes) -> Iterator[tuple[int, int, str]]:
+    offset = 0
+    while offset + _EVENT_HEADER.size <= len(buffer):
+        wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(buffer, offset)
+        offset += _EVENT_HEADER.size
+        name = buffer[offset : offset + length].rstrip(b"\0")
+        offset += length
+        yield wd, mask, os.fsdecode(name)
+
+
+class WorkspaceWatcher:
+    """
+    Collects the paths created, modified and deleted under `root` between `begin()` and
+    `collect()`. Uses inotify where available and falls back to mtime polling.
+    """
+
+    def __init__(
+        self,
+        root: str | os.PathLike,
+        ignore: Iterable[str] = DEFAULT_IGNORE,
+        use_inotify: bool = True,
+    ):
+        self.root = os.path.abspath(os.fspath(root))
+        self.ignore = tuple(ignore)
+        self._listeners: list[Callable[[ChangeSet], None]] = []
+        self._lock = threading.Lock()
+        self._backend: _InotifyBackend | _PollingBackend
+        try:
+            if not use_inotify:
+                raise OSError(errno.ENOSYS, "inotify disabled")
+            self._backend = _InotifyBackend(self)
+        except OSError:
+            self._backend = _PollingBackend(self)
+
+    @property
+    def backend(self) -> str:
+        return "inotify" if isinstance(self._backend, _InotifyBackend) else "polling"
+
+    def is_ignored(self, name: str) -> bool:
+        return name.startswith(".") or any(
+            fnmatch.fnmatch(name, pattern) for pattern in self.ignore
+        )
+
+    def add_listener(self, listener: Callable[[ChangeSet], None]):
+        """Register a callback that receives every non-empty change set."""
+        self._listeners.append(listener)
+
+    def begin(self):
+        """Start a new collection window, e.g. right before a tool runs."""
+        with self._lock:
+            self._backend.begin()
+
+    def collect(self) -> ChangeSet:
+        """Return the changes since `begin()` and notify listeners."""
+        changes = ChangeSet(root=self.root)
+        with self._lock:
+            self._backend.collect(changes)
+        if changes:
+            for listener in self._listeners:
+                listener(changes)
+        return changes
+
+    def close(self):
+        with self._lock:
+            self._backend.close()
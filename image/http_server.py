@@ -1,16 +1,11 @@
 import os
-import socket
-from http.server import HTTPServer, SimpleHTTPRequestHandler
 
-
-class HTTPServerV6(HTTPServer):
-    address_family = socket.AF_INET6
+from computer_use_demo.media import MediaLibrary, MediaServer
 
 
 def run_server():
-    os.chdir(os.path.dirname(__file__) + "/static_content")
-    server_address = ("::", 8080)
-    httpd = HTTPServerV6(server_address, SimpleHTTPRequestHandler)
+    library = MediaLibrary(os.path.dirname(__file__) + "/static_content")
+    httpd = MediaServer(library, host="::", port=8080)
     print("Starting HTTP server on port 8080...")  # noqa: T201
     httpd.serve_forever()
 
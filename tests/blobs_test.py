@@ -0,0 +1,181 @@
+import base64
+import copy
+import gc
+import threading
+import uuid
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
+
+from PIL import Image
+
+from computer_use_demo.autopc.actor.anthropic_actor import AnthropicActor
+from computer_use_demo.blobs import BlobStore, ImageRef, as_base64, materialize
+from computer_use_demo.tokens import image_size
+from computer_use_demo.tools.base import ToolResult
+from tests.stub_api import StubAPIServer, StubResponse, message_body
+
+
+def _png(seed: int, width: int = 64, height: int = 40) -> bytes:
+    image = Image.effect_noise((width, height), 64 + seed)
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _tool_result(image) -> dict:
+    return {
+        "role": "user",
+        "content": [
+            {
+                "type": "tool_result",
+                "tool_use_id": "toolu_1",
+                "content": [
+                    {"type": "text", "text": "done"},
+                    {
+                        "type": "image",
+                        "source": {"type": "base64", "media_type": "image/png", "data": image},
+                    },
+                ],
+            }
+        ],
+    }
+
+
+def test_same_content_is_stored_once_and_released_with_last_handle():
+    store = BlobStore()
+    data = _png(1)
+    first = store.put(data)
+    second = store.put(data)
+    assert first == second and first is not second
+    assert store.refs(first.key) == 2
+    assert store.stats.blobs == 1
+    assert store.stats.memory_bytes == len(data)
+    assert store.stats.deduplicated_bytes == len(data)
+
+    key = first.key
+    del first
+    gc.collect()
+    assert store.refs(key) == 1
+    assert second.data() == data
+    del second
+    gc.collect()
+    assert store.refs(key) == 0
+    assert store.stats.blobs == 0
+    assert store.stats.memory_bytes == 0
+
+
+def test_copies_share_the_handle():
+    ref = BlobStore().put(_png(1))
+    assert copy.copy(ref) is ref
+    assert copy.deepcopy({"data": ref})["data"] is ref
+
+
+def test_spills_least_recently_used_to_disk(tmp_path):
+    images = [_png(i) for i in range(3)]
+    store = BlobStore(memory_limit=len(images[0]) + len(images[1]) + 10, spill_dir=tmp_path)
+    refs = [store.put(data) for data in images[:2]]
+    refs[0].data()  # now the second image is the least recently used
+    refs.append(store.put(images[2]))
+
+    assert store.stats.spills == 1
+    assert (tmp_path / refs[1].key).exists()
+    assert store.stats.memory_bytes <= store.memory_limit
+    assert store.read(refs[1].key, 10, 20) == images[1][10:20]
+    assert store.size(refs[1].key) == len(images[1])
+    assert [ref.data() for ref in refs] == images
+
+    key = refs[1].key
+    del refs[1]
+    gc.collect()
+    assert not (tmp_path / key).exists()
+    assert store.stats.spilled_bytes == 0
+
+
+def test_a_spilled_blob_can_be_read_while_its_last_handle_goes(tmp_path, monkeypatch):
+    images = [_png(i) for i in range(2)]
+    store = BlobStore(memory_limit=1, spill_dir=tmp_path)
+    refs = [store.put(data) for data in images]
+    key = refs[0].key
+    assert store.stats.spills == 1
+    read_bytes = Path.read_bytes
+    release = threading.Thread(target=store.decref, args=(key,))
+
+    def release_while_reading(path):
+        # the last handle goes away on another thread, mid-read
+        release.start()
+        release.join(0.2)
+        return read_bytes(path)
+
+    monkeypatch.setattr(Path, "read_bytes", release_while_reading)
+    assert store.get(key) == images[0]
+    monkeypatch.undo()
+    release.join()
+    assert not (tmp_path / key).exists()
+
+
+def test_handle_knows_image_size():
+    ref = BlobStore().put(_png(1, 320, 200))
+    assert ref.dimensions == (320, 200)
+    assert image_size(ref) == (320, 200)
+
+
+def test_materialize_only_copies_messages_with_handles():
+    store = BlobStore()
+    data = _png(1)
+    ref = store.put(data)
+    text = {"role": "user", "content": [{"type": "text", "text": "hi"}]}
+    plain = {"role": "user", "content": "go"}
+    with_ref = _tool_result(ref)
+    messages = [plain, text, with_ref]
+
+    sent = materialize(messages)
+    assert sent[0] is plain and sent[1] is text
+    image = sent[2]["content"][0]["content"][1]
+    assert image["source"]["data"] == base64.b64encode(data).decode()
+    # the history still holds the handle
+    assert with_ref["content"][0]["content"][1]["source"]["data"] is ref
+
+
+def test_actor_sends_base64_and_keeps_handles(monkeypatch):
+    data = _png(1)
+    ref = BlobStore().put(data)
+    messages = [
+        {"role": "user", "content": "look"},
+        {
+            "role": "assistant",
+            "content": [{"type": "tool_use", "id": "toolu_1", "name": "computer", "input": {}}],
+        },
+        _tool_result(ref),
+    ]
+    with StubAPIServer(StubResponse(body=message_body())) as stub:
+        monkeypatch.setenv("ANTHROPIC_BASE_URL", stub.base_url)
+        actor = AnthropicActor(
+            model="stub-model",
+            provider="anthropic",
+            system_prompt_suffix="",
+            api_key=f"test-{uuid.uuid4()}",
+            api_response_callback=mock.Mock(),
+        )
+        actor(messages=messages)
+
+        image = stub.requests[0]["messages"][2]["content"][0]["content"][1]
+        assert image["source"]["data"] == base64.b64encode(data).decode()
+    assert messages[2]["content"][0]["content"][1]["source"]["data"] is ref
+
+
+def test_history_holds_far_less_than_base64_copies():
+    store = BlobStore()
+    screenshots = [_png(i, 256, 160) for i in range(10)]
+    # before: the tool result, the message and the screenshot cache each held base64
+    encoded = [base64.b64encode(data).decode() for data in screenshots]
+    before = sum(3 * len(item) for item in encoded)
+
+    refs = [store.put(data) for data in screenshots]
+    results = [ToolResult(base64_image=ref) for ref in refs]
+    history = [_tool_result(result.base64_image) for result in results]
+    cache = {i: result.base64_image for i, result in enumerate(results)}
+    after = store.stats.memory_bytes
+    assert before / after > 3.5
+    assert as_base64(history[0]["content"][0]["content"][1]["source"]["data"]) == encoded[0]
+    assert isinstance(cache[0], ImageRef)
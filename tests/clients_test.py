@@ -0,0 +1,55 @@
+import pytest
+
+from computer_use_demo.clients import ClientRegistry, PoolLimits
+from tests.stub_api import StubAPIServer
+
+
+@pytest.fixture
+def stub():
+    with StubAPIServer() as server:
+        yield server
+
+
+@pytest.fixture
+def registry():
+    registry = ClientRegistry(PoolLimits(max_connections=4, max_keepalive_connections=2))
+    yield registry
+    registry.close()
+
+
+def _create(client):
+    return client.messages.create(
+        model="stub-model",
+        max_tokens=10,
+        messages=[{"role": "user", "content": "hi"}],
+    )
+
+
+def test_clients_are_reused_per_key(registry, stub):
+    client = registry.get("anthropic", api_key="key-1", base_url=stub.base_url)
+    assert registry.get("anthropic", api_key="key-1", base_url=stub.base_url) is client
+    assert registry.get("anthropic", api_key="key-2", base_url=stub.base_url) is not client
+    assert all("key-1" not in str(key) for key in registry.metrics())
+    with pytest.raises(ValueError, match="not supported"):
+        registry.get("unknown")
+
+
+def test_connections_are_kept_alive_across_turns(registry, stub):
+    for _ in range(5):
+        client = registry.get("anthropic", api_key="key", base_url=stub.base_url)
+        assert _create(client).content[0].text == "ok"
+
+    metrics = registry.metrics_for("anthropic", api_key="key", base_url=stub.base_url)
+    assert metrics["requests"] == 5
+    assert metrics["connections_opened"] == 1
+    assert metrics["client_reuses"] == 4
+    assert stub.connections == 1
+
+
+def test_pool_limits_from_env(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_POOL_MAX_CONNECTIONS", "7")
+    monkeypatch.setenv("ANTHROPIC_POOL_KEEPALIVE_EXPIRY", "3.5")
+    limits = PoolLimits.from_env()
+    assert limits.max_connections == 7
+    assert limits.keepalive_expiry == 3.5
+    assert limits.max_keepalive_connections == PoolLimits().max_keepalive_connections
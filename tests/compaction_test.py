@@ -0,0 +1,189 @@
+import base64
+import logging
+from io import BytesIO
+
+from anthropic.types.beta import BetaTextBlock, BetaToolUseBlock
+from PIL import Image
+
+from computer_use_demo.autopc.actor.compaction import (
+    SUMMARY_PREFIX,
+    ConversationCompactor,
+    ModelSummarizer,
+)
+from computer_use_demo.conversation import Conversation, filter_to_n_most_recent_images
+from computer_use_demo.event_loop import BackgroundEventLoop
+from computer_use_demo.request_policy import RequestPolicy, RequestTarget, RetryPolicy
+from computer_use_demo.tokens import (
+    block_tokens,
+    image_size,
+    image_tokens,
+    message_tokens,
+)
+from tests.stub_api import StubAPIServer, StubResponse, message_body
+
+
+def _png(width: int, height: int) -> str:
+    buffer = BytesIO()
+    Image.new("RGB", (width, height)).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def _session(steps: int, output_chars: int = 4000):
+    messages = [{"role": "user", "content": "open the report and fix the totals"}]
+    for i in range(steps):
+        messages.append(
+            {
+                "role": "assistant",
+                "content": [
+                    BetaTextBlock(type="text", text=f"Step {i}: " + "thinking " * 100),
+                    BetaToolUseBlock(
+                        type="tool_use", id=f"toolu_{i}", name="bash", input={"command": "ls"}
+                    ),
+                ],
+            }
+        )
+        messages.append(
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "tool_result",
+                        "tool_use_id": f"toolu_{i}",
+                        "content": [{"type": "text", "text": "x" * output_chars}],
+                    }
+                ],
+            }
+        )
+    return messages
+
+
+def _total(messages):
+    return sum(message_tokens(m) for m in messages)
+
+
+def test_image_tokens_from_resolution():
+    data = _png(1280, 800)
+    assert image_size(data) == (1280, 800)
+    assert block_tokens({"type": "image", "source": {"data": data}}) == image_tokens(1280, 800)
+    assert image_tokens(1280, 800) == 1366
+    # downscaled to a 1568px long edge first
+    assert image_tokens(3136, 1568) == image_tokens(1568, 784)
+    buffer = BytesIO()
+    Image.new("RGB", (100, 50)).save(buffer, format="JPEG")
+    assert image_size(base64.b64encode(buffer.getvalue()).decode()) == (100, 50)
+
+
+def test_under_budget_is_untouched():
+    messages = _session(3)
+    report = ConversationCompactor(budget_tokens=100_000).compact(messages)
+    assert not report.compacted
+    assert messages == _session(3)
+
+
+def test_stubs_oldest_tool_outputs_first(caplog):
+    messages = _session(10)
+    budget = _total(messages) - 3000
+    compactor = ConversationCompactor(budget_tokens=budget, keep_recent_messages=4)
+    with caplog.at_level(logging.INFO):
+        report = compactor.compact(messages)
+
+    assert report.tokens_after <= compactor.target_tokens
+    assert report.tokens_after == _total(messages)
+    result = messages[2]["content"][0]
+    assert result["tool_use_id"] == "toolu_0"
+    assert result["content"][0]["text"].startswith("x" * 200 + "\n[compacted: 3800 characters")
+    # recent turns are kept verbatim, and tool_use blocks everywhere
+    assert messages[-1]["content"][0]["content"][0]["text"] == "x" * 4000
+    assert all(
+        isinstance(m["content"][1], BetaToolUseBlock) for m in messages[1::2]
+    )
+    assert "compacted conversation" in caplog.text
+    assert report.decisions[0] == "message 1: truncated assistant text"
+
+
+def test_stubbed_images_are_dropped():
+    messages = _session(4)
+    messages[2]["content"][0]["content"].append(
+        {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": _png(1280, 800)}}
+    )
+    compactor = ConversationCompactor(budget_tokens=1000, keep_recent_messages=2)
+    compactor.compact(messages)
+    (stub,) = messages[2]["content"][0]["content"]
+    assert stub["type"] == "text"
+    assert stub["text"].endswith("[compacted: 1 screenshot(s) removed]")
+
+
+def test_collapses_old_turns_into_summary():
+    seen = []
+
+    def summarizer(messages):
+        seen.append(messages)
+        return f"did {len(messages)} things"
+
+    messages = _session(10)
+    compactor = ConversationCompactor(
+        budget_tokens=1500, keep_recent_messages=4, summarizer=summarizer
+    )
+    report = compactor.compact(messages)
+
+    assert report.collapsed_messages == 16
+    assert [m["role"] for m in messages] == ["user", "assistant", "user", "assistant", "user"]
+    assert messages[0]["content"][-1]["text"] == SUMMARY_PREFIX + "did 16 things"
+    assert messages[0]["content"][0]["text"] == "open the report and fix the totals"
+    assert messages[1]["content"][1].id == "toolu_8"
+
+    # a second collapse folds the earlier summary into the new one
+    messages += _session(4)[1:]
+    compactor.compact(messages)
+    assert seen[1][0]["content"][0]["text"] == SUMMARY_PREFIX + "did 16 things"
+    assert sum(b["text"].startswith(SUMMARY_PREFIX) for b in messages[0]["content"]) == 1
+
+
+def test_summaries_are_requested_under_the_request_policy():
+    overloaded = StubResponse(
+        status=529,
+        body={"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}},
+    )
+    summary = message_body(content=[{"type": "text", "text": "opened the report"}])
+    event_loop = BackgroundEventLoop()
+    try:
+        with StubAPIServer(StubResponse(body=summary)) as stub:
+            stub.script = [overloaded]
+            policy = RequestPolicy(
+                RequestTarget("anthropic", "summary-model", api_key="test-key", base_url=stub.base_url),
+                retry=RetryPolicy(base_delay=0.01, max_delay=0.05),
+            )
+            text = ModelSummarizer(policy, event_loop=event_loop)(_session(2))
+    finally:
+        event_loop.stop()
+
+    assert text == "opened the report"
+    assert [request["model"] for request in stub.requests] == ["summary-model"] * 2
+    assert policy.metrics.retries == 1
+
+
+def test_pruning_after_compaction_keeps_the_latest_screenshots():
+    messages = Conversation(_session(25, output_chars=100))
+    for message in messages[2::2]:
+        message["content"][0]["content"].append(
+            {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": _png(1280, 800)}}
+        )
+    assert messages.images.update(messages) == 25
+    compactor = ConversationCompactor(budget_tokens=25_000, keep_recent_messages=30)
+    compactor.compact(messages)
+    remaining = sum(
+        1
+        for message in messages[2::2]
+        for item in message["content"][0]["content"]
+        if item["type"] == "image"
+    )
+    assert 0 < remaining < 25
+    assert messages.images.total == remaining
+
+    filter_to_n_most_recent_images(messages, 3, min_removal_threshold=1)
+    # the screenshots that are left are the newest
+    assert [
+        any(item["type"] == "image" for item in message["content"][0]["content"])
+        for message in messages[-5::2]
+    ] == [True] * 3
+    assert messages.images.total == 3
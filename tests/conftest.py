@@ -3,6 +3,23 @@ from unittest import mock
 
 import pytest
 
+from computer_use_demo.event_loop import BackgroundEventLoop
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmarks", action="store_true", help="also run tests marked benchmark"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmarks"):
+        return
+    skip = pytest.mark.skip(reason="benchmark; run with --benchmarks")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
 
 @pytest.fixture(autouse=True)
 def mock_screen_dimensions():
@@ -10,3 +27,28 @@ def mock_screen_dimensions():
         os.environ, {"HEIGHT": "768", "WIDTH": "1024", "DISPLAY_NUM": "1"}
     ):
         yield
+
+
+@pytest.fixture
+def event_loop_thread():
+    loop = BackgroundEventLoop(name="test-event-loop")
+    yield loop
+    loop.stop()
+
+
+@pytest.fixture
+def make_queue(tmp_path, event_loop_thread):
+    """Makes `JobQueue`s under `tmp_path` on `event_loop_thread`, closed after the test."""
+    # imported here: the jobs module pulls in the tools, which need a display
+    from computer_use_demo.jobs import JobQueue
+
+    queues = []
+
+    def make(**kwargs):
+        queue = JobQueue(tmp_path / "jobs", event_loop=event_loop_thread, **kwargs)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.close()
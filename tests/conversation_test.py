@@ -0,0 +1,178 @@
+import copy
+import time
+from unittest import mock
+
+import pytest
+from anthropic.types.beta import BetaMessage, BetaTextBlock, BetaToolUseBlock
+
+from computer_use_demo.autopc.executor.anthropic_executor import AnthropicExecutor
+from computer_use_demo.conversation import (
+    Conversation,
+    ImageIndex,
+    MessageKeys,
+    filter_to_n_most_recent_images,
+    message_key,
+)
+from computer_use_demo.event_loop import BackgroundEventLoop
+from computer_use_demo.tools.registry import ToolRegistry
+
+
+def _screenshot_turn(n: int):
+    return {
+        "role": "user",
+        "content": [
+            {
+                "type": "tool_result",
+                "tool_use_id": f"toolu_{n}",
+                "content": [
+                    {"type": "text", "text": f"step {n}"},
+                    {"type": "image", "source": {"data": f"img{n}"}},
+                ],
+            }
+        ],
+    }
+
+
+def _images(messages):
+    return [
+        content["source"]["data"]
+        for message in messages
+        if isinstance(message["content"], list)
+        for block in message["content"]
+        if block.get("type") == "tool_result"
+        for content in block["content"]
+        if content["type"] == "image"
+    ]
+
+
+def test_matches_full_scan_turn_by_turn():
+    conversation = Conversation([{"role": "user", "content": "start"}])
+    plain = copy.deepcopy(list(conversation))
+    for n in range(40):
+        turn = _screenshot_turn(n)
+        conversation.append(turn)
+        plain.append(copy.deepcopy(turn))
+        removed = filter_to_n_most_recent_images(conversation, 3, min_removal_threshold=5)
+        assert removed == filter_to_n_most_recent_images(plain, 3, min_removal_threshold=5)
+        assert conversation == plain
+    assert len(_images(conversation)) <= 3 + 4
+    assert _images(conversation)[-1] == "img39"
+    # the text of pruned tool results is kept
+    assert conversation[1]["content"][0]["content"] == [{"type": "text", "text": "step 0"}]
+
+
+def test_removes_in_chunks():
+    conversation = Conversation(_screenshot_turn(n) for n in range(12))
+    assert filter_to_n_most_recent_images(conversation, 2, min_removal_threshold=10) == 10
+    assert _images(conversation) == ["img10", "img11"]
+    assert conversation.images.total == 2
+    assert filter_to_n_most_recent_images(conversation, 2, min_removal_threshold=10) == 0
+
+
+def test_only_scans_new_messages():
+    conversation = Conversation(_screenshot_turn(n) for n in range(5))
+    filter_to_n_most_recent_images(conversation, 10)
+
+    class Exploding(dict):
+        def __getitem__(self, key):
+            raise AssertionError("already indexed message was rescanned")
+
+    for i in range(4):
+        conversation[i] = Exploding(conversation[i])
+    conversation.append(_screenshot_turn(5))
+    assert conversation.images.update(conversation) == 6
+
+
+def test_rebuilds_after_history_rewritten():
+    conversation = Conversation(_screenshot_turn(n) for n in range(6))
+    assert conversation.images.update(conversation) == 6
+    del conversation[2:]
+    conversation.append(_screenshot_turn(9))
+    assert conversation.images.update(conversation) == 3
+    assert filter_to_n_most_recent_images(conversation, 1, min_removal_threshold=1) == 2
+    assert _images(conversation) == ["img9"]
+
+
+def test_images_removed_elsewhere_are_not_double_counted():
+    messages = [_screenshot_turn(n) for n in range(4)]
+    index = ImageIndex()
+    assert index.update(messages) == 4
+    messages[0]["content"][0]["content"] = []
+    assert index.remove_oldest(2) == 2
+    assert _images(messages) == ["img3"]
+    assert index.total == 1
+
+
+def _assistant_turn(n: int, as_dicts: bool = False):
+    content = [
+        BetaTextBlock(type="text", text=f"step {n}: clicking"),
+        BetaToolUseBlock(
+            type="tool_use", id=f"toolu_{n}", name="computer", input={"action": "screenshot"}
+        ),
+    ]
+    if as_dicts:
+        content = [block.model_dump(exclude_unset=True) for block in content]
+    return {"role": "assistant", "content": content}
+
+
+def test_message_key_is_a_content_hash():
+    assert message_key(_assistant_turn(1)) == message_key(_assistant_turn(1, as_dicts=True))
+    assert message_key(_assistant_turn(1)) != message_key(_assistant_turn(2))
+    assert message_key(_screenshot_turn(1)) == message_key(copy.deepcopy(_screenshot_turn(1)))
+
+
+def test_message_keys_follow_the_list():
+    messages = [_assistant_turn(n) for n in range(3)]
+    keys = MessageKeys()
+    assert keys.contains(messages, _assistant_turn(1))
+    assert not keys.contains(messages, _assistant_turn(3))
+    messages.append(_assistant_turn(3))
+    assert keys.contains(messages, _assistant_turn(3))
+    del messages[1:]
+    assert not keys.contains(messages, _assistant_turn(2))
+
+
+def test_executor_does_not_append_a_response_twice():
+    event_loop = BackgroundEventLoop()
+    executor = AnthropicExecutor(
+        output_callback=mock.Mock(),
+        tool_output_callback=mock.Mock(),
+        tool_registry=ToolRegistry(factories={}),
+        event_loop=event_loop,
+    )
+    response = BetaMessage(
+        id="msg_1",
+        type="message",
+        role="assistant",
+        model="stub-model",
+        content=[BetaTextBlock(type="text", text="All done.")],
+        stop_reason="end_turn",
+        usage={"input_tokens": 1, "output_tokens": 1},
+    )
+    try:
+        for messages in (Conversation([{"role": "user", "content": "go"}]), [{"role": "user", "content": "go"}]):
+            list(executor(response, messages))
+            list(executor(response, messages))
+            assert len(messages) == 2
+    finally:
+        event_loop.stop()
+
+
+@pytest.mark.benchmark
+def test_dedup_benchmark_500_steps():
+    """Duplicate checks over a 500-step session: list scans against set lookups."""
+    steps = 500
+
+    def session(check):
+        messages = Conversation([{"role": "user", "content": "go"}])
+        start = time.process_time()
+        for n in range(steps):
+            for message in (_assistant_turn(n), _screenshot_turn(n)):
+                if not check(messages, message):
+                    messages.append(message)
+        return time.process_time() - start, messages
+
+    scan, scanned = session(lambda messages, message: message in messages)
+    lookup, looked_up = session(lambda messages, message: messages.keys.contains(messages, message))
+    assert scanned == looked_up
+    assert lookup * 3 < scan
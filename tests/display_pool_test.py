@@ -0,0 +1,141 @@
+import subprocess
+import threading
+import time
+
+import pytest
+
+from computer_use_demo.display_pool import DisplayPool, PoolExhaustedError
+from computer_use_demo.displays import DisplayError, DisplayNumbers, XvfbDisplay
+from computer_use_demo.sessions import display_pool_from_env
+
+
+class _FakeDisplay(XvfbDisplay):
+    """Stands in for Xvfb with a process that just sleeps; starting it takes a while."""
+
+    start_delay = 0.2
+
+    def command(self) -> list[str]:
+        return ["sleep", "60"]
+
+    def ready(self) -> bool:
+        return True
+
+    def start(self, timeout: float = 10.0) -> "_FakeDisplay":
+        time.sleep(self.start_delay)
+        return super().start(timeout)
+
+
+def _pool(base: int, **kwargs) -> DisplayPool:
+    return DisplayPool(_FakeDisplay, numbers=DisplayNumbers(base), health_interval=0.1, **kwargs)
+
+
+def _wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_warm_leases_skip_startup():
+    pool = _pool(200, size=2).start()
+    try:
+        assert pool.metrics()["idle"] == 2
+        start = time.perf_counter()
+        display = pool.lease()
+        assert time.perf_counter() - start < 0.05
+        assert display.alive()
+        assert pool.stats.warm_leases == 1
+        assert pool.metrics()["leased"] == 1
+    finally:
+        pool.close()
+    assert not display.alive()
+
+
+def test_empty_pool_starts_a_display():
+    pool = _pool(210)
+    display = pool.lease()
+    try:
+        assert display.alive()
+        assert display.name == ":210"
+        assert pool.stats.cold_starts == 1
+        assert pool.stats.lease_seconds >= _FakeDisplay.start_delay
+    finally:
+        pool.release(display)
+    # nothing to keep it for
+    assert not display.alive()
+    assert pool.total == 0
+
+
+def test_full_pool_waits_for_a_release():
+    pool = _pool(220, size=1, max_size=1).start()
+    try:
+        first = pool.lease()
+        with pytest.raises(DisplayError):
+            pool.lease(timeout=0.05)
+        threading.Timer(0.1, pool.release, [first]).start()
+        second = pool.lease(timeout=5)
+        assert second is first
+        assert pool.stats.waits == 1  # the lease that timed out is not counted
+        assert pool.stats.resets == 1
+    finally:
+        pool.close()
+
+
+def test_released_displays_are_reset():
+    pool = _pool(230, size=1).start()
+    try:
+        display = pool.lease()
+        client = subprocess.Popen(["sleep", "60"], env=display.env())
+        assert display.clients() == [client.pid]
+        pool.release(display)
+        _wait_for(lambda: pool.metrics()["idle"] == 1)
+        assert client.wait(1) == -9
+        assert display.alive()
+        assert display.clients() == []
+    finally:
+        pool.close()
+
+
+def test_unhealthy_displays_are_replaced():
+    pool = _pool(240, size=1).start()
+    try:
+        broken = pool._idle[0]
+        broken.process.kill()
+        _wait_for(lambda: pool.stats.unhealthy == 1 and pool.metrics()["idle"] == 1)
+        replacement = pool.lease()
+        assert replacement is not broken
+        assert replacement.alive()
+        assert pool.stats.started == 2
+    finally:
+        pool.close()
+
+
+def test_sized_for_concurrency():
+    pool = DisplayPool.for_concurrency(_FakeDisplay, 3, numbers=DisplayNumbers(250))
+    assert pool.size == pool.max_size == 4
+    start = time.perf_counter()
+    pool.start()
+    try:
+        # the displays start in parallel
+        assert time.perf_counter() - start < 4 * _FakeDisplay.start_delay
+        displays = [pool.lease() for _ in range(3)]
+        assert len({display.name for display in displays}) == 3
+        assert pool.stats.cold_starts == 0
+        assert pool.metrics()["idle"] == 1
+    finally:
+        pool.close()
+
+
+def test_pool_from_env_is_bounded(monkeypatch):
+    monkeypatch.setattr("computer_use_demo.sessions.XvfbDisplay", _FakeDisplay)
+    monkeypatch.setenv("SESSION_DISPLAYS", "xvfb")
+    monkeypatch.setenv("SESSION_DISPLAY_POOL", "1")
+    pool = display_pool_from_env(2, base=260)
+    try:
+        assert (pool.size, pool.max_size) == (1, 3)
+        displays = [pool.lease() for _ in range(3)]
+        with pytest.raises(PoolExhaustedError):
+            pool.lease(timeout=0.05)
+    finally:
+        pool.close()
+    assert not any(display.alive() for display in displays)
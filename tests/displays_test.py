@@ -0,0 +1,185 @@
+import asyncio
+import shutil
+import subprocess
+import threading
+import time
+
+import pytest
+
+from computer_use_demo.display_pool import DisplayPool
+from computer_use_demo.displays import DisplayNumbers, XvfbDisplay, process_tree_usage
+from computer_use_demo.sessions import SessionManager
+from computer_use_demo.tools import BashTool, ComputerTool
+
+
+class _FakeDisplay(XvfbDisplay):
+    """Stands in for Xvfb with a process that just sleeps."""
+
+    def command(self) -> list[str]:
+        return ["sleep", "60"]
+
+    def ready(self) -> bool:
+        return True
+
+
+def test_process_tree_usage_counts_descendants():
+    process = subprocess.Popen(["bash", "-c", "sleep 5 & sleep 5; wait"])
+    try:
+        time.sleep(0.2)
+        usage = process_tree_usage([process.pid])
+        assert usage.processes == 3
+        assert usage.rss_bytes > 0
+        assert usage.cpu_seconds >= 0
+    finally:
+        process.kill()
+        process.wait()
+    assert process_tree_usage([process.pid]).processes == 0
+
+
+def test_xvfb_command_matches_startup_script():
+    display = XvfbDisplay(7, width=1024, height=768)
+    assert display.command()[:6] == ["Xvfb", ":7", "-ac", "-screen", "0", "1024x768x24"]
+    env = display.env()
+    assert (env["DISPLAY"], env["DISPLAY_NUM"], env["WIDTH"]) == (":7", "7", "1024")
+
+
+@pytest.mark.skipif(shutil.which("Xvfb") is None, reason="Xvfb is not installed")
+def test_xvfb_starts_and_stops():
+    display = XvfbDisplay(187).start()
+    try:
+        assert display.alive()
+        assert display.ready()
+    finally:
+        display.stop()
+    assert not display.alive()
+
+
+async def test_sessions_get_their_own_display_and_tools():
+    manager = SessionManager(display_pool=DisplayPool(_FakeDisplay, numbers=DisplayNumbers(150)))
+    a, b = manager.open("a", "alice"), manager.open("b", "bob")
+    tools_a, tools_b = await manager.tools(a), await manager.tools(b)
+    assert await manager.tools(a) is tools_a
+    assert (a.display.name, b.display.name) == (":150", ":151")
+
+    computer_a, computer_b = tools_a.get(ComputerTool.name), tools_b.get(ComputerTool.name)
+    assert computer_a is not computer_b
+    assert computer_a.display == ":150"
+    assert computer_a.xdotool == "DISPLAY=:150 xdotool"
+    assert tools_a.get("str_replace_editor") is not tools_b.get("str_replace_editor")
+
+    bash = tools_b.get(BashTool.name)
+    result = await bash(command="echo $DISPLAY")
+    assert result.output == ":151"
+
+    usage = manager.usage()
+    assert usage["a"].processes == 1  # the display
+    assert usage["b"].processes >= 2  # the display and bash
+    assert usage["b"].rss_bytes > 0
+
+    display = b.display
+    manager.close("b")
+    assert not display.alive()
+    assert manager.get("b") is None
+    # the number is free again
+    c = manager.open("c")
+    await manager.tools(c)
+    assert c.display.name == ":151"
+    manager.shutdown()
+    assert not a.display and not c.display
+
+
+async def test_logout_keeps_the_display_until_the_loop_stops():
+    manager = SessionManager(display_pool=DisplayPool(_FakeDisplay, numbers=DisplayNumbers(170)))
+    session = manager.open("a")
+    await manager.tools(session)
+    display = session.display
+    in_step = threading.Event()
+    drew_on = []
+
+    def steps(cancel_event):
+        while True:
+            in_step.set()
+            time.sleep(0.2)  # e.g. typing, which the cancel does not interrupt
+            drew_on.append(display.alive())
+            yield None
+            if cancel_event.is_set():
+                return
+
+    async def consume():
+        async for _ in manager.run(session, steps):
+            pass
+
+    run = asyncio.create_task(consume())
+    await asyncio.to_thread(in_step.wait)
+    await manager.aclose("a")
+    await run
+    assert drew_on and all(drew_on)
+    assert not display.alive()
+    assert manager.get("a") is None
+
+
+async def test_a_full_pool_takes_back_the_display_of_an_idle_session():
+    pool = DisplayPool(_FakeDisplay, size=1, max_size=1, numbers=DisplayNumbers(175))
+    manager = SessionManager(display_pool=pool)
+    a, b = manager.open("a"), manager.open("b")
+    tools_a = await manager.tools(a)
+    display = a.display
+
+    await manager.tools(b)
+    assert b.display is display
+    assert a.display is None
+    # a's tools were closed with the display; it gets new ones when it runs again
+    assert tools_a.get(BashTool.name) is not None
+    assert await manager.tools(a) is not tools_a
+    assert a.display is display and b.display is None
+    assert pool.stats.started == 1
+    manager.shutdown()
+
+
+async def test_a_full_pool_waits_for_running_sessions():
+    pool = DisplayPool(_FakeDisplay, max_size=1, numbers=DisplayNumbers(178))
+    manager = SessionManager(display_pool=pool)
+    a, b = manager.open("a"), manager.open("b")
+    await manager.tools(a)
+    gate = threading.Event()
+
+    def steps(cancel_event):
+        gate.wait(5)
+        yield None
+
+    async def consume():
+        async for _ in manager.run(a, steps):
+            pass
+
+    run = asyncio.create_task(consume())
+    await asyncio.sleep(0.05)
+    lease = asyncio.create_task(manager.tools(b))
+    await asyncio.sleep(0.2)
+    # the display is in use by a's loop
+    assert not lease.done()
+    gate.set()
+    await run
+    await asyncio.wait_for(lease, 5)
+    assert b.display is not None and a.display is None
+    manager.shutdown()
+
+
+async def test_idle_sessions_are_torn_down():
+    manager = SessionManager(
+        display_pool=DisplayPool(_FakeDisplay, numbers=DisplayNumbers(160)), idle_timeout=30
+    )
+    session = manager.open("a")
+    await manager.tools(session)
+    display = session.display
+    assert manager.reap_idle() == []
+    assert manager.reap_idle(now=time.monotonic() + 31) == ["a"]
+    assert not display.alive()
+    assert manager.get("a") is None
+
+
+async def test_without_a_display_pool_tools_use_the_shared_screen():
+    manager = SessionManager()
+    session = manager.open("a")
+    tools = await manager.tools(session)
+    assert session.display is None
+    assert tools.get(ComputerTool.name).display is None
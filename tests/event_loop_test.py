@@ -0,0 +1,63 @@
+import asyncio
+import threading
+
+import pytest
+
+from computer_use_demo.event_loop import get_background_loop
+from computer_use_demo.tools.bash import BashTool
+
+
+def test_run_uses_one_persistent_loop(event_loop_thread):
+    async def current_loop():
+        return asyncio.get_running_loop(), threading.current_thread()
+
+    first_loop, first_thread = event_loop_thread.run(current_loop())
+    second_loop, second_thread = event_loop_thread.run(current_loop())
+    assert first_loop is second_loop
+    assert first_thread is second_thread is not threading.current_thread()
+
+
+def test_bash_session_survives_across_runs(event_loop_thread):
+    bash = BashTool()
+    event_loop_thread.run(bash(command="export MARKER=persisted"))
+    result = event_loop_thread.run(bash(command="echo $MARKER"))
+    assert result.output == "persisted"
+
+
+def test_submit_from_many_threads(event_loop_thread):
+    async def double(x):
+        await asyncio.sleep(0.01)
+        return x * 2
+
+    results = [None] * 8
+
+    def worker(i):
+        results[i] = event_loop_thread.submit(double(i)).result()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [i * 2 for i in range(8)]
+
+
+def test_run_timeout_and_reentrancy(event_loop_thread):
+    with pytest.raises(TimeoutError):
+        event_loop_thread.run(asyncio.sleep(1), timeout=0.05)
+
+    async def reenter():
+        event_loop_thread.run(asyncio.sleep(0))
+
+    with pytest.raises(RuntimeError, match="deadlock"):
+        event_loop_thread.run(reenter())
+
+
+def test_stop_and_restart(event_loop_thread):
+    event_loop_thread.stop()
+    assert not event_loop_thread.is_running
+    assert event_loop_thread.run(asyncio.sleep(0, result="ok")) == "ok"
+
+
+def test_default_loop_is_shared():
+    assert get_background_loop() is get_background_loop()
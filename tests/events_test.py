@@ -0,0 +1,231 @@
+import base64
+import json
+import logging
+import threading
+import time
+
+from computer_use_demo.events import (
+    DropPolicy,
+    EventBus,
+    StructuredLogger,
+    summarize,
+)
+from computer_use_demo.tools.base import ToolResult
+
+PNG = base64.b64encode(b"\x89PNG\r\n\x1a\n" + b"\0" * 3000).decode()
+
+
+def _blocked_bus(policy, maxsize=3, block_timeout=0.05):
+    """A bus whose only subscriber is stuck on its first event until released."""
+    bus = EventBus()
+    release = threading.Event()
+    seen = []
+
+    def handler(event):
+        release.wait()
+        seen.append(event.payload)
+
+    subscriber = bus.subscribe(
+        handler, maxsize=maxsize, policy=policy, block_timeout=block_timeout
+    )
+    bus.publish("tick", 0)
+    deadline = time.monotonic() + 1
+    while subscriber._queue and time.monotonic() < deadline:
+        time.sleep(0.001)  # until the worker holds event 0
+    return bus, subscriber, release, seen
+
+
+def test_drop_oldest_keeps_latest_events():
+    bus, subscriber, release, seen = _blocked_bus(DropPolicy.DROP_OLDEST)
+    for i in range(1, 7):
+        bus.publish("tick", i)
+    release.set()
+    assert bus.flush(1)
+    assert seen == [0, 4, 5, 6]
+    assert subscriber.stats.dropped == 3
+
+
+def test_drop_newest_keeps_queued_events():
+    bus, subscriber, release, seen = _blocked_bus(DropPolicy.DROP_NEWEST)
+    for i in range(1, 7):
+        bus.publish("tick", i)
+    release.set()
+    assert bus.flush(1)
+    assert seen == [0, 1, 2, 3]
+    assert subscriber.stats.dropped == 3
+
+
+def test_block_waits_a_bounded_time_then_drops():
+    bus, subscriber, release, seen = _blocked_bus(
+        DropPolicy.BLOCK, maxsize=1, block_timeout=0.05
+    )
+    bus.publish("tick", 1)
+    start = time.monotonic()
+    bus.publish("tick", 2)
+    assert 0.04 <= time.monotonic() - start < 0.5
+    release.set()
+    assert bus.flush(1)
+    assert seen == [0, 1]
+    assert subscriber.stats.dropped == 1
+
+
+def test_block_resumes_as_soon_as_there_is_room():
+    bus, subscriber, release, seen = _blocked_bus(
+        DropPolicy.BLOCK, maxsize=1, block_timeout=5
+    )
+    bus.publish("tick", 1)
+    threading.Timer(0.05, release.set).start()
+    start = time.monotonic()
+    bus.publish("tick", 2)
+    assert time.monotonic() - start < 1
+    assert bus.flush(1)
+    assert seen == [0, 1, 2]
+    assert subscriber.stats.dropped == 0
+
+
+def test_slow_consumer_does_not_slow_publisher():
+    bus = EventBus()
+    bus.subscribe(lambda event: time.sleep(0.05), maxsize=8, policy=DropPolicy.DROP_OLDEST)
+    start = time.monotonic()
+    for i in range(200):
+        bus.publish("tick", i)
+    elapsed = time.monotonic() - start
+    # 200 events at 50ms each would take 10s inline
+    assert elapsed < 0.5
+    stats = bus.stats()
+    assert stats["published"] == 200
+    assert stats["mean_publish_us"] > 0
+    bus.close(0)
+
+
+def test_kinds_filter_and_handler_errors():
+    bus = EventBus()
+    seen = []
+
+    def handler(event):
+        if event.payload == "bad":
+            raise RuntimeError("boom")
+        seen.append(event.payload)
+
+    subscriber = bus.subscribe(handler, kinds={"wanted"})
+    bus.publish("other", "ignored")
+    bus.publish("wanted", "bad")
+    bus.publish("wanted", "good")
+    assert bus.flush(1)
+    assert seen == ["good"]
+    assert subscriber.stats.errors == 1
+    assert subscriber.stats.delivered == 1
+
+
+def test_route_runs_callbacks_in_order_off_thread():
+    bus = EventBus()
+    calls = []
+    caller = threading.get_ident()
+
+    def output(block):
+        calls.append(("output", block, threading.get_ident() != caller))
+
+    def tool_output(result, tool_id):
+        calls.append(("tool_output", tool_id, threading.get_ident() != caller))
+
+    publishers, subscriber = bus.route(
+        {"output": output, "tool_output": tool_output, "text": None}, session="s1"
+    )
+    assert publishers["text"] is None
+    publishers["output"]("a")
+    publishers["tool_output"](ToolResult(output="x"), "toolu_1")
+    publishers["output"]("b")
+    # events of other sessions on the same bus are not delivered
+    bus.publish("output", ("c",), session="s2")
+    bus.unsubscribe(subscriber)
+    assert calls == [
+        ("output", "a", True),
+        ("tool_output", "toolu_1", True),
+        ("output", "b", True),
+    ]
+
+
+def test_routed_callbacks_lose_nothing_when_they_fall_behind():
+    bus = EventBus()
+    received = []
+
+    def slow(item):
+        time.sleep(0.1)  # e.g. saving a screenshot
+        received.append(item)
+
+    publishers, subscriber = bus.route({"tool_output": slow}, session="s1", maxsize=2)
+    try:
+        for i in range(6):
+            publishers["tool_output"](i)
+        subscriber.flush(timeout=5)
+        assert received == list(range(6))
+        assert subscriber.stats.dropped == 0
+    finally:
+        bus.close()
+
+
+def test_a_stuck_session_does_not_hold_up_the_others():
+    bus = EventBus()
+    release = threading.Event()
+    received = []
+    stuck, _ = bus.route({"output": lambda item: release.wait(5)}, session="stuck", maxsize=2)
+    other, other_subscriber = bus.route({"output": received.append}, session="other", maxsize=2)
+    try:
+        for i in range(2):
+            stuck["output"](i)  # queued behind the stuck callback
+        start = time.perf_counter()
+        for i in range(50):
+            other["output"](i)
+        # no waiting for room behind the stuck consumer, and nothing dropped
+        assert time.perf_counter() - start < 0.05
+        assert bus.flush(timeout=0) is False
+        other_subscriber.flush(timeout=5)
+        assert received == list(range(50))
+        assert other_subscriber.stats.dropped == 0
+    finally:
+        release.set()
+        bus.close()
+
+
+def test_summarize_replaces_images_with_references():
+    message = {
+        "role": "user",
+        "content": [
+            {
+                "type": "tool_result",
+                "tool_use_id": "toolu_1",
+                "content": [
+                    {"type": "text", "text": "done"},
+                    {
+                        "type": "image",
+                        "source": {"type": "base64", "media_type": "image/png", "data": PNG},
+                    },
+                ],
+            }
+        ],
+    }
+    summary = summarize(message)
+    image = summary["content"][0]["content"][1]
+    assert set(image) == {"type", "ref", "bytes"}
+    assert image["bytes"] == 3008
+    assert PNG not in json.dumps(summary)
+
+    result = summarize((ToolResult(output="ok", base64_image=PNG), "toolu_1"))
+    assert result[0]["output"] == "ok"
+    assert result[0]["base64_image"]["ref"] == image["ref"]
+    assert result[1] == "toolu_1"
+
+    assert summarize("x" * 1000, max_text=10).endswith("(1000 chars)")
+
+
+def test_structured_logger_writes_json_lines(caplog):
+    bus = EventBus()
+    bus.subscribe(StructuredLogger(logging.getLogger("events-test")))
+    with caplog.at_level(logging.INFO, logger="events-test"):
+        bus.publisher("tool_output", session="s1")(ToolResult(base64_image=PNG), "toolu_1")
+        assert bus.flush(1)
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record["kind"] == "tool_output"
+    assert record["session"] == "s1"
+    assert record["payload"][0]["base64_image"]["bytes"] == 3008
+    assert len(caplog.records[-1].getMessage()) < 500
@@ -0,0 +1,9 @@
+import time
+
+
+def wait_done(job, timeout: float = 5.0):
+    """Wait for `job` to end, failing the test if it has not within `timeout`."""
+    deadline = time.monotonic() + timeout
+    while not job.done:
+        assert time.monotonic() < deadline, job.status
+        job.wait_for_events(len(job.events), timeout=0.1)
@@ -0,0 +1,239 @@
+import base64
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from computer_use_demo.jobs import (
+    JobRequest,
+    JobServer,
+    JobStatus,
+    QueueFullError,
+)
+from computer_use_demo.tools import ToolResult
+from tests.job_helpers import wait_done
+
+
+def _png() -> str:
+    buffer = BytesIO()
+    Image.new("RGB", (4, 4), "red").save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def _runner(steps: int = 2, delay: float = 0.0, gate: threading.Event | None = None):
+    """Stands in for the sampling loop: a screenshot and a reply per step."""
+
+    def run(job, tools, cancel_event):
+        assert tools is not None
+        if gate is not None:
+            gate.wait(5)
+        for step in range(steps):
+            if cancel_event.wait(delay):
+                return
+            job.add_event("tool_output", screenshot=job.save_screenshot(_png()))
+            result = ToolResult(output=f"step {step}")
+            job.messages.append(
+                {"role": "assistant", "content": [{"type": "text", "text": result.output}]}
+            )
+            yield result
+
+    return run
+
+
+def test_jobs_run_and_keep_artifacts(make_queue):
+    queue = make_queue(runner=_runner())
+    job = queue.submit(JobRequest(prompt="open a browser", api_key="sk-secret"))
+    wait_done(job)
+    assert job.status == JobStatus.SUCCEEDED
+    assert [event["kind"] for event in job.events] == [
+        "status",
+        "status",
+        "tool_output",
+        "tool_output",
+        "status",
+    ]
+    assert [event["seq"] for event in job.events] == list(range(5))
+
+    saved = json.loads((job.directory / "job.json").read_text())
+    assert saved["status"] == "succeeded"
+    assert saved["screenshots"] == 2
+    assert saved["timings"]["run_seconds"] >= 0
+    assert "api_key" not in saved["request"]
+    assert "sk-secret" not in "".join(p.read_text() for p in job.directory.glob("*.json*"))
+    messages = json.loads((job.directory / "messages.json").read_text())
+    assert [m["role"] for m in messages] == ["user", "assistant", "assistant"]
+    assert len((job.directory / "events.jsonl").read_text().splitlines()) == 5
+    assert (job.directory / "screenshots" / "0002.png").read_bytes().startswith(b"\x89PNG")
+    assert queue.stats.succeeded == 1
+
+
+def test_workers_bound_how_many_jobs_run(make_queue):
+    running = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def run(job, tools, cancel_event):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+        yield None
+
+    queue = make_queue(runner=run, workers=2)
+    jobs = [queue.submit(JobRequest(prompt=f"task {i}")) for i in range(6)]
+    for job in jobs:
+        wait_done(job)
+    assert peak == 2
+    assert queue.stats.succeeded == 6
+    assert queue.stats.queued == queue.stats.running == 0
+
+
+def test_a_full_queue_rejects_jobs(make_queue):
+    gate = threading.Event()
+    queue = make_queue(runner=_runner(gate=gate), workers=1, max_queued=1)
+    first = queue.submit(JobRequest(prompt="a"))
+    while first.status != JobStatus.RUNNING:
+        time.sleep(0.01)
+    queue.submit(JobRequest(prompt="b"))
+    with pytest.raises(QueueFullError):
+        queue.submit(JobRequest(prompt="c"))
+    assert queue.stats.rejected == 1
+    gate.set()
+
+
+def test_cancel_queued_and_running_jobs(make_queue):
+    queue = make_queue(runner=_runner(steps=1000, delay=0.01), workers=1)
+    running = queue.submit(JobRequest(prompt="a"))
+    waiting = queue.submit(JobRequest(prompt="b"))
+    while running.status != JobStatus.RUNNING:
+        time.sleep(0.01)
+    assert queue.cancel(waiting.id)
+    assert waiting.status == JobStatus.CANCELLED
+    assert queue.cancel(running.id)
+    wait_done(running)
+    assert running.status == JobStatus.CANCELLED
+    assert not queue.cancel(running.id)
+    assert queue.stats.cancelled == 2
+    assert queue.stats.queued == 0
+
+
+def test_cancelled_jobs_settle_once_their_loop_has_stopped(make_queue):
+    in_step = threading.Event()
+
+    def run(job, tools, cancel_event):
+        while True:
+            in_step.set()
+            time.sleep(0.2)  # a tool call, which the cancel does not interrupt
+            job.messages.append({"role": "assistant", "content": "step done"})
+            yield None
+            if cancel_event.is_set():
+                return
+
+    queue = make_queue(runner=run)
+    job = queue.submit(JobRequest(prompt="a"))
+    in_step.wait(5)
+    queue.cancel(job.id)
+    wait_done(job)
+    assert job.status == JobStatus.CANCELLED
+    # the step that was under way when it was cancelled is in the artifacts
+    saved = json.loads((job.directory / "messages.json").read_text())
+    assert saved[-1]["content"] == "step done"
+    assert len(saved) == len(job.messages)
+    assert queue.session_manager.get(job.id) is None
+
+
+def test_failures_are_recorded(make_queue):
+    def run(job, tools, cancel_event):
+        yield None
+        raise RuntimeError("no API key")
+
+    queue = make_queue(runner=run)
+    job = queue.submit(JobRequest(prompt="a"))
+    wait_done(job)
+    assert job.status == JobStatus.FAILED
+    assert job.error == "RuntimeError: no API key"
+    assert json.loads((job.directory / "job.json").read_text())["error"] == job.error
+
+
+def test_evicted_jobs_are_read_from_their_artifacts(make_queue):
+    queue = make_queue(runner=_runner(steps=0), keep_finished=1)
+    first = queue.submit(JobRequest(prompt="a"))
+    wait_done(first)
+    second = queue.submit(JobRequest(prompt="b"))
+    wait_done(second)
+    assert [job.id for job in queue.jobs()] == [second.id]
+    assert queue.get(first.id)["status"] == "succeeded"
+    assert queue.get("0" * 32) is None
+
+
+def test_requests_are_validated():
+    assert JobRequest.from_json({"prompt": "x", "screen": 1}).screen == 1
+    for body in (
+        [],
+        {},
+        {"prompt": ""},
+        {"prompt": "x", "provider": "other"},
+        {"prompt": "x", "screen": -1},
+        {"prompt": "x", "temperature": 1},
+    ):
+        with pytest.raises(ValueError):
+            JobRequest.from_json(body)
+
+
+def _request(server, method, path, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{server.port}{path}", data=data, method=method
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as error:
+        return error.code, error.read()
+
+
+def test_http_api(make_queue):
+    gate = threading.Event()
+    server = JobServer(make_queue(runner=_runner(gate=gate)), port=0).start()
+    try:
+        status, body = _request(server, "POST", "/jobs", {"prompt": "open a browser"})
+        assert status == 202
+        job_id = json.loads(body)["id"]
+
+        # progress streams until the job ends
+        received = []
+
+        def follow():
+            url = f"http://127.0.0.1:{server.port}/jobs/{job_id}/events?after=1"
+            with urllib.request.urlopen(url, timeout=5) as response:
+                for line in response:
+                    received.append(json.loads(line))
+
+        follower = threading.Thread(target=follow)
+        follower.start()
+        gate.set()
+        follower.join(5)
+        assert [event["seq"] for event in received] == [1, 2, 3, 4]
+        assert received[-1] == {**received[-1], "kind": "status", "status": "succeeded"}
+
+        status, body = _request(server, "GET", f"/jobs/{job_id}")
+        assert (status, json.loads(body)["screenshots"]) == (200, 2)
+        status, body = _request(server, "GET", f"/artifacts/{job_id}/screenshots/0001.png")
+        assert status == 200 and body.startswith(b"\x89PNG")
+        status, body = _request(server, "GET", "/jobs")
+        assert [job["id"] for job in json.loads(body)] == [job_id]
+
+        assert _request(server, "POST", "/jobs", {"prompt": ""})[0] == 400
+        assert _request(server, "GET", "/jobs/" + "0" * 32)[0] == 404
+        assert _request(server, "POST", f"/jobs/{job_id}/cancel")[0] == 404
+        assert json.loads(_request(server, "GET", "/metrics")[1])["succeeded"] == 1
+    finally:
+        server.stop()
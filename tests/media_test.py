@@ -0,0 +1,199 @@
+import gzip
+import http.client
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from computer_use_demo import media
+from computer_use_demo.blobs import BlobStore
+from computer_use_demo.media import (
+    MEDIA_PATH,
+    LRUBytesCache,
+    MediaLibrary,
+    MediaServer,
+)
+
+
+def _png(width: int = 1280, height: int = 800) -> bytes:
+    buffer = BytesIO()
+    Image.effect_noise((width, height), 64).convert("RGB").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    (tmp_path / "index.html").write_text("<html>" + "hello " * 500 + "</html>")
+    (tmp_path / "app.js").write_text("console.log(1);")
+    return tmp_path
+
+
+@pytest.fixture
+def library(static_dir):
+    return MediaLibrary(static_dir, BlobStore())
+
+
+def test_static_files_are_validated(library):
+    first = library.respond("GET", "/", {})
+    assert first.status == 200
+    assert first.headers["Content-Type"] == "text/html"
+    etag, modified = first.headers["ETag"], first.headers["Last-Modified"]
+
+    assert library.respond("GET", "/index.html", {"If-None-Match": etag}).status == 304
+    assert library.respond("GET", "/index.html", {"If-Modified-Since": modified}).status == 304
+    assert library.respond("GET", "/index.html", {"If-None-Match": '"other"'}).status == 200
+    assert library.respond("GET", "/missing.css", {}).status == 404
+    assert library.respond("GET", "/../etc/passwd", {}).status == 404
+    assert library.respond("POST", "/", {}).status == 405
+
+
+def test_text_is_gzipped_when_accepted(library, static_dir):
+    plain = library.respond("GET", "/index.html", {})
+    zipped = library.respond("GET", "/index.html", {"Accept-Encoding": "gzip, br"})
+    assert zipped.headers["Content-Encoding"] == "gzip"
+    assert zipped.headers["Vary"] == "Accept-Encoding"
+    assert zipped.headers["ETag"] != plain.headers["ETag"]
+    assert gzip.decompress(zipped.body) == plain.body
+    assert len(zipped.body) < len(plain.body) / 10
+    # the gzipped variant validates too
+    assert library.respond(
+        "GET", "/index.html", {"If-None-Match": zipped.headers["ETag"]}
+    ).status == 304
+    # too small to be worth it
+    assert "Content-Encoding" not in library.respond("GET", "/app.js", {"Accept-Encoding": "gzip"}).headers
+
+
+def test_byte_ranges(library):
+    body = library.respond("GET", "/index.html", {}).body
+    size = len(body)
+    part = library.respond("GET", "/index.html", {"Range": "bytes=10-19", "Accept-Encoding": "gzip"})
+    assert part.status == 206
+    assert part.body == body[10:20]
+    assert part.headers["Content-Range"] == f"bytes 10-19/{size}"
+    assert "Content-Encoding" not in part.headers
+
+    assert library.respond("GET", "/index.html", {"Range": "bytes=-5"}).body == body[-5:]
+    assert library.respond("GET", "/index.html", {"Range": "bytes=100-"}).body == body[100:]
+    assert library.respond("GET", "/index.html", {"Range": f"bytes={size}-"}).status == 416
+    # a stale If-Range gets the whole file
+    stale = library.respond("GET", "/index.html", {"Range": "bytes=0-1", "If-Range": '"old"'})
+    assert (stale.status, stale.body) == (200, body)
+
+
+def test_blobs_and_thumbnails(library):
+    data = _png()
+    ref = library.blob_store.put(data)
+    path = f"{MEDIA_PATH}/{ref.key}"
+
+    full = library.respond("GET", path, {})
+    assert (full.status, full.body) == (200, data)
+    assert "immutable" in full.headers["Cache-Control"]
+    assert library.respond("GET", path, {"If-None-Match": f'"{ref.key}"'}).status == 304
+
+    small = library.respond("GET", path + "?size=small", {})
+    assert small.headers["Content-Type"] == "image/jpeg"
+    assert Image.open(BytesIO(small.body)).size == (320, 200)
+    assert small.headers["ETag"] != full.headers["ETag"]
+    library.respond("GET", path + "?size=small", {})
+    assert (library.thumbnails.hits, library.thumbnails.misses) == (1, 1)
+
+    assert library.respond("GET", path + "?size=huge", {}).status == 400
+    assert library.respond("GET", f"{MEDIA_PATH}/{'0' * 64}", {}).status == 404
+    assert library.respond("GET", f"{MEDIA_PATH}/nope", {}).status == 404
+
+
+def test_validators_and_ranges_are_checked_before_reading(library, monkeypatch):
+    etag = library.respond("GET", "/index.html", {}).headers["ETag"]
+    ref = library.blob_store.put(_png(64, 40))
+    reads = []
+    read_file, read_blob = media._read_file, library.blob_store.read
+    monkeypatch.setattr(media, "_read_file", lambda *args: reads.append(args[1:]) or read_file(*args))
+    monkeypatch.setattr(
+        library.blob_store, "read", lambda *args: reads.append(args[1:]) or read_blob(*args)
+    )
+
+    assert library.respond("GET", "/index.html", {"If-None-Match": etag}).status == 304
+    assert library.respond("GET", f"{MEDIA_PATH}/{ref.key}", {"If-None-Match": f'"{ref.key}"'}).status == 304
+    assert library.respond("HEAD", "/index.html", {}).headers["Content-Length"] != "0"
+    assert reads == []
+
+    assert library.respond("GET", "/index.html", {"Range": "bytes=10-19"}).status == 206
+    assert library.respond("GET", f"{MEDIA_PATH}/{ref.key}", {"Range": "bytes=-5"}).status == 206
+    assert reads == [(10, 20), (ref.size - 5, ref.size)]
+
+
+def test_head_has_length_but_no_body(library):
+    head = library.respond("HEAD", "/index.html", {})
+    assert head.body == b""
+    assert int(head.headers["Content-Length"]) == len(library.respond("GET", "/index.html", {}).body)
+
+
+def test_lru_is_bounded_by_bytes():
+    cache = LRUBytesCache(max_bytes=10)
+    cache.put(("a",), b"1234")
+    cache.put(("b",), b"1234")
+    cache.get(("a",))
+    cache.put(("c",), b"1234")
+    assert cache.get(("b",)) is None
+    assert cache.get(("a",)) == b"1234"
+    assert cache.size == 8
+    cache.put(("big",), b"x" * 11)
+    assert cache.get(("big",)) is None
+
+
+@pytest.fixture
+def server(library):
+    server = MediaServer(library, host="127.0.0.1", port=0).start()
+    yield server
+    server.stop()
+
+
+def _get(port: int, path: str, connection: http.client.HTTPConnection | None = None) -> int:
+    connection = connection or http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    connection.request("GET", path)
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+
+def test_a_stalled_client_does_not_block_others(server):
+    stalled = socket.create_connection(("127.0.0.1", server.port))
+    stalled.sendall(b"GET /index.html HTTP/1.1\r\n")  # and never finishes
+    try:
+        start = time.perf_counter()
+        assert _get(server.port, "/index.html") == 200
+        assert time.perf_counter() - start < 1
+    finally:
+        stalled.close()
+
+
+@pytest.mark.benchmark
+def test_load_concurrent_clients(server, library):
+    """Requests per second from concurrent keep-alive clients, over the real server."""
+    ref = library.blob_store.put(_png(640, 400))
+    paths = ["/index.html", f"{MEDIA_PATH}/{ref.key}", f"{MEDIA_PATH}/{ref.key}?size=small"]
+    clients, per_client = 16, 50
+    errors = []
+
+    def client(n: int) -> int:
+        connection = http.client.HTTPConnection("127.0.0.1", server.port, timeout=10)
+        done = 0
+        try:
+            for i in range(per_client):
+                if _get(server.port, paths[(n + i) % len(paths)], connection) == 200:
+                    done += 1
+        except Exception as error:  # noqa: BLE001
+            errors.append(error)
+        finally:
+            connection.close()
+        return done
+
+    with ThreadPoolExecutor(clients) as pool:
+        done = sum(pool.map(client, range(clients)))
+    assert not errors
+    assert done == clients * per_client
+    assert threading.active_count() < 100
@@ -0,0 +1,94 @@
+import threading
+
+from computer_use_demo.jobs import JobRequest
+from computer_use_demo.orchestrator import TIMED_OUT, Orchestrator
+
+
+def _runner(delay: float = 0.1):
+    """Answers each prompt after `delay`, reporting the size of its history."""
+    running = 0
+    lock = threading.Lock()
+
+    def run(job, tools, cancel_event):
+        nonlocal running
+        with lock:
+            running += 1
+            run.peak = max(run.peak, running)
+        try:
+            prompt = job.request.prompt
+            if prompt == "fail":
+                raise RuntimeError("site is down")
+            if cancel_event.wait(float(prompt[5:]) if prompt.startswith("wait ") else delay):
+                return
+            run.history_sizes.append(len(job.messages))
+            job.max_input_tokens = 100 * len(job.messages)
+            job.messages.append(
+                {"role": "assistant", "content": [{"type": "text", "text": prompt.upper()}]}
+            )
+            yield None
+        finally:
+            with lock:
+                running -= 1
+
+    run.peak = 0
+    run.history_sizes = []
+    return run
+
+
+def test_subtasks_run_concurrently_with_short_histories(make_queue):
+    runner = _runner(delay=0.2)
+    orchestrator = Orchestrator(make_queue(runner=runner, workers=8))
+    sites = [f"price at site {i}" for i in range(5)]
+    outcome = orchestrator.run(sites)
+    assert outcome.ok
+    # side by side, not 5 x 0.2s
+    assert outcome.seconds < 0.6
+    assert [result.text for result in outcome.results] == [site.upper() for site in sites]
+    # every subtask started from its own prompt only
+    assert runner.history_sizes == [1] * 5
+    assert outcome.max_input_tokens == 100
+    assert outcome.merged().startswith("## Subtask 1: price at site 0\n\nPRICE AT SITE 0")
+
+
+def test_concurrency_is_capped(make_queue):
+    runner = _runner(delay=0.05)
+    orchestrator = Orchestrator(make_queue(runner=runner, workers=8), concurrency=2)
+    finished = []
+    outcome = orchestrator.run([f"task {i}" for i in range(6)], on_result=finished.append)
+    assert outcome.ok
+    assert runner.peak == 2
+    assert sorted(result.index for result in finished) == list(range(6))
+
+
+def test_timeouts_and_failures_are_reported(make_queue):
+    queue = make_queue(runner=_runner(delay=0.01), workers=8)
+    orchestrator = Orchestrator(queue, timeout=0.3)
+    outcome = orchestrator.run(["quick", "wait 10", "fail"])
+    quick, slow, failed = outcome.results
+    assert quick.ok
+    assert slow.status == TIMED_OUT
+    assert 0.3 <= slow.seconds < 2
+    assert queue.get(slow.job_id).status == "cancelled"
+    assert failed.status == "failed" and "site is down" in failed.error
+    assert not outcome.ok
+    merged = outcome.merged()
+    assert "QUICK" in merged and "(timed out after" in merged and "site is down" in merged
+
+
+def test_subtasks_take_the_template_settings(make_queue):
+    queue = make_queue(runner=_runner(delay=0.0), workers=8)
+    outcome = Orchestrator(queue).run(
+        ["a", JobRequest(prompt="b", screen=2)], template=JobRequest(prompt="", model="m", screen=1)
+    )
+    first, second = (queue.get(result.job_id).request for result in outcome.results)
+    assert (first.prompt, first.model, first.screen) == ("a", "m", 1)
+    assert (second.prompt, second.model, second.screen) == ("b", None, 2)
+
+
+def test_the_timeout_counts_from_when_a_subtask_starts_running(make_queue):
+    queue = make_queue(runner=_runner(), workers=1)
+    orchestrator = Orchestrator(queue, concurrency=2, timeout=0.4)
+    # the second waits 0.25s for the only worker, then runs for 0.25s
+    outcome = orchestrator.run(["wait 0.25", "wait 0.25"])
+    assert [result.status for result in outcome.results] == ["succeeded", "succeeded"]
+    assert outcome.results[1].seconds >= 0.45
@@ -0,0 +1,180 @@
+import json
+import time
+from io import BytesIO
+
+import pytest
+from anthropic._utils import maybe_transform
+from anthropic.types.beta import BetaTextBlock, BetaToolUseBlock, message_create_params
+from PIL import Image
+
+from computer_use_demo import payload_cache
+from computer_use_demo.blobs import BlobStore, materialize
+from computer_use_demo.payload_cache import (
+    MessageEncoder,
+    encode_message,
+    splice,
+)
+from computer_use_demo.scheduler import estimate_input_tokens
+
+
+def _png(seed: int) -> bytes:
+    buffer = BytesIO()
+    Image.effect_noise((128, 80), 64 + seed).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _history(turns: int, store: BlobStore | None = None, images: int = 0) -> list:
+    """A session's history: pydantic assistant blocks and dict tool results."""
+    messages = [{"role": "user", "content": "Open the spreadsheet and fill in the totals."}]
+    for i in range(turns):
+        messages.append(
+            {
+                "role": "assistant",
+                "content": [
+                    BetaTextBlock(type="text", text=f"Step {i}: clicking on the next cell. " * 4),
+                    BetaToolUseBlock(
+                        type="tool_use",
+                        id=f"toolu_{i}",
+                        name="computer",
+                        input={"action": "left_click", "coordinate": [i, 2 * i]},
+                    ),
+                ],
+            }
+        )
+        content = [{"type": "text", "text": f"clicked ({i}, {2 * i})\n" * 10}]
+        if store is not None and i >= turns - images:
+            content.append(
+                {
+                    "type": "image",
+                    "source": {"type": "base64", "media_type": "image/png", "data": store.put(_png(i))},
+                }
+            )
+        messages.append(
+            {
+                "role": "user",
+                "content": [{"type": "tool_result", "tool_use_id": f"toolu_{i}", "content": content}],
+            }
+        )
+    return messages
+
+
+def _sdk_json(messages: list) -> list:
+    """The `messages` JSON the SDK itself would send."""
+    return maybe_transform(
+        {"messages": messages}, message_create_params.MessageCreateParams
+    )["messages"]
+
+
+def test_encoding_matches_sdk_serialization():
+    messages = _history(3)
+    for message in messages:
+        assert json.loads(b"".join(encode_message(message))) == _sdk_json([message])[0]
+
+
+def test_body_materializes_images():
+    store = BlobStore()
+    messages = _history(2, store, images=1)
+    ref = messages[-1]["content"][0]["content"][1]["source"]["data"]
+    body = json.loads(MessageEncoder().encode(messages).body())
+    assert body[-1]["content"][0]["content"][1]["source"]["data"] == ref.base64()
+    assert body[:-1] == _sdk_json(messages[:-1])
+
+
+def test_only_new_and_edited_messages_are_encoded():
+    encoder = MessageEncoder()
+    messages = _history(5)
+    encoder.encode(messages)
+    assert encoder.stats.misses == 11
+
+    messages.append({"role": "assistant", "content": [{"type": "text", "text": "done"}]})
+    encoder.encode(messages)
+    assert (encoder.stats.hits, encoder.stats.misses) == (11, 12)
+
+    # pruning and compaction replace content lists rather than mutating blocks
+    messages[2]["content"][0]["content"] = [{"type": "text", "text": "stub"}]
+    encoded = encoder.encode(messages)
+    assert (encoder.stats.hits, encoder.stats.misses) == (22, 13)
+    assert json.loads(encoded.body())[2]["content"][0]["content"][0]["text"] == "stub"
+
+    del messages[1:5]
+    encoder.encode(messages)
+    assert len(encoder._cache) == len(messages)
+
+
+@pytest.mark.parametrize("separators", [(",", ":"), (", ", ": ")])
+def test_splice_replaces_marker(separators):
+    # httpx 0.28 writes compact JSON, older versions put spaces after separators
+    messages = _history(1)
+    encoded = MessageEncoder().encode(messages)
+    body = json.dumps({"model": "m", "messages": list(encoded), "max_tokens": 1}, separators=separators)
+    spliced = json.loads(splice(body.encode()))
+    assert spliced["messages"] == _sdk_json(messages)
+    assert spliced["max_tokens"] == 1
+    assert splice(b'{"messages":[]}') is None
+
+
+def test_a_marker_that_cannot_be_spliced_is_not_sent():
+    encoded = MessageEncoder().encode(_history(1))
+    body = json.dumps({"messages": list(encoded)}, indent=2).encode()
+    with pytest.raises(RuntimeError):
+        splice(body.replace(encoded.token.encode(), b"not-a-token"))
+
+
+def test_estimates_see_the_original_messages():
+    messages = _history(3)
+    encoded = MessageEncoder().encode(messages)
+    assert estimate_input_tokens({"messages": encoded}) == estimate_input_tokens(
+        {"messages": messages}
+    )
+
+
+def test_estimates_are_cached_per_message(monkeypatch):
+    estimated = []
+    monkeypatch.setattr(
+        payload_cache, "message_tokens", lambda message: estimated.append(message) or 7
+    )
+    messages = _history(3)
+    encoder = MessageEncoder()
+    encoder.encode(messages)
+    assert len(estimated) == len(messages)
+
+    estimated.clear()
+    messages[1] = {**messages[1], "content": "edited"}
+    encoded = encoder.encode(messages)
+    assert estimated == [messages[1]]
+    assert estimate_input_tokens({"messages": encoded}) == 7 * len(messages) + 1
+
+
+def test_splice_fails_loudly_once_messages_are_gone():
+    encoded = MessageEncoder().encode(_history(1))
+    body = json.dumps({"messages": list(encoded)}, separators=(",", ":")).encode()
+    del encoded
+    with pytest.raises(RuntimeError):
+        splice(body)
+
+
+@pytest.mark.benchmark
+def test_benchmark_per_turn_cpu_on_200_messages():
+    """Client CPU to serialize `messages` per turn, SDK path vs cached fragments."""
+    store = BlobStore()
+    messages = _history(100, store, images=3)[:200]
+    turns = 5
+
+    def sdk_turn():
+        sent = _sdk_json(materialize(messages))
+        json.dumps(sent, ensure_ascii=False, separators=(",", ":")).encode()
+
+    encoder = MessageEncoder()
+    encoder.encode(messages).body()  # the first turn encodes everything
+
+    def cached_turn():
+        encoder.encode(messages).body()
+
+    def cpu(turn) -> float:
+        start = time.process_time()
+        for _ in range(turns):
+            turn()
+        return (time.process_time() - start) / turns
+
+    sdk, cached = cpu(sdk_turn), cpu(cached_turn)
+    assert cached * 5 < sdk
@@ -0,0 +1,92 @@
+import uuid
+from unittest import mock
+
+from anthropic.types import TextBlock
+
+from computer_use_demo.autopc.actor.anthropic_actor import AnthropicActor
+from computer_use_demo.autopc.actor.prompt_cache import (
+    EPHEMERAL,
+    PromptCacheRequestBuilder,
+)
+from tests.stub_api import StubAPIServer, StubResponse, message_body
+
+TOOLS = [{"name": "bash", "type": "bash_20241022"}, {"name": "str_replace_editor"}]
+
+
+def _conversation(turns: int):
+    messages = [{"role": "user", "content": [TextBlock(type="text", text="start")]}]
+    for i in range(turns):
+        messages.append({"role": "assistant", "content": [{"type": "text", "text": f"a{i}"}]})
+        messages.append(
+            {
+                "role": "user",
+                "content": [{"type": "tool_result", "tool_use_id": str(i), "content": []}],
+            }
+        )
+    return messages
+
+
+def test_breakpoints_on_copies_only():
+    builder = PromptCacheRequestBuilder()
+    messages = _conversation(3)
+    request = builder.build(system="sys", tools=TOOLS, messages=messages)
+
+    assert request["system"] == [{"type": "text", "text": "sys", "cache_control": EPHEMERAL}]
+    assert request["tools"][-1]["cache_control"] == EPHEMERAL
+    assert "cache_control" not in TOOLS[-1]
+
+    marked = [
+        i
+        for i, message in enumerate(request["messages"])
+        if "cache_control" in message["content"][-1]
+    ]
+    assert marked == [4, 6]
+    assert all("cache_control" not in m["content"][-1] for m in messages[1:])
+
+
+def test_breakpoints_move_forward():
+    builder = PromptCacheRequestBuilder()
+    messages = _conversation(1)
+    first = builder.build(system="s", tools=TOOLS, messages=messages)["messages"]
+    # pydantic blocks are converted to dicts when marked
+    assert first[0]["content"][-1] == {"type": "text", "text": "start", "cache_control": EPHEMERAL}
+
+    messages += _conversation(2)[3:]
+    second = builder.build(system="s", tools=TOOLS, messages=messages)["messages"]
+    assert "cache_control" in second[2]["content"][-1]
+    assert "cache_control" in second[4]["content"][-1]
+    assert second[0] is messages[0]
+
+
+def test_pruning_counts_prefix_resets():
+    prune = mock.Mock(side_effect=[0, 10])
+    builder = PromptCacheRequestBuilder(images_to_keep=2, prune_images=prune)
+    builder.build(system="s", tools=TOOLS, messages=_conversation(1))
+    builder.build(system="s", tools=TOOLS, messages=_conversation(1))
+    assert builder.stats.prefix_resets == 1
+
+
+def test_actor_sends_breakpoints_and_records_usage(monkeypatch):
+    usage = {
+        "input_tokens": 5,
+        "output_tokens": 1,
+        "cache_read_input_tokens": 900,
+        "cache_creation_input_tokens": 100,
+    }
+    with StubAPIServer(StubResponse(body=message_body(usage=usage))) as stub:
+        monkeypatch.setenv("ANTHROPIC_BASE_URL", stub.base_url)
+        actor = AnthropicActor(
+            model="stub-model",
+            provider="anthropic",
+            system_prompt_suffix="",
+            api_key=f"test-{uuid.uuid4()}",
+            api_response_callback=mock.Mock(),
+        )
+        actor(messages=[{"role": "user", "content": "hello"}])
+
+        body = stub.requests[0]
+        assert body["system"][0]["cache_control"] == EPHEMERAL
+        assert body["tools"][-1]["cache_control"] == EPHEMERAL
+        assert body["messages"][0]["content"][0]["cache_control"] == EPHEMERAL
+        assert actor.cache_stats.cache_read_input_tokens == 900
+        assert actor.cache_stats.hit_ratio == 900 / 1005
@@ -0,0 +1,128 @@
+import gc
+
+from anthropic.types import TextBlock
+from anthropic.types.beta import BetaTextBlock, BetaToolUseBlock
+
+from computer_use_demo.blobs import BlobStore
+from computer_use_demo.render import MEDIA_PATH, ChatRenderer, render_message
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 100_000
+
+
+def _turn(n: int, store: BlobStore) -> list:
+    return [
+        {
+            "role": "assistant",
+            "content": [
+                BetaToolUseBlock(
+                    type="tool_use", id=f"toolu_{n}", name="computer", input={"action": "screenshot"}
+                )
+            ],
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": f"toolu_{n}",
+                    "content": [
+                        {
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": "image/png",
+                                "data": store.put(PNG + n.to_bytes(4, "big")),
+                            },
+                        }
+                    ],
+                }
+            ],
+        },
+    ]
+
+
+def _size(rows) -> int:
+    return sum(len(cell) for row in rows for cell in row if cell)
+
+
+def test_render_message_rows():
+    assert render_message({"role": "user", "content": [TextBlock(type="text", text="hi")]}) == ["hi", None]
+    assert render_message({"role": "assistant", "content": [BetaTextBlock(type="text", text="ok")]}) == [None, "ok"]
+    assert render_message({"role": "user", "content": "go"}) == ["go", None]
+    tool_use = render_message(_turn(1, BlobStore())[0])
+    assert tool_use[1].startswith("Tool Use: computer")
+    text_result = {
+        "role": "user",
+        "content": [{"type": "tool_result", "tool_use_id": "t", "content": [{"type": "text", "text": "out"}]}],
+    }
+    assert render_message(text_result) == [None, "out"]
+    assert render_message({"role": "user", "content": []}) is None
+
+
+def test_images_are_referenced_by_url():
+    store = BlobStore()
+    message = _turn(1, store)[1]
+    ref = message["content"][0]["content"][0]["source"]["data"]
+    row = render_message(message)
+    assert row == [None, f'<img src="{MEDIA_PATH}/{ref.key}">']
+
+
+def test_updates_carry_only_new_rows_of_constant_size():
+    store = BlobStore()
+    renderer = ChatRenderer()
+    messages = [{"role": "user", "content": "take screenshots"}]
+    assert renderer.update(messages) == [["take screenshots", None]]
+
+    sizes = []
+    for n in range(200):
+        messages.extend(_turn(n, store))
+        new = renderer.update(messages)
+        assert len(new) == 2
+        sizes.append(_size(new))
+    assert renderer.update(messages) == []
+    assert len(renderer.rows) == 401
+    # an update is the same size at step 200 as at step 1, and far below a screenshot
+    assert max(sizes) - min(sizes) < 10
+    assert max(sizes) < 200
+
+
+def test_rewritten_history_is_rendered_again():
+    store = BlobStore()
+    renderer = ChatRenderer()
+    messages = [{"role": "user", "content": "go"}, *_turn(1, store), *_turn(2, store)]
+    renderer.update(messages)
+    del messages[1:]
+    messages.append({"role": "assistant", "content": [BetaTextBlock(type="text", text="done")]})
+    assert renderer.update(messages) == [["go", None], [None, "done"]]
+    assert renderer.rows == [["go", None], [None, "done"]]
+
+
+def test_rendered_images_stay_available():
+    store = BlobStore()
+    renderer = ChatRenderer()
+    messages = _turn(1, store)
+    renderer.update(messages)
+    key = messages[1]["content"][0]["content"][0]["source"]["data"].key
+    # the history drops the screenshot, but the chat still shows it
+    messages[1]["content"][0]["content"] = []
+    gc.collect()
+    assert store.get(key).startswith(PNG)
+
+
+def test_only_the_latest_rendered_images_are_kept():
+    store = BlobStore()
+    renderer = ChatRenderer(max_images=2)
+    messages = [message for n in range(5) for message in _turn(n, store)]
+    renderer.update(messages)
+    keys = [m["content"][0]["content"][0]["source"]["data"].key for m in messages[1::2]]
+    for message in messages[1::2]:
+        message["content"][0]["content"] = []
+    gc.collect()
+
+    def kept(key):
+        try:
+            return store.get(key).startswith(PNG)
+        except KeyError:
+            return False
+
+    assert [kept(key) for key in keys] == [False, False, False, True, True]
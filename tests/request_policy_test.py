@@ -0,0 +1,168 @@
+import time
+
+import anthropic
+import pytest
+
+from computer_use_demo.request_policy import (
+    LatencyTracker,
+    RequestPolicy,
+    RequestTarget,
+    RetryPolicy,
+)
+from tests.stub_api import StubAPIServer, StubResponse, message_body, message_events
+
+OVERLOADED = StubResponse(
+    status=529,
+    body={"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}},
+)
+FAST_RETRY = RetryPolicy(base_delay=0.01, max_delay=0.05, attempt_timeout=5.0)
+
+
+def _target(stub, model="primary-model"):
+    return RequestTarget("anthropic", model, api_key="test-key", base_url=stub.base_url)
+
+
+async def _create(policy):
+    raw = await policy.create(
+        max_tokens=10, messages=[{"role": "user", "content": "hi"}], betas=[]
+    )
+    return raw.parse()
+
+
+async def test_retries_overloaded_with_backoff():
+    with StubAPIServer() as stub:
+        stub.script = [OVERLOADED, OVERLOADED]
+        policy = RequestPolicy(_target(stub), retry=FAST_RETRY)
+        response = await _create(policy)
+
+    assert response.content[0].text == "ok"
+    assert len(stub.requests) == 3
+    assert stub.requests[-1]["model"] == "primary-model"
+    metrics = policy.metrics.as_dict()
+    assert metrics["retries"] == 2
+    assert metrics["errors"] == {"529": 2}
+    assert metrics["latency"]["anthropic"]["p50"] is not None
+
+
+async def test_gives_up_on_non_retryable_errors():
+    bad_request = StubResponse(
+        status=400,
+        body={"type": "error", "error": {"type": "invalid_request_error", "message": "no"}},
+    )
+    with StubAPIServer(bad_request) as stub:
+        policy = RequestPolicy(_target(stub), retry=FAST_RETRY)
+        with pytest.raises(anthropic.BadRequestError):
+            await _create(policy)
+    assert len(stub.requests) == 1
+    assert policy.metrics.failures == 1
+
+
+async def test_attempt_deadline():
+    with StubAPIServer() as stub:
+        stub.script = [StubResponse(body=message_body(), delay=2.0)]
+        retry = RetryPolicy(base_delay=0.01, attempt_timeout=0.3)
+        policy = RequestPolicy(_target(stub), retry=retry)
+        start = time.monotonic()
+        await _create(policy)
+        elapsed = time.monotonic() - start
+
+    assert elapsed < 1.5
+    assert policy.metrics.timeouts == 1
+    assert policy.metrics.errors == {"TimeoutError": 1}
+
+
+async def test_retries_fail_over_to_the_fallback():
+    with StubAPIServer(OVERLOADED) as primary, StubAPIServer() as fallback:
+        policy = RequestPolicy(
+            _target(primary), fallback=_target(fallback, "fallback-model"), retry=FAST_RETRY
+        )
+        await _create(policy)
+    assert len(primary.requests) == 1
+    assert fallback.requests[0]["model"] == "fallback-model"
+
+
+async def test_hedges_slow_primary_and_cancels_it():
+    with StubAPIServer() as primary, StubAPIServer() as fallback:
+        primary.default = StubResponse(body=message_body(content=[{"type": "text", "text": "primary"}]), delay=2.0)
+        fallback.default = StubResponse(body=message_body(content=[{"type": "text", "text": "fallback"}]))
+        policy = RequestPolicy(
+            _target(primary),
+            fallback=_target(fallback, "fallback-model"),
+            retry=FAST_RETRY,
+            hedge=True,
+            initial_hedge_delay=0.2,
+        )
+        start = time.monotonic()
+        response = await _create(policy)
+        elapsed = time.monotonic() - start
+
+    assert response.content[0].text == "fallback"
+    assert elapsed < 1.0
+    assert policy.metrics.hedges == policy.metrics.hedge_wins == 1
+    assert "anthropic" in policy.metrics.latency
+
+
+async def test_fast_primary_is_not_hedged():
+    with StubAPIServer() as primary, StubAPIServer() as fallback:
+        policy = RequestPolicy(
+            _target(primary), fallback=_target(fallback), hedge=True, initial_hedge_delay=1.0
+        )
+        await _create(policy)
+    assert policy.metrics.hedges == 0
+    assert fallback.requests == []
+
+
+async def test_streams_are_retried_until_they_start():
+    with StubAPIServer(StubResponse(events=message_events(message_body()))) as stub:
+        stub.script = [OVERLOADED]
+        policy = RequestPolicy(_target(stub), retry=FAST_RETRY)
+        events = []
+        raw = await policy.stream(
+            on_event=events.append, max_tokens=10, messages=[{"role": "user", "content": "hi"}], betas=[]
+        )
+
+    assert raw.parse().content[0].text == "ok"
+    assert raw.headers["content-type"] == "text/event-stream"
+    assert len(stub.requests) == 2
+    assert policy.metrics.retries == 1
+    assert [event.type for event in events][:2] == ["message_start", "content_block_start"]
+
+
+async def test_streams_that_started_are_not_retried():
+    # the second event comes after the attempt's deadline
+    slow = StubResponse(events=message_events(message_body()), event_delay=0.3)
+    with StubAPIServer(slow) as stub:
+        retry = RetryPolicy(base_delay=0.01, attempt_timeout=0.45)
+        policy = RequestPolicy(_target(stub), retry=retry)
+        events = []
+        with pytest.raises(TimeoutError):
+            await policy.stream(
+                on_event=events.append, max_tokens=10, messages=[{"role": "user", "content": "hi"}]
+            )
+
+    assert len(stub.requests) == 1
+    assert [event.type for event in events] == ["message_start"]
+
+
+def test_hedge_delay_follows_p95():
+    policy = RequestPolicy(
+        RequestTarget("anthropic", "m"),
+        fallback=RequestTarget("bedrock", "m"),
+        hedge=True,
+        initial_hedge_delay=7.0,
+        min_hedge_delay=0.1,
+    )
+    assert policy.hedge_delay() == 7.0
+    tracker = policy.metrics.latency["anthropic"]
+    for latency in [1.0] * 18 + [3.0, 9.0]:
+        tracker.record(latency)
+    assert policy.hedge_delay() == 9.0 == tracker.percentile(0.95)
+    assert LatencyTracker().percentile(0.5) is None
+
+
+def test_backoff_is_jittered_and_capped():
+    retry = RetryPolicy(base_delay=1.0, max_delay=4.0)
+    delays = [retry.backoff(5) for _ in range(100)]
+    assert all(0 <= d <= 4.0 for d in delays)
+    assert len(set(delays)) > 1
+    assert retry.backoff(1, retry_after=3.0) == 3.0
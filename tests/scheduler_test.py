@@ -0,0 +1,144 @@
+import asyncio
+import time
+
+from computer_use_demo.request_policy import RequestPolicy, RequestTarget, RetryPolicy
+from computer_use_demo.scheduler import (
+    Priority,
+    RateLimits,
+    RequestScheduler,
+    TokenBucket,
+    estimate_input_tokens,
+    get_scheduler,
+)
+from tests.stub_api import RateLimiter, StubAPIServer
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills_and_carries_debt():
+    clock = FakeClock()
+    bucket = TokenBucket(60, period=60.0, clock=clock)
+    bucket.consume(60)
+    assert bucket.time_until(1) == 1.0
+    clock.now = 30
+    assert bucket.level == 30
+    bucket.refund(-40)  # cost more than estimated
+    assert bucket.time_until(1) == 11.0
+    clock.now = 1000
+    assert bucket.level == 60
+    # larger than the bucket: admitted once it is full
+    assert bucket.time_until(500) == 0
+
+
+async def test_interactive_before_batch():
+    scheduler = RequestScheduler(RateLimits(requests=1, period=0.1, utilization=1.0))
+    await scheduler.acquire("warmup")
+    order = []
+
+    async def request(session, priority):
+        await scheduler.acquire(session, priority)
+        order.append(session)
+
+    batch = asyncio.ensure_future(request("batch", Priority.BATCH))
+    await asyncio.sleep(0)
+    interactive = asyncio.ensure_future(request("interactive", Priority.INTERACTIVE))
+    await asyncio.gather(batch, interactive)
+    assert order == ["interactive", "batch"]
+
+
+async def test_sessions_are_served_round_robin():
+    scheduler = RequestScheduler(RateLimits(requests=1, period=0.02, utilization=1.0))
+    await scheduler.acquire("warmup")
+    order = []
+
+    async def request(session):
+        await scheduler.acquire(session)
+        order.append(session)
+
+    flood = [asyncio.ensure_future(request("flood")) for _ in range(6)]
+    await asyncio.sleep(0)
+    other = [asyncio.ensure_future(request("other")) for _ in range(2)]
+    await asyncio.gather(*flood, *other)
+    assert order[:4] == ["flood", "other", "flood", "other"]
+    assert scheduler.metrics.queued == 8
+
+
+async def test_settle_refunds_unused_output_tokens():
+    scheduler = RequestScheduler(RateLimits(output_tokens=1000, utilization=1.0))
+    reservation = await scheduler.acquire(output_tokens=800)
+    assert round(scheduler._buckets["output_tokens"].level) == 200
+
+    class Usage:
+        input_tokens = 10
+        output_tokens = 50
+
+    scheduler.settle(reservation, Usage())
+    assert round(scheduler._buckets["output_tokens"].level) == 950
+
+
+async def test_throttle_pauses_admissions():
+    scheduler = RequestScheduler(RateLimits(requests=100))
+    scheduler.throttled(retry_after=0.3)
+    start = time.monotonic()
+    await scheduler.acquire()
+    assert time.monotonic() - start >= 0.29
+
+
+def test_limits_adopted_from_headers():
+    scheduler = RequestScheduler(RateLimits())
+    assert scheduler._buckets == {}
+    scheduler.observe(
+        {
+            "anthropic-ratelimit-requests-limit": "50",
+            "anthropic-ratelimit-requests-remaining": "3",
+        }
+    )
+    assert scheduler.limits.requests == 50
+    assert round(scheduler._buckets["requests"].level) == 3
+
+    configured = RequestScheduler(RateLimits(requests=10))
+    configured.observe({"anthropic-ratelimit-requests-limit": "50"})
+    assert configured.limits.requests == 10
+
+
+def test_estimate_input_tokens():
+    request = {
+        "system": "x" * 400,
+        "messages": [{"role": "user", "content": "y" * 40}],
+    }
+    assert estimate_input_tokens(request) == 100 + 1 + 10 + 4
+
+
+async def test_stays_within_server_limits():
+    limiter = RateLimiter(requests=10, period=1.0)
+    with StubAPIServer() as stub:
+        stub.handler = limiter
+        get_scheduler("anthropic", "key", base_url=stub.base_url).configure(
+            RateLimits(requests=10, period=1.0)
+        )
+
+        async def session(name, count):
+            policy = RequestPolicy(
+                RequestTarget("anthropic", "m", api_key="key", base_url=stub.base_url),
+                retry=RetryPolicy(max_attempts=1),
+                session=name,
+            )
+            for _ in range(count):
+                await policy.create(
+                    max_tokens=5, messages=[{"role": "user", "content": "hi"}], betas=[]
+                )
+
+        start = time.monotonic()
+        await asyncio.gather(*(session(f"s{i}", 10) for i in range(3)))
+        elapsed = time.monotonic() - start
+
+    assert limiter.throttled == 0
+    assert len(stub.requests) == 30
+    # a burst of ~9.5, then ~9.5 per second
+    assert 1.8 < elapsed < 3.5
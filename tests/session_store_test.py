@@ -0,0 +1,142 @@
+import multiprocessing
+import time
+
+import pytest
+
+from computer_use_demo.auth.auth_manager import AuthManager
+from computer_use_demo.auth.session_store import (
+    MemorySessionStore,
+    SQLiteSessionStore,
+    session_store_from_env,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    stores = []
+
+    def make(**kwargs):
+        if request.param == "memory":
+            store = MemorySessionStore(**kwargs)
+        else:
+            store = SQLiteSessionStore(str(tmp_path / "sessions.db"), **kwargs)
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        store.close()
+
+
+def test_sessions_expire(make_store):
+    store = make_store(ttl=100, sliding=False)
+    store.create("t", "alice", now=1000)
+    assert store.get("t", now=1050).user == "alice"
+    assert store.get("t", now=1100) is None
+    assert store.get("unknown", now=1000) is None
+    store.delete("t")
+    assert len(store) == 0
+
+
+def test_use_extends_the_lifetime(make_store):
+    store = make_store(ttl=100, touch_interval=10)
+    store.create("t", "alice", now=1000)
+    # too soon after the last extension to write again
+    assert store.get("t", now=1005).expires == 1100
+    assert store.get("t", now=1080).expires == 1180
+    assert store.get("t", now=1181) is None
+
+
+def test_purge_drops_only_expired_sessions(make_store):
+    store = make_store(ttl=100, touch_interval=1)
+    for i in range(10):
+        store.create(f"t{i}", "alice", now=1000 + i * 10)
+    store.get("t0", now=1050)  # now good until 1150
+    store.delete("t1")
+    assert store.purge_expired(now=1145) == 3  # t2 to t4
+    assert len(store) == 6
+    assert store.get("t0", now=1145) is not None
+    assert store.get("t6", now=1145) is not None
+
+
+def test_memory_store_purges_on_create():
+    store = MemorySessionStore(ttl=10)
+    for i in range(1000):
+        store.create(f"t{i}", "alice", now=i)
+    assert len(store) == 10
+
+
+def test_sqlite_store_is_shared_and_keeps_no_raw_tokens(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    first, second = SQLiteSessionStore(path), SQLiteSessionStore(path)
+    try:
+        first.create("secret-token", "alice")
+        assert second.get("secret-token").user == "alice"
+        second.delete("secret-token")
+        assert first.get("secret-token") is None
+    finally:
+        first.close()
+        second.close()
+    assert b"secret-token" not in (tmp_path / "sessions.db").read_bytes()
+
+
+def test_auth_manager_uses_the_store(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    try:
+        token = AuthManager(store=store).login("test", "test123")
+        # another worker, with its own AuthManager, accepts the token
+        other = AuthManager(store=store)
+        assert other.verify_token(token)
+        assert not other.verify_token(None)
+        other.logout(token)
+        assert not AuthManager(store=store).verify_token(token)
+    finally:
+        store.close()
+
+
+def test_store_from_env(monkeypatch, tmp_path):
+    assert isinstance(session_store_from_env(), MemorySessionStore)
+    monkeypatch.setenv("SESSION_STORE", f"sqlite://{tmp_path}/sessions.db")
+    monkeypatch.setenv("SESSION_TTL", "60")
+    store = session_store_from_env()
+    assert isinstance(store, SQLiteSessionStore) and store.ttl == 60
+    store.close()
+
+
+def _verify_for(path: str, tokens: list[str], seconds: float, results):
+    store = SQLiteSessionStore(path)
+    verified = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for token in tokens:
+            assert store.get(token) is not None
+        verified += len(tokens)
+    store.close()
+    results.put(verified)
+
+
+@pytest.mark.benchmark
+def test_benchmark_verifications_across_processes(tmp_path):
+    """Token verifications with 4 worker processes sharing one database."""
+    path = str(tmp_path / "sessions.db")
+    store = SQLiteSessionStore(path)
+    tokens = [f"token-{i}" for i in range(100)]
+    for token in tokens:
+        store.create(token, "alice")
+    for i in range(10_000):
+        store.create(f"other-{i}", "bob")
+    store.close()
+
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    workers = [
+        context.Process(target=_verify_for, args=(path, tokens, 1.0, results))
+        for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    verified = [results.get(timeout=60) for _ in workers]
+    for worker in workers:
+        worker.join()
+    assert all(count >= len(tokens) for count in verified)
+    assert all(worker.exitcode == 0 for worker in workers)
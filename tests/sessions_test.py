@@ -0,0 +1,211 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+import pytest
+from anthropic.types.beta import BetaToolUseBlock
+
+from computer_use_demo.autopc.executor.anthropic_executor import AnthropicExecutor
+from computer_use_demo.event_loop import BackgroundEventLoop
+from computer_use_demo.sessions import SessionBusyError, SessionManager
+from computer_use_demo.tools.registry import ToolRegistry
+
+
+def _steps(n: int, delay: float = 0.0, started: threading.Event | None = None):
+    def steps(cancel_event: threading.Event):
+        if started is not None:
+            started.set()
+        for i in range(n):
+            if cancel_event.wait(delay):
+                return
+            yield i
+
+    return steps
+
+
+async def _collect(manager, session, steps) -> list:
+    return [item async for item in manager.run(session, steps)]
+
+
+async def test_runs_yield_on_the_pool():
+    manager = SessionManager()
+    session = manager.open("a")
+    assert await _collect(manager, session, _steps(3)) == [0, 1, 2]
+    assert manager.stats.as_dict()["finished"] == 1
+    assert not session.running
+    assert manager.open("a") is session
+
+
+async def test_sessions_are_independent():
+    manager = SessionManager()
+    a, b = manager.open("a"), manager.open("b")
+    a.selected_screen = 1
+    assert b.selected_screen == 0
+
+
+async def test_switching_screens_reaches_the_session_tools():
+    manager = SessionManager()
+    session = manager.open("a")
+    tools = await manager.tools(session)
+    session.selected_screen = 1
+    assert await manager.tools(session) is tools
+    assert tools.selected_screen == tools.get("computer").selected_screen == 1
+    manager.close("a")
+
+
+async def test_errors_reach_the_handler():
+    manager = SessionManager()
+
+    def failing(cancel_event):
+        yield 1
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError, match="boom"):
+        await _collect(manager, manager.open("a"), failing)
+    assert manager.stats.failed == 1
+    # the slot was given back
+    assert await _collect(manager, manager.open("b"), _steps(1)) == [0]
+
+
+async def test_cancel_returns_immediately():
+    manager = SessionManager()
+    session = manager.open("a")
+    started = threading.Event()
+    received = []
+
+    async def consume():
+        async for item in manager.run(session, _steps(1000, delay=0.05, started=started)):
+            received.append(item)
+
+    task = asyncio.create_task(consume())
+    await asyncio.to_thread(started.wait)
+    await asyncio.sleep(0.12)
+    start = time.perf_counter()
+    session.cancel()
+    await task
+    assert time.perf_counter() - start < 0.05
+    assert 0 < len(received) < 10
+    assert manager.stats.cancelled == 1
+    # the next run waits for the cancelled loop to stop, then goes ahead
+    assert await _collect(manager, session, _steps(2)) == [0, 1]
+
+
+async def test_a_cancel_mid_step_reaches_the_loops_cleanup():
+    manager = SessionManager()
+    session = manager.open("a")
+    in_step = threading.Event()
+    cleaned_up = threading.Event()
+
+    def steps(cancel_event):
+        # like the sampling loop: a step, then a check for the cancel after yielding it
+        while True:
+            in_step.set()
+            time.sleep(0.1)  # a tool call
+            yield "row"
+            if cancel_event.is_set():
+                cleaned_up.set()  # where the loop answers the interrupted tool calls
+                return
+
+    task = asyncio.create_task(_collect(manager, session, steps))
+    await asyncio.to_thread(in_step.wait)
+    session.cancel()
+    await task
+    assert await asyncio.to_thread(cleaned_up.wait, 1)
+
+
+async def test_one_run_per_session():
+    manager = SessionManager()
+    session = manager.open("a")
+    run = manager.run(session, _steps(100, delay=0.01))
+    await run.__anext__()
+    with pytest.raises(SessionBusyError):
+        await _collect(manager, session, _steps(1))
+    await run.aclose()
+    assert session.cancel_event.is_set()
+
+
+async def test_concurrency_limits_overall_and_per_user():
+    manager = SessionManager(max_concurrent=3, max_per_user=2)
+    running = 0
+    peak = 0
+    peak_by_user: dict[str, int] = {}
+    by_user: dict[str, int] = {}
+    lock = threading.Lock()
+
+    def steps_for(user):
+        def steps(cancel_event):
+            nonlocal running, peak
+            with lock:
+                running += 1
+                by_user[user] = by_user.get(user, 0) + 1
+                peak = max(peak, running)
+                peak_by_user[user] = max(peak_by_user.get(user, 0), by_user[user])
+            time.sleep(0.05)
+            with lock:
+                running -= 1
+                by_user[user] -= 1
+            yield user
+
+        return steps
+
+    users = ["alice"] * 4 + ["bob"] * 2 + ["carol"] * 2
+    results = await asyncio.gather(
+        *(
+            _collect(manager, manager.open(f"s{i}", user), steps_for(user))
+            for i, user in enumerate(users)
+        )
+    )
+    assert sorted(item for items in results for item in items) == sorted(users)
+    assert peak == 3
+    assert max(peak_by_user.values()) == 2
+    assert manager.stats.wait_seconds > 0
+    assert manager.stats.running == 0
+
+
+async def test_many_sessions_do_not_starve_the_event_loop():
+    """While every slot is busy with blocking work, the event loop stays responsive."""
+    manager = SessionManager(max_concurrent=4, max_per_user=4)
+
+    def blocking(cancel_event):
+        time.sleep(0.2)
+        yield None
+
+    runs = asyncio.gather(
+        *(_collect(manager, manager.open(f"s{i}", f"u{i}"), blocking) for i in range(20))
+    )
+    start = time.perf_counter()
+    await asyncio.sleep(0.01)
+    assert time.perf_counter() - start < 0.1
+    assert manager.stats.queued == 16
+    await runs
+    assert manager.stats.finished == 20
+
+
+def test_executor_cancels_started_tool_calls():
+    cancelled = threading.Event()
+
+    class _SlowTool:
+        async def __call__(self, **kwargs):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        def to_params(self):
+            return {"name": "slow", "description": "slow", "input_schema": {"type": "object"}}
+
+    event_loop = BackgroundEventLoop()
+    try:
+        executor = AnthropicExecutor(
+            output_callback=mock.Mock(),
+            tool_output_callback=mock.Mock(),
+            tool_registry=ToolRegistry(factories={"slow": _SlowTool}),
+            event_loop=event_loop,
+        )
+        executor.dispatch(BetaToolUseBlock(type="tool_use", id="toolu_1", name="slow", input={}))
+        executor.cancel()
+        assert cancelled.wait(1)
+    finally:
+        event_loop.stop()
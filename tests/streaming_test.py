@@ -0,0 +1,151 @@
+import time
+import uuid
+from unittest import mock
+
+from computer_use_demo.autopc.actor.anthropic_actor import AnthropicActor
+from computer_use_demo.autopc.executor.anthropic_executor import AnthropicExecutor
+from computer_use_demo.event_loop import BackgroundEventLoop
+from computer_use_demo.tools.base import ToolResult
+from computer_use_demo.tools.registry import ToolRegistry
+from tests.stub_api import StubAPIServer, StubResponse, message_body, message_events
+
+BODY = message_body(
+    content=[
+        {"type": "text", "text": "Let me look."},
+        {"type": "tool_use", "id": "toolu_1", "name": "probe", "input": {"n": 1}},
+        {"type": "text", "text": "And then more narration."},
+    ],
+    stop_reason="tool_use",
+)
+
+
+class _ProbeTool:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, **kwargs):
+        self.calls.append((time.monotonic(), kwargs))
+        return ToolResult(output=f"probed {kwargs['n']}")
+
+    def to_params(self):
+        return {"name": "probe", "description": "probe", "input_schema": {"type": "object"}}
+
+
+def _run_turn(stub, stream, monkeypatch, event_loop):
+    monkeypatch.setenv("ANTHROPIC_BASE_URL", stub.base_url)
+    probe = _ProbeTool()
+    registry = ToolRegistry(factories={"probe": lambda: probe})
+    actor = AnthropicActor(
+        model="stub-model",
+        provider="anthropic",
+        system_prompt_suffix="",
+        api_key=f"test-{uuid.uuid4()}",
+        api_response_callback=mock.Mock(),
+        tool_registry=registry,
+        prompt_caching=False,
+        stream=stream,
+    )
+    executor = AnthropicExecutor(
+        output_callback=mock.Mock(),
+        tool_output_callback=mock.Mock(),
+        tool_registry=registry,
+        event_loop=event_loop,
+    )
+    texts = []
+    messages = [{"role": "user", "content": "go"}]
+    if stream:
+        response = actor(messages=messages, on_text=texts.append, on_tool_use=executor.dispatch)
+    else:
+        response = actor(messages=messages)
+    finished = time.monotonic()
+    *_, (_, tool_result_content) = executor(response, messages)
+    messages.append({"role": "user", "content": tool_result_content})
+    return messages, texts, probe, finished
+
+
+def test_streaming_matches_non_streaming_history(monkeypatch):
+    event_loop = BackgroundEventLoop()
+    try:
+        with StubAPIServer(StubResponse(body=BODY)) as stub:
+            plain, _, _, _ = _run_turn(stub, False, monkeypatch, event_loop)
+        with StubAPIServer(StubResponse(events=message_events(BODY))) as stub:
+            streamed, texts, _, _ = _run_turn(stub, True, monkeypatch, event_loop)
+    finally:
+        event_loop.stop()
+
+    def dump(messages):
+        return [
+            {**m, "content": [getattr(b, "model_dump", lambda: b)() for b in m["content"]]}
+            if isinstance(m["content"], list)
+            else m
+            for m in messages
+        ]
+
+    assert dump(streamed) == dump(plain)
+    assert texts == ["Let me look.", "And then more narration."]
+    assert streamed[-1]["content"][0]["content"][0]["text"] == "probed 1"
+
+
+def test_tool_use_dispatched_before_stream_ends(monkeypatch):
+    event_loop = BackgroundEventLoop()
+    try:
+        with StubAPIServer(
+            StubResponse(events=message_events(BODY), event_delay=0.1)
+        ) as stub:
+            _, _, probe, finished = _run_turn(stub, True, monkeypatch, event_loop)
+    finally:
+        event_loop.stop()
+
+    (started, kwargs), = probe.calls
+    assert kwargs == {"n": 1}
+    # four more events (0.1s apart) followed the tool_use block
+    assert finished - started > 0.25
+
+
+def test_streamed_responses_reach_the_callback_like_raw_ones(monkeypatch):
+    callback = mock.Mock()
+    with StubAPIServer(StubResponse(events=message_events(BODY))) as stub:
+        monkeypatch.setenv("ANTHROPIC_BASE_URL", stub.base_url)
+        actor = AnthropicActor(
+            model="stub-model",
+            provider="anthropic",
+            system_prompt_suffix="",
+            api_key=f"test-{uuid.uuid4()}",
+            api_response_callback=callback,
+            tool_registry=ToolRegistry(factories={"probe": _ProbeTool}),
+            prompt_caching=False,
+            stream=True,
+        )
+        response = actor(messages=[{"role": "user", "content": "go"}])
+
+    (raw,), _ = callback.call_args
+    assert raw.parse() is response
+    assert raw.headers["content-type"] == "text/event-stream"
+    assert raw.elapsed.total_seconds() >= 0
+
+
+def test_streams_are_retried_under_the_request_policy(monkeypatch):
+    overloaded = StubResponse(
+        status=529,
+        body={"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}},
+    )
+    with StubAPIServer(StubResponse(events=message_events(BODY))) as stub:
+        stub.script = [overloaded]
+        monkeypatch.setenv("ANTHROPIC_BASE_URL", stub.base_url)
+        actor = AnthropicActor(
+            model="stub-model",
+            provider="anthropic",
+            system_prompt_suffix="",
+            api_key=f"test-{uuid.uuid4()}",
+            api_response_callback=mock.Mock(),
+            tool_registry=ToolRegistry(factories={"probe": _ProbeTool}),
+            prompt_caching=False,
+            stream=True,
+        )
+        texts = []
+        response = actor(messages=[{"role": "user", "content": "go"}], on_text=texts.append)
+
+    assert len(stub.requests) == 2
+    assert actor.request_policy.metrics.retries == 1
+    assert texts == ["Let me look.", "And then more narration."]
+    assert response.stop_reason == "tool_use"
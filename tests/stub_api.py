@@ -0,0 +1,190 @@
+"""A local stand-in for the Messages API, for tests that need real HTTP traffic."""
+
+import json
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+
+def message_body(
+    content: list[dict[str, Any]] | None = None,
+    stop_reason: str = "end_turn",
+    usage: dict[str, int] | None = None,
+) -> dict[str, Any]:
+    return {
+        "id": "msg_stub",
+        "type": "message",
+        "role": "assistant",
+        "model": "stub-model",
+        "content": content if content is not None else [{"type": "text", "text": "ok"}],
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": usage or {"input_tokens": 10, "output_tokens": 5},
+    }
+
+
+def message_events(body: dict[str, Any]) -> list[tuple[str, dict[str, Any]]]:
+    """The server-sent events that stream `body` block by block."""
+    start = {**body, "content": [], "stop_reason": None}
+    events: list[tuple[str, dict[str, Any]]] = [
+        ("message_start", {"type": "message_start", "message": start})
+    ]
+    for index, block in enumerate(body["content"]):
+        if block["type"] == "text":
+            empty = {"type": "text", "text": ""}
+            delta = {"type": "text_delta", "text": block["text"]}
+        else:
+            empty = {**block, "input": {}}
+            delta = {"type": "input_json_delta", "partial_json": json.dumps(block["input"])}
+        events += [
+            ("content_block_start", {"type": "content_block_start", "index": index, "content_block": empty}),
+            ("content_block_delta", {"type": "content_block_delta", "index": index, "delta": delta}),
+            ("content_block_stop", {"type": "content_block_stop", "index": index}),
+        ]
+    events += [
+        (
+            "message_delta",
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": body["stop_reason"], "stop_sequence": None},
+                "usage": {"output_tokens": body["usage"]["output_tokens"]},
+            },
+        ),
+        ("message_stop", {"type": "message_stop"}),
+    ]
+    return events
+
+
+@dataclass
+class StubResponse:
+    status: int = 200
+    body: dict[str, Any] | None = None
+    delay: float = 0.0
+    headers: dict[str, str] = field(default_factory=dict)
+    # server-sent events as (event, data) pairs, each sent after `event_delay`
+    events: list[tuple[str, dict[str, Any]]] | None = None
+    event_delay: float = 0.0
+
+
+class RateLimiter:
+    """
+    A `StubAPIServer.handler` that enforces a request-rate token bucket like the real
+    API: 429 with `retry-after` when it is empty, rate-limit headers otherwise.
+    """
+
+    def __init__(self, requests: int, period: float = 60.0, response: StubResponse | None = None):
+        self.limit = requests
+        self.rate = requests / period
+        self.level = float(requests)
+        self.updated = time.monotonic()
+        self.response = response or StubResponse(body=message_body())
+        self.throttled = 0
+
+    def __call__(self, payload: dict[str, Any]) -> StubResponse:
+        now = time.monotonic()
+        self.level = min(self.limit, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.level < 1:
+            self.throttled += 1
+            return StubResponse(
+                status=429,
+                body={"type": "error", "error": {"type": "rate_limit_error", "message": "slow down"}},
+                headers={"retry-after": "1"},
+            )
+        self.level -= 1
+        headers = {
+            "anthropic-ratelimit-requests-limit": str(self.limit),
+            "anthropic-ratelimit-requests-remaining": str(int(self.level)),
+        }
+        return StubResponse(body=self.response.body, headers={**self.response.headers, **headers})
+
+
+class StubAPIServer:
+    """
+    Serves `POST /v1/messages` over keep-alive HTTP/1.1. Responses come from `script`
+    (consumed in order) and then from `default`; every request body is recorded.
+    """
+
+    def __init__(self, default: StubResponse | None = None):
+        self.default = default or StubResponse(body=message_body())
+        self.script: list[StubResponse] = []
+        self.handler: Callable[[dict[str, Any]], StubResponse] | None = None
+        self.requests: list[dict[str, Any]] = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("content-length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with server._lock:
+                    server.requests.append(payload)
+                    if server.handler is not None:
+                        response = server.handler(payload)
+                    elif server.script:
+                        response = server.script.pop(0)
+                    else:
+                        response = server.default
+                if response.delay:
+                    time.sleep(response.delay)
+                if response.events is not None:
+                    self._send_events(response)
+                    return
+                data = json.dumps(response.body or {}).encode()
+                self.send_response(response.status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                for name, value in response.headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def _send_events(self, response: StubResponse):
+                self.send_response(response.status)
+                self.send_header("content-type", "text/event-stream")
+                self.send_header("connection", "close")
+                self.end_headers()
+                try:
+                    for event, data in response.events or []:
+                        if response.event_delay:
+                            time.sleep(response.event_delay)
+                        chunk = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+                        self.wfile.write(chunk.encode())
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                self.close_connection = True
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "StubAPIServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
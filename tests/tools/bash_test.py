@@ -69,3 +69,19 @@ async def test_bash_tool_timeout(bash_tool):
         match="timed out: bash has not returned in 0.1 seconds and must be restarted",
     ):
         await bash_tool(command="sleep 1")
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_pid_and_close(bash_tool):
+    assert bash_tool.pid is None
+    await bash_tool(command="true")
+    process = bash_tool._session._process
+    assert bash_tool.pid == process.pid
+
+    bash_tool.close()
+    assert bash_tool.pid is None
+    bash_tool.close()  # closing again is harmless
+
+    result = await bash_tool(command="echo 'after close'")
+    assert "after close" in result.output
+    assert bash_tool.pid not in (None, process.pid)
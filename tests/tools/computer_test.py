@@ -137,3 +137,21 @@ async def test_computer_tool_missing_coordinate(computer_tool):
 async def test_computer_tool_missing_text(computer_tool):
     with pytest.raises(ToolError, match="text is required for type"):
         await computer_tool(action="type")
+
+
+@pytest.mark.asyncio
+async def test_typing_on_a_session_display_goes_through_xdotool():
+    computer_tool = ComputerTool(display=":101")
+    with (
+        patch("computer_use_demo.tools.computer.run", new_callable=AsyncMock) as mock_run,
+        patch("computer_use_demo.tools.computer.pyautogui") as mock_pyautogui,
+        patch.object(
+            computer_tool, "_handle_screenshot", new_callable=AsyncMock
+        ) as mock_screenshot,
+    ):
+        mock_run.return_value = (0, "", "")
+        mock_screenshot.return_value = ToolResult(base64_image="base64_screenshot")
+        result = await computer_tool._handle_type(text="it's")
+        mock_run.assert_called_once_with("DISPLAY=:101 xdotool type --delay 12 -- 'it'\"'\"'s'")
+        mock_pyautogui.write.assert_not_called()
+        assert result.base64_image == "base64_screenshot"
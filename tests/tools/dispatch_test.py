@@ -0,0 +1,206 @@
+import asyncio
+import time
+from unittest import mock
+
+import pytest
+from anthropic.types.beta import BetaMessage, BetaTextBlock, BetaToolUseBlock
+
+from computer_use_demo.autopc.executor.anthropic_executor import AnthropicExecutor
+from computer_use_demo.event_loop import BackgroundEventLoop
+from computer_use_demo.tools.base import BaseAnthropicTool, ToolResult
+from computer_use_demo.tools.bash import BashTool
+from computer_use_demo.tools.collection import ToolCollection
+from computer_use_demo.tools.computer import ComputerTool
+from computer_use_demo.tools.dispatch import ToolDispatcher, conflicts
+from computer_use_demo.tools.edit import EditTool
+from computer_use_demo.tools.registry import ToolRegistry
+
+
+class _SlowTool(BaseAnthropicTool):
+    """Sleeps, then reports when it ran; borrows the resources of a real tool."""
+
+    def __init__(self, name, like, log, delay=0.2):
+        self.name = name
+        self.like = like
+        self.log = log
+        self.delay = delay
+
+    def resources(self, **kwargs):
+        return self.like.resources(**kwargs)
+
+    async def __call__(self, **kwargs):
+        start = time.monotonic()
+        await asyncio.sleep(self.delay)
+        self.log.append((self.name, kwargs, start, time.monotonic()))
+        return ToolResult(output=f"{self.name} {kwargs}")
+
+    def to_params(self):
+        return {"name": self.name}
+
+
+def test_conflicts():
+    display = [("display", True)]
+    assert conflicts(display, display)
+    assert not conflicts(display, [("fs:/a", False)])
+    assert not conflicts([("fs:/a", False)], [("fs:/a", False)])
+    assert conflicts([("fs:/a", False)], [("fs:/a", True)])
+    assert conflicts([("fs:/a", False)], [("fs:/a/b.txt", True)])
+    assert not conflicts([("fs:/a", False)], [("fs:/ab", True)])
+    assert conflicts([("fs", True)], [("fs:/a", False)])
+    assert not conflicts([("fs", False)], [("fs:/a", False)])
+    assert not conflicts([("*", True)], [])
+    assert conflicts([("*", True)], [("display", False)])
+
+
+def test_tool_resources():
+    assert ComputerTool().resources(action="screenshot") == [("display", True)]
+    edit = EditTool()
+    assert edit.resources(command="view", path="/tmp/a/") == [("fs:/tmp/a", False)]
+    assert edit.resources(command="create", path="/tmp/a/b") == [("fs:/tmp/a/b", True)]
+    assert edit.resources(command="view", path="/") == [("fs:", False)]
+    assert ("shell", True) in BashTool().resources(command="ls")
+    # commands can drive the screen, so they keep their order with computer actions
+    assert ("display", True) in BashTool().resources(command="xdotool click 1")
+
+
+def _collection(log):
+    return ToolCollection(
+        _SlowTool("computer", ComputerTool(), log),
+        _SlowTool("str_replace_editor", EditTool(), log),
+        _SlowTool("bash", BashTool(), log),
+    )
+
+
+async def test_views_overlap_but_display_keeps_order():
+    log = []
+    dispatcher = ToolDispatcher(_collection(log), spawn=asyncio.ensure_future)
+    calls = [
+        ("computer", {"action": "left_click"}),
+        ("str_replace_editor", {"command": "view", "path": "/a"}),
+        ("str_replace_editor", {"command": "view", "path": "/b"}),
+        ("computer", {"action": "screenshot"}),
+    ]
+    start = time.monotonic()
+    results = await asyncio.gather(*(dispatcher.submit(*call) for call in calls))
+    elapsed = time.monotonic() - start
+
+    assert [r.output for r in results] == [f"{name} {args}" for name, args in calls]
+    # two display steps in sequence; the views ride along with the first
+    assert 0.35 < elapsed < 0.6
+    click, screenshot = [entry for entry in log if entry[0] == "computer"]
+    assert click[1] == {"action": "left_click"}
+    assert screenshot[2] >= click[3]
+
+
+async def test_writes_wait_for_reads_of_the_same_path():
+    log = []
+    dispatcher = ToolDispatcher(_collection(log), spawn=asyncio.ensure_future)
+    view = dispatcher.submit("str_replace_editor", {"command": "view", "path": "/a/x"})
+    write = dispatcher.submit(
+        "str_replace_editor", {"command": "str_replace", "path": "/a/x", "old_str": "1"}
+    )
+    bash = dispatcher.submit("bash", {"command": "cat /a/x"})
+    await asyncio.gather(view, write, bash)
+    assert [entry[1].get("command") for entry in log] == ["view", "str_replace", "cat /a/x"]
+    assert log[1][2] >= log[0][3] and log[2][2] >= log[1][3]
+
+
+def test_executor_runs_independent_calls_concurrently():
+    log = []
+    factories = {
+        "computer": lambda: _SlowTool("computer", ComputerTool(), log),
+        "str_replace_editor": lambda: _SlowTool("str_replace_editor", EditTool(), log),
+    }
+    event_loop = BackgroundEventLoop()
+    executor = AnthropicExecutor(
+        output_callback=mock.Mock(),
+        tool_output_callback=mock.Mock(),
+        tool_registry=ToolRegistry(factories=factories),
+        event_loop=event_loop,
+    )
+    response = BetaMessage(
+        id="msg",
+        type="message",
+        role="assistant",
+        model="stub",
+        stop_reason="tool_use",
+        usage={"input_tokens": 1, "output_tokens": 1},
+        content=[
+            BetaTextBlock(type="text", text="Looking."),
+            BetaToolUseBlock(type="tool_use", id="t1", name="str_replace_editor", input={"command": "view", "path": "/a"}),
+            BetaToolUseBlock(type="tool_use", id="t2", name="computer", input={"action": "screenshot"}),
+            BetaToolUseBlock(type="tool_use", id="t3", name="str_replace_editor", input={"command": "view", "path": "/b"}),
+        ],
+    )
+    try:
+        start = time.monotonic()
+        *_, (_, tool_results) = executor(response, [])
+        elapsed = time.monotonic() - start
+    finally:
+        event_loop.stop()
+
+    assert [r["tool_use_id"] for r in tool_results] == ["t1", "t2", "t3"]
+    assert elapsed < 0.4
+
+
+def test_executor_forgets_a_response_whose_results_were_not_all_collected():
+    log = []
+    factories = {"computer": lambda: _SlowTool("computer", ComputerTool(), log)}
+    event_loop = BackgroundEventLoop()
+    executor = AnthropicExecutor(
+        output_callback=mock.Mock(side_effect=RuntimeError("render failed")),
+        tool_output_callback=mock.Mock(),
+        tool_registry=ToolRegistry(factories=factories),
+        event_loop=event_loop,
+    )
+    response = BetaMessage(
+        id="msg",
+        type="message",
+        role="assistant",
+        model="stub",
+        stop_reason="tool_use",
+        usage={"input_tokens": 1, "output_tokens": 1},
+        content=[
+            BetaToolUseBlock(type="tool_use", id="t1", name="computer", input={"action": "screenshot"}),
+        ],
+    )
+    try:
+        with pytest.raises(RuntimeError):
+            list(executor(response, []))
+        # the next response's computer calls do not wait on this one's
+        assert executor.dispatcher._submitted == []
+    finally:
+        executor.cancel()
+        event_loop.stop()
+
+
+def test_executor_keeps_results_of_a_response_that_renders_no_new_rows():
+    log = []
+    factories = {"computer": lambda: _SlowTool("computer", ComputerTool(), log, delay=0)}
+    event_loop = BackgroundEventLoop()
+    executor = AnthropicExecutor(
+        output_callback=mock.Mock(),
+        tool_output_callback=mock.Mock(),
+        tool_registry=ToolRegistry(factories=factories),
+        event_loop=event_loop,
+    )
+    response = BetaMessage(
+        id="msg",
+        type="message",
+        role="assistant",
+        model="stub",
+        stop_reason="tool_use",
+        usage={"input_tokens": 1, "output_tokens": 1},
+        content=[
+            BetaToolUseBlock(type="tool_use", id="t1", name="computer", input={"action": "screenshot"}),
+        ],
+    )
+    messages = [{"role": "user", "content": "go"}]
+    try:
+        list(executor(response, messages))
+        # the same response again: its message is a duplicate, so nothing new is shown
+        assert list(executor(response, messages)) == []
+    finally:
+        event_loop.stop()
+    assert [r["tool_use_id"] for r in executor.tool_results] == ["t1"]
+    assert len(log) == 2
@@ -8,7 +8,7 @@ from computer_use_demo.tools.edit import EditTool
 
 
 @pytest.mark.asyncio
-async def test_view_command():
+async def test_view_command(tmp_path):
     edit_tool = EditTool()
 
     # Test viewing a file that exists
@@ -22,15 +22,13 @@ async def test_view_command():
         assert "File content" in result.output
 
     # Test viewing a directory
-    with patch("pathlib.Path.exists", return_value=True), patch(
-        "pathlib.Path.is_dir", return_value=True
-    ), patch("computer_use_demo.tools.edit.run") as mock_run:
-        mock_run.return_value = (None, "file1.txt\nfile2.txt", None)
-        result = await edit_tool(command="view", path="/test/dir")
-        assert isinstance(result, CLIResult)
-        assert result.output
-        assert "file1.txt" in result.output
-        assert "file2.txt" in result.output
+    (tmp_path / "file1.txt").write_text("")
+    (tmp_path / "file2.txt").write_text("")
+    result = await edit_tool(command="view", path=str(tmp_path))
+    assert isinstance(result, CLIResult)
+    assert result.output
+    assert "file1.txt" in result.output
+    assert "file2.txt" in result.output
 
     # Test viewing a file with a specific range
     with patch("pathlib.Path.exists", return_value=True), patch(
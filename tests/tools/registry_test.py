@@ -0,0 +1,80 @@
+from unittest import mock
+
+import pytest
+
+from computer_use_demo.tools.bash import BashTool
+from computer_use_demo.tools.computer import ComputerTool
+from computer_use_demo.tools.edit import EditTool
+from computer_use_demo.tools.registry import ToolRegistry
+from computer_use_demo.tools.search import SearchTool
+
+
+def test_tools_are_created_lazily_once():
+    factory = mock.Mock(side_effect=BashTool)
+    registry = ToolRegistry(factories={"bash": factory})
+    assert factory.call_count == 0
+
+    assert registry.get("bash") is registry.get("bash")
+    assert factory.call_count == 1
+    assert registry.get("missing") is None
+
+
+def test_default_tools_and_cached_params(tmp_path):
+    registry = ToolRegistry(selected_screen=1)
+    params = registry.to_params()
+    assert [p["name"] for p in params] == ["computer", "bash", "str_replace_editor"]
+    assert registry.to_params() is params
+    assert isinstance(registry.get("computer"), ComputerTool)
+    assert registry.get("computer").selected_screen == 1
+
+    registry = ToolRegistry(workspace_root=str(tmp_path))
+    assert isinstance(registry.get("search"), SearchTool)
+
+
+def test_switching_screens_reaches_the_computer_tool():
+    registry = ToolRegistry()
+    params = registry.to_params()
+    registry.selected_screen = 1
+    assert registry.get("computer").selected_screen == 1
+    assert registry.to_params() is not params
+
+
+@pytest.mark.asyncio
+async def test_close_stops_the_shell():
+    registry = ToolRegistry()
+    assert registry.pids() == []
+    await registry.get("bash")(command="true")
+    bash = registry.get("bash")
+    assert registry.pids() == [bash.pid]
+    registry.close()
+    assert bash.pid is None
+    assert registry.get("bash") is not bash
+
+
+def test_collection_shares_instances(tmp_path):
+    registry = ToolRegistry(workspace_root=str(tmp_path))
+    collection = registry.collection
+    assert registry.collection is collection
+    assert collection.tools["str_replace_editor"] is registry.get("str_replace_editor")
+    assert isinstance(collection.tools["str_replace_editor"], EditTool)
+    assert collection.watcher is registry.watcher is not None
+    registry.close()
+
+
+@pytest.mark.asyncio
+async def test_search_index_follows_watched_changes(tmp_path):
+    registry = ToolRegistry(workspace_root=str(tmp_path))
+    collection = registry.collection
+    registry.get("search").index.refresh_interval = 3600
+    assert (await collection.run(name="search", tool_input={"pattern": "fresh_marker"}))
+
+    target = tmp_path / "new.py"
+    result = await collection.run(
+        name="str_replace_editor",
+        tool_input={"command": "create", "path": str(target), "file_text": "fresh_marker\n"},
+    )
+    assert "created: new.py" in result.system
+
+    result = await collection.run(name="search", tool_input={"pattern": "fresh_marker"})
+    assert result.output == f"{target}:1:fresh_marker"
+    registry.close()
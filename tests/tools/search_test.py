@@ -0,0 +1,120 @@
+import os
+
+import pytest
+
+from computer_use_demo.tools.base import CLIResult, ToolError
+from computer_use_demo.tools.index import TrigramIndex, _required_literals
+from computer_use_demo.tools.search import SearchTool
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "alpha.py").write_text("def alpha():\n    return 'needle'\n")
+    (tmp_path / "pkg" / "beta.py").write_text("def beta():\n    return 'hay'\n")
+    (tmp_path / "blob.bin").write_bytes(b"needle\0\0\0")
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / "HEAD").write_text("needle")
+    return tmp_path
+
+
+def test_index_search_literal(workspace):
+    index = TrigramIndex(workspace)
+    matches = index.search("needle")
+    assert [(m.path, m.line_number) for m in matches] == [
+        (str(workspace / "pkg" / "alpha.py"), 2)
+    ]
+    assert len(index) == 2  # binary and hidden files are skipped
+
+
+def test_index_search_case_and_scope(workspace):
+    index = TrigramIndex(workspace)
+    assert index.search("NEEDLE") == []
+    assert len(index.search("NEEDLE", case_sensitive=False)) == 1
+    assert index.search("def", path=str(workspace / "pkg" / "beta.py"))[0].line == (
+        "def beta():"
+    )
+
+
+def test_index_search_regex(workspace):
+    index = TrigramIndex(workspace)
+    matches = index.search(r"def (alpha|beta)\(\)", regex=True)
+    assert len(matches) == 2
+    assert _required_literals(r"def (alpha|beta)\(\)") == ["def ", "()"]
+
+
+def test_index_refresh_picks_up_changes(workspace):
+    index = TrigramIndex(workspace, refresh_interval=0)
+    assert index.search("haystack") == []
+
+    target = workspace / "pkg" / "beta.py"
+    target.write_text("haystack = 1\n")
+    stat = os.stat(target)
+    os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    (workspace / "pkg" / "alpha.py").unlink()
+
+    assert [m.line for m in index.search("haystack")] == ["haystack = 1"]
+    assert index.search("needle") == []
+
+
+def test_index_update_paths(workspace):
+    index = TrigramIndex(workspace, refresh_interval=3600)
+    index.refresh()
+    new_file = workspace / "pkg" / "gamma.py"
+    new_file.write_text("gamma_marker\n")
+    assert index.search("gamma_marker") == []
+    index.update_paths([str(new_file)])
+    assert len(index.search("gamma_marker")) == 1
+
+
+def test_skipped_files_are_remembered_until_they_change(workspace, monkeypatch):
+    (workspace / "big.txt").write_text("needle\n" * 100)
+    index = TrigramIndex(workspace, max_file_size=100, refresh_interval=0)
+    index.refresh()
+    assert index.skipped() == [str(workspace / "big.txt"), str(workspace / "blob.bin")]
+    assert index.skipped(reason="too large") == [str(workspace / "big.txt")]
+
+    reindexed = []
+    reindex = index._reindex
+    monkeypatch.setattr(
+        index, "_reindex", lambda path, stat: reindexed.append(path) or reindex(path, stat)
+    )
+    index.refresh()
+    assert reindexed == []
+
+    (workspace / "big.txt").write_text("needle\n")
+    index.refresh()
+    assert reindexed == [str(workspace / "big.txt")]
+    assert index.skipped(reason="too large") == []
+    (workspace / "blob.bin").unlink()
+    index.refresh()
+    assert index.skipped() == []
+
+
+@pytest.mark.asyncio
+async def test_search_tool_reports_files_too_large_to_search(workspace):
+    (workspace / "pkg" / "big.py").write_text("needle = 1\n" * 100)
+    tool = SearchTool(workspace, TrigramIndex(workspace, max_file_size=100))
+    result = await tool(pattern="needle", path=str(workspace / "pkg"))
+    assert result.output.splitlines() == [
+        f"{workspace / 'pkg' / 'alpha.py'}:2:    return 'needle'",
+        f"[1 file(s) over 100 bytes were not searched: {workspace / 'pkg' / 'big.py'}]",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_search_tool(workspace):
+    tool = SearchTool(workspace)
+    assert tool.to_params()["name"] == "search"
+
+    result = await tool(pattern="needle")
+    assert isinstance(result, CLIResult)
+    assert result.output == f"{workspace / 'pkg' / 'alpha.py'}:2:    return 'needle'"
+
+    result = await tool(pattern="missing")
+    assert "No matches found" in result.output
+
+    with pytest.raises(ToolError, match="Invalid regular expression"):
+        await tool(pattern="(", regex=True)
+    with pytest.raises(ToolError, match="not an absolute path"):
+        await tool(pattern="needle", path="pkg")
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from computer_use_demo.tools.walk import DirectoryWalker
+
+
+@pytest.fixture
+def tree(tmp_path):
+    (tmp_path / "a" / "b" / "c").mkdir(parents=True)
+    (tmp_path / "a" / "b" / "c" / "deep.txt").write_text("")
+    (tmp_path / "a" / "one.txt").write_text("")
+    (tmp_path / "z.txt").write_text("")
+    (tmp_path / ".hidden").mkdir()
+    (tmp_path / ".hidden" / "secret.txt").write_text("")
+    (tmp_path / "node_modules").mkdir()
+    return tmp_path
+
+
+def test_walk_depth_and_hidden(tree):
+    listing = DirectoryWalker().walk(tree)
+    assert listing.paths == (
+        str(tree / "a"),
+        str(tree / "a" / "b"),
+        str(tree / "a" / "one.txt"),
+        str(tree / "node_modules"),
+        str(tree / "z.txt"),
+    )
+    assert not listing.truncated
+    assert listing.render().splitlines()[0] == str(tree)
+
+
+def test_walk_ignore_patterns(tree):
+    listing = DirectoryWalker(ignore=["node_modules", "*.txt"]).walk(tree, max_depth=3)
+    assert listing.paths == (
+        str(tree / "a"),
+        str(tree / "a" / "b"),
+        str(tree / "a" / "b" / "c"),
+    )
+
+
+def test_walk_entry_cap(tree):
+    listing = DirectoryWalker(max_entries=2).walk(tree)
+    # breadth-first: the cap keeps top-level entries before descending
+    assert listing.paths == (str(tree / "a"), str(tree / "node_modules"))
+    assert listing.omitted_entries == 3
+    assert listing.unexpanded_dirs == 0
+    assert "[3 more entries omitted, 0 directories not expanded]" in listing.render()
+
+    listing = DirectoryWalker(max_entries=1).walk(tree)
+    assert listing.paths == (str(tree / "a"),)
+    assert listing.omitted_entries == 4
+    assert listing.unexpanded_dirs == 1
+
+
+def test_walk_cache_invalidated_by_mtime(tree):
+    walker = DirectoryWalker()
+    first = walker.walk(tree)
+    assert walker.walk(tree) is first
+
+    (tree / "a" / "two.txt").write_text("")
+    # force a distinct mtime on filesystems with coarse timestamps
+    stat = os.stat(tree / "a")
+    os.utime(tree / "a", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    second = walker.walk(tree)
+    assert second is not first
+    assert str(tree / "a" / "two.txt") in second.paths
+
+
+def test_walk_missing_directory(tmp_path):
+    listing = DirectoryWalker().walk(tmp_path / "missing")
+    assert listing.paths == ()
+    assert listing.errors
@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from computer_use_demo.tools.base import ToolResult
+from computer_use_demo.tools.collection import ToolCollection
+from computer_use_demo.tools.watch import ChangeSet, WorkspaceWatcher
+
+
+@pytest.fixture(params=[True, False], ids=["inotify", "polling"])
+def watcher(request, tmp_path):
+    (tmp_path / "existing.txt").write_text("old")
+    (tmp_path / "doomed.txt").write_text("bye")
+    watcher = WorkspaceWatcher(tmp_path, use_inotify=request.param)
+    yield watcher
+    watcher.close()
+
+
+def test_watcher_collects_changes(watcher, tmp_path):
+    watcher.begin()
+    (tmp_path / "new.txt").write_text("hi")
+    (tmp_path / "existing.txt").write_text("new contents")
+    (tmp_path / "doomed.txt").unlink()
+    (tmp_path / "build").mkdir()
+    (tmp_path / "build" / "out.o").write_text("")
+    (tmp_path / ".cache").mkdir()
+    changes = watcher.collect()
+
+    assert changes.created == {
+        str(tmp_path / "new.txt"),
+        str(tmp_path / "build"),
+        str(tmp_path / "build" / "out.o"),
+    }
+    assert changes.modified == {str(tmp_path / "existing.txt")}
+    assert changes.deleted == {str(tmp_path / "doomed.txt")}
+
+    watcher.begin()
+    assert not watcher.collect()
+
+
+def test_watcher_ignores_changes_between_calls(watcher, tmp_path):
+    (tmp_path / "before.txt").write_text("")
+    watcher.begin()
+    assert not watcher.collect()
+
+
+def test_change_summary_aggregates(tmp_path):
+    changes = ChangeSet(root=str(tmp_path))
+    changes.record_created(str(tmp_path / "a.py"))
+    changes.record_deleted(str(tmp_path / "b.py"))
+    assert changes.summary() == (
+        f"Filesystem changes under {tmp_path}:\n  created: a.py\n  deleted: b.py"
+    )
+
+    for i in range(30):
+        changes.record_created(str(tmp_path / "build" / f"{i}.o"))
+    summary = changes.summary(max_paths=5)
+    assert "created 31 files: build/ (30), ./ (1)" in summary
+    assert "deleted 1 files: ./ (1)" in summary
+
+
+def test_change_set_coalesces_events(tmp_path):
+    changes = ChangeSet(root=str(tmp_path))
+    changes.record_created("/x")
+    changes.record_modified("/x")
+    assert changes.created == {"/x"} and not changes.modified
+    changes.record_deleted("/x")
+    assert not changes
+    changes.record_deleted("/y")
+    changes.record_created("/y")
+    assert changes.modified == {"/y"} and not changes.deleted
+
+
+class _TouchTool:
+    def __init__(self, path):
+        self.path = path
+
+    async def __call__(self, **kwargs):
+        self.path.write_text("touched")
+        return ToolResult(output="done")
+
+    def to_params(self):
+        return {"name": "touch"}
+
+
+@pytest.mark.asyncio
+async def test_tool_collection_attaches_changes(watcher, tmp_path):
+    collection = ToolCollection(_TouchTool(tmp_path / "touched.txt"), watcher=watcher)
+    result = await collection.run(name="touch", tool_input={})
+    assert result.output == "done"
+    assert result.system == f"Filesystem changes under {tmp_path}:\n  created: touched.txt"
+
+
+class _HangingTool:
+    async def __call__(self, **kwargs):
+        await asyncio.sleep(10)
+
+    def to_params(self):
+        return {"name": "hang"}
+
+
+@pytest.mark.asyncio
+async def test_a_cancelled_call_does_not_leave_the_window_open(watcher, tmp_path):
+    collection = ToolCollection(
+        _HangingTool(), _TouchTool(tmp_path / "touched.txt"), watcher=watcher
+    )
+    call = asyncio.ensure_future(collection.run(name="hang", tool_input={}))
+    await asyncio.sleep(0.1)
+    call.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await call
+    assert collection._running == 0
+
+    # made between calls, so not the next call's doing
+    (tmp_path / "between.txt").write_text("x")
+    result = await collection.run(name="touch", tool_input={})
+    assert result.system == f"Filesystem changes under {tmp_path}:\n  created: touched.txt"